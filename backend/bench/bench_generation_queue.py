@@ -0,0 +1,144 @@
+"""Measure enqueue latency and throughput of the generation scheduler.
+
+Several simulated clients each submit a burst of generation requests.
+"direct" sends one enqueue_batch per request as soon as it arrives, like
+/api/generate used to; "scheduler" goes through GenerationScheduler, which
+merges compatible requests and caps outstanding batches. Latency is from
+submission until the request's batch was accepted by InvokeAI.
+
+Usage: python -m bench.bench_generation_queue [--clients 8] [--requests 10] [--quantity 2]
+"""
+from generation_queue import GenerationScheduler, GenerationJob
+from generation_tracker import GenerationTracker
+from invokeai_client import InvokeAIClient
+from bench import fake_invokeai
+import argparse
+import asyncio
+import httpx
+import statistics
+import time
+
+def _batch(items):
+    seeds = [seed for seed, _ in items]
+    prompts = [prompt for _, prompt in items]
+    return {
+        "prepend": False,
+        "batch": {
+            "graph": {"id": "bench", "nodes": {}, "edges": []},
+            "runs": 1,
+            "data": [[
+                {"node_path": "noise", "field_name": "seed", "items": seeds},
+                {"node_path": "pos_cond", "field_name": "prompt", "items": prompts},
+            ]],
+        },
+    }
+
+def _summary(label, latencies, elapsed, requests, batches, images):
+    latencies = sorted(latencies)
+    return {
+        "mode": label,
+        "requests": requests,
+        "enqueue_batch_calls": batches,
+        "images_per_batch": round(images / batches, 1),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(requests / elapsed, 1),
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "latency_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        "latency_max_ms": round(latencies[-1] * 1000, 1),
+    }
+
+async def _direct(client: InvokeAIClient, args) -> dict:
+    latencies = []
+
+    async def submit(client_index, request_index):
+        items = [(request_index * 100 + i, f"client {client_index}") for i in range(args.quantity)]
+        start = time.perf_counter()
+        response = await client.post("/api/v1/queue/default/enqueue_batch", json=_batch(items))
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        submit(c, r) for c in range(args.clients) for r in range(args.requests)
+    ))
+    elapsed = time.perf_counter() - start
+    total = args.clients * args.requests
+    return _summary("direct", latencies, elapsed, total, total, total * args.quantity)
+
+async def _scheduled(client: InvokeAIClient, args) -> dict:
+    async def enqueue(params, items):
+        response = await client.post("/api/v1/queue/default/enqueue_batch", json=_batch(items))
+        response.raise_for_status()
+        return response.json()
+
+    tracker = GenerationTracker(client, poll_interval=args.poll_interval)
+    scheduler = GenerationScheduler(
+        tracker,
+        enqueue,
+        max_outstanding=args.max_outstanding,
+        max_batch_items=args.max_batch_items,
+        batch_window=args.batch_window,
+        max_queued=args.clients * args.requests,
+        max_queued_per_client=args.requests
+    )
+    await tracker.start()
+    await scheduler.start()
+    try:
+        start = time.perf_counter()
+        jobs = [
+            scheduler.submit(GenerationJob(
+                client_id=f"client-{c}",
+                key="sdxl",
+                params={},
+                items=[(r * 100 + i, f"client {c}") for i in range(args.quantity)]
+            ))
+            for r in range(args.requests) for c in range(args.clients)
+        ]
+        while any(job.dispatched_at is None and job.error is None for job in jobs):
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - start
+    finally:
+        await scheduler.stop()
+        await tracker.stop()
+    latencies = [job.dispatched_at - job.submitted_at for job in jobs]
+    return _summary(
+        "scheduler", latencies, elapsed, len(jobs),
+        scheduler.batches_sent, len(jobs) * args.quantity
+    )
+
+async def _run(args) -> list:
+    client = InvokeAIClient(
+        args.base_url,
+        timeout=httpx.Timeout(30.0),
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=16)
+    )
+    await client.start()
+    try:
+        results = []
+        for runner in (_direct, _scheduled):
+            fake_invokeai.app.state.enqueued = []
+            results.append(await runner(client, args))
+        return results
+    finally:
+        await client.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=10, help="requests per client")
+    parser.add_argument("--quantity", type=int, default=2, help="images per request")
+    parser.add_argument("--max-outstanding", type=int, default=2)
+    parser.add_argument("--max-batch-items", type=int, default=32)
+    parser.add_argument("--batch-window", type=float, default=0.05)
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--seconds-per-image", type=float, default=0.002,
+                        help="simulated GPU time per image in the fake InvokeAI")
+    args = parser.parse_args()
+
+    fake_invokeai.SECONDS_PER_IMAGE = args.seconds_per_image
+    args.base_url = fake_invokeai.serve_in_thread()
+    for result in asyncio.run(_run(args)):
+        print(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Compare a fresh httpx client per call against the shared pooled client.
+
+Usage: python -m bench.bench_invokeai_client [--requests 500] [--concurrency 50]
+"""
+from invokeai_client import InvokeAIClient
+from bench.fake_invokeai import serve_in_thread
+import argparse
+import asyncio
+import httpx
+import time
+
+async def _per_call(base_url: str, names, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(name):
+        async with semaphore:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(f"{base_url}/api/v1/images/i/{name}/metadata")
+                response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(fetch(name) for name in names))
+    return time.perf_counter() - start
+
+async def _pooled(base_url: str, names, concurrency: int) -> float:
+    client = InvokeAIClient(
+        base_url,
+        timeout=httpx.Timeout(10.0),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    )
+    await client.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(name):
+        async with semaphore:
+            response = await client.get(f"/api/v1/images/i/{name}/metadata")
+            response.raise_for_status()
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch(name) for name in names))
+        return time.perf_counter() - start
+    finally:
+        await client.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    base_url = serve_in_thread()
+    names = [f"image_{i}.png" for i in range(args.requests)]
+    for label, runner in (("client per call", _per_call), ("shared pooled client", _pooled)):
+        elapsed = asyncio.run(runner(base_url, names, args.concurrency))
+        print(f"{label:>22}: {args.requests / elapsed:8.1f} req/s ({elapsed:.2f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compare full-size photo serving: Starlette's FileResponse vs FileRangeResponse.
+
+Serves a directory of random files from an in-process uvicorn server and
+downloads them with increasing concurrency, reporting MB/s and requests/s.
+
+Usage: python -m bench.bench_photo_serving [--files 32] [--size-mb 4] [--concurrency 1 16 64]
+"""
+from fastapi import FastAPI
+from fastapi.responses import FileResponse
+from file_responses import FileRangeResponse
+from bench.servers import serve_in_thread
+from pathlib import Path
+import argparse
+import asyncio
+import httpx
+import os
+import tempfile
+import time
+
+def _app(photo_dir: Path) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/file_response/{name}")
+    async def file_response(name: str):
+        return FileResponse(photo_dir / name)
+
+    @app.get("/range_response/{name}")
+    async def range_response(name: str):
+        path = photo_dir / name
+        return FileRangeResponse(path, path.stat().st_size)
+
+    return app
+
+async def _download(base_url: str, route: str, names, concurrency: int, rounds: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def fetch(name):
+            async with semaphore:
+                received = 0
+                async with client.stream("GET", f"/{route}/{name}") as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_raw():
+                        received += len(chunk)
+                return received
+
+        start = time.perf_counter()
+        sizes = await asyncio.gather(*(fetch(name) for _ in range(rounds) for name in names))
+        return sum(sizes), len(sizes), time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=32)
+    parser.add_argument("--size-mb", type=float, default=4)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        photo_dir = Path(tmp)
+        names = []
+        for i in range(args.files):
+            name = f"photo_{i}.png"
+            (photo_dir / name).write_bytes(os.urandom(int(args.size_mb * 2**20)))
+            names.append(name)
+        base_url = serve_in_thread(_app(photo_dir))
+
+        for concurrency in args.concurrency:
+            for route in ("file_response", "range_response"):
+                nbytes, requests, elapsed = asyncio.run(
+                    _download(base_url, route, names, concurrency, args.rounds)
+                )
+                print(
+                    f"{route:>15} c={concurrency:<3}: {nbytes / 2**20 / elapsed:8.1f} MB/s "
+                    f"{requests / elapsed:7.1f} req/s"
+                )
+
+if __name__ == "__main__":
+    main()
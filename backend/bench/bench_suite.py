@@ -0,0 +1,502 @@
+"""End-to-end benchmark of the gallery backend against synthetic photo libraries.
+
+For each requested library size a directory of PNGs is generated (kept
+under --data-dir and reused by later runs with the same settings). The app
+is then started in its own process under uvicorn, with a fresh thumbnail
+cache and databases, and pointed at bench/fake_invokeai.py running in a
+second process. This process drives the load and measures:
+
+  startup     time until the app answers, i.e. the initial index build
+  listing     /api/photos in full, paged and revalidated; /api/photos/details
+  thumbnails  cold (rendered) and warm (cached) throughput and latency
+  metadata    /api/metadata/batch and single lookups, cold and warm
+  generate    /api/generate response time and time until the job's batch
+              is accepted by InvokeAI
+  memory      resident set size of the app process after each phase, and
+              of it together with its workers and encoder processes
+
+Results of all sizes are written as one JSON file named after the current
+commit; `compare` prints the relative change of every metric between two
+such files.
+
+Usage:
+  python -m bench.bench_suite run [--photos 1000 10000] [--workers N] [--output results.json]
+  python -m bench.bench_suite compare old.json new.json
+"""
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from bench.servers import free_port
+import argparse
+import asyncio
+import datetime
+import httpx
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_VERSION = 1
+TEMPLATE_VARIANTS = 16
+
+def _commit() -> str:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+# Synthetic libraries
+
+def _templates(edge: int, seed: int) -> List[bytes]:
+    """Distinct smooth PNGs; realistic to decode and resize, small on disk."""
+    from PIL import Image
+    rng = random.Random(seed)
+    templates = []
+    for _ in range(TEMPLATE_VARIANTS):
+        small = Image.frombytes("RGB", (8, 8), rng.randbytes(8 * 8 * 3))
+        img = small.resize((edge, edge), Image.Resampling.BICUBIC).quantize(64).convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG")
+        templates.append(buffer.getvalue())
+    return templates
+
+def _with_metadata(png: bytes, index: int) -> bytes:
+    """Same image with InvokeAI-style metadata embedded as a PNG text chunk."""
+    from PIL import Image, PngImagePlugin
+    info = PngImagePlugin.PngInfo()
+    info.add_text("invokeai_metadata", json.dumps({
+        "positive_prompt": f"synthetic image {index}",
+        "negative_prompt": "",
+        "width": 1024,
+        "height": 1024,
+        "seed": index,
+        "steps": 20,
+        "cfg_scale": 7.5,
+        "scheduler": "dpmpp_2m",
+        "model": {"key": "fake-model", "name": "fake-sdxl", "base": "sdxl", "type": "main"},
+    }))
+    with Image.open(io.BytesIO(png)) as img:
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG", pnginfo=info)
+    return buffer.getvalue()
+
+def make_library(data_dir: Path, count: int, edge: int, embedded: float, seed: int = 1234) -> Path:
+    """Create, or reuse, a directory of `count` PNGs with deterministic names and mtimes.
+
+    Every `1 / embedded`-th photo carries embedded generation metadata; the
+    others have to be looked up in (fake) InvokeAI.
+    """
+    config = {"count": count, "edge": edge, "embedded": embedded, "seed": seed}
+    photo_dir = data_dir / f"photos-{count}-{edge}-{int(embedded * 100)}-{seed}"
+    marker = data_dir / f"{photo_dir.name}.json"
+    if marker.exists() and json.loads(marker.read_text()) == config:
+        return photo_dir
+    shutil.rmtree(photo_dir, ignore_errors=True)
+    photo_dir.mkdir(parents=True)
+
+    plain = _templates(edge, seed)
+    tagged = [_with_metadata(png, i) for i, png in enumerate(plain)]
+    embedded_every = round(1 / embedded) if embedded > 0 else 0
+    base_mtime = 1_700_000_000
+    started = time.perf_counter()
+    for i in range(count):
+        use_tagged = embedded_every and i % embedded_every == 0
+        path = photo_dir / f"synthetic_{i:06d}.png"
+        path.write_bytes((tagged if use_tagged else plain)[i % TEMPLATE_VARIANTS])
+        os.utime(path, (base_mtime + i, base_mtime + i))
+    marker.write_text(json.dumps(config))
+    print(f"Generated {count} photos in {photo_dir} ({time.perf_counter() - started:.1f}s)", file=sys.stderr)
+    return photo_dir
+
+# Processes under test
+
+def _rss_mb(pid: int) -> Dict[str, Optional[float]]:
+    """Current and peak resident set size of a process; Linux only."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {"rss_mb": None, "peak_rss_mb": None}
+    def mb(key):
+        return round(int(fields[key].split()[0]) / 1024, 1) if key in fields else None
+    return {"rss_mb": mb("VmRSS"), "peak_rss_mb": mb("VmHWM"), "tree_rss_mb": _tree_rss_mb(pid)}
+
+def _tree_rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process and all its descendants: worker processes and pools."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat") as f:
+                # The command name may contain spaces; fields resume after its ")"
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry.name))
+    total_kb = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, ()))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1) if total_kb else None
+
+def _wait_until_up(url: str, process: subprocess.Popen, timeout: float) -> float:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process for {url} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.02)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def _serve(args) -> None:
+    """Child process: run the real app on a photo library with a fresh work directory."""
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.chdir(args.work_dir)
+    # settings.py resolves "photos" relative to the working directory
+    os.symlink(args.photo_dir, "photos")
+    shutil.copy(BACKEND_DIR / "ip_whitelist.txt", "ip_whitelist.txt")
+    os.environ.update({
+        "GALLERY_INVOKEAI_URL": args.invokeai_url,
+        "GALLERY_PREWARM_ON_STARTUP": "0",
+        # Background feature extraction would compete with the thumbnail measurements
+        "GALLERY_FEATURE_WORKERS": "0",
+    })
+    if args.thumbnail_workers:
+        os.environ["GALLERY_THUMBNAIL_WORKERS"] = str(args.thumbnail_workers)
+    import uvicorn
+    uvicorn.run(
+        "main:create_app", factory=True, workers=args.workers,
+        host="127.0.0.1", port=args.port, log_level="warning"
+    )
+
+# Measurements
+
+def _stats(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "per_second": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+async def _run_many(calls: List[Callable[[], Awaitable[bool]]], concurrency: int) -> Dict[str, Any]:
+    """Run calls with bounded concurrency; each returns whether it succeeded."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def timed(call):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            ok = await call()
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(call) for call in calls))
+    return _stats(latencies, time.perf_counter() - started, errors)
+
+def _get(client: httpx.AsyncClient, url: str, **kwargs) -> Callable[[], Awaitable[bool]]:
+    async def call():
+        response = await client.get(url, **kwargs)
+        return response.status_code in (200, 304)
+    return call
+
+async def _listing(client: httpx.AsyncClient, args) -> Tuple[Dict[str, Any], List[str]]:
+    full = await client.get("/api/photos")
+    full.raise_for_status()
+    names = full.json()
+    etag = full.headers["etag"]
+
+    result = {
+        "full": await _run_many([_get(client, "/api/photos") for _ in range(args.repeat)], 1),
+        "full_not_modified": await _run_many(
+            [_get(client, "/api/photos", headers={"If-None-Match": etag}) for _ in range(args.repeat)], 1
+        ),
+        "page_100_concurrent": await _run_many(
+            [_get(client, "/api/photos", params={"limit": 100}) for _ in range(args.repeat * 10)],
+            args.concurrency
+        ),
+        "details_page_100": await _run_many(
+            [_get(client, "/api/photos/details", params={"limit": 100}) for _ in range(args.repeat)], 1
+        ),
+    }
+
+    # Walk the first pages by cursor, as an infinite-scrolling client would
+    latencies = []
+    cursor = None
+    started = time.perf_counter()
+    for _ in range(min(50, len(names) // 100 or 1)):
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        page_started = time.perf_counter()
+        response = await client.get("/api/photos", params=params)
+        latencies.append(time.perf_counter() - page_started)
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    result["cursor_walk_100"] = _stats(latencies, time.perf_counter() - started)
+    return result, names
+
+async def _thumbnails(client: httpx.AsyncClient, names: List[str], args) -> Dict[str, Any]:
+    sample = names[:args.thumbnails]
+    calls = lambda: [_get(client, f"/photos/thumbnail/{name}") for name in sample]
+    return {
+        "cold": await _run_many(calls(), args.concurrency),
+        "warm": await _run_many(calls(), args.concurrency),
+    }
+
+async def _metadata(client: httpx.AsyncClient, names: List[str], args) -> Dict[str, Any]:
+    batch_names = names[:args.metadata]
+    single_names = names[args.metadata:args.metadata * 2] or batch_names
+
+    def batch_calls():
+        async def post(chunk):
+            response = await client.post("/api/metadata/batch", json={"image_names": chunk})
+            return response.status_code == 200 and not response.json()["errors"]
+        chunks = [batch_names[i:i + 100] for i in range(0, len(batch_names), 100)]
+        return [lambda chunk=chunk: post(chunk) for chunk in chunks]
+
+    single_calls = lambda: [_get(client, f"/api/metadata/{name}") for name in single_names]
+    return {
+        "batch_100_cold": await _run_many(batch_calls(), 4),
+        "batch_100_warm": await _run_many(batch_calls(), 4),
+        "single_cold": await _run_many(single_calls(), args.concurrency),
+        "single_warm": await _run_many(single_calls(), args.concurrency),
+    }
+
+async def _generate(client: httpx.AsyncClient, names: List[str], args) -> Dict[str, Any]:
+    response_latencies: List[float] = []
+    enqueue_latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def submit(i):
+        nonlocal errors
+        body = {
+            "image_name": names[i % len(names)],
+            "additional_prompt": f"variation {i}",
+            "quantity": 1,
+            "metadata": {"positive_prompt": "synthetic", "model": {"key": "fake-model", "base": "sdxl"}},
+        }
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/api/generate", json=body)
+            response_latencies.append(time.perf_counter() - started)
+        if response.status_code != 202:
+            errors += 1
+            return
+        job_id = response.json()["job_id"]
+        deadline = started + args.enqueue_timeout
+        while time.perf_counter() < deadline:
+            status = (await client.get(f"/api/generate/{job_id}")).json()
+            if status.get("batch_id"):
+                enqueue_latencies.append(time.perf_counter() - started)
+                return
+            if status.get("status") == "failed":
+                break
+            await asyncio.sleep(0.01)
+        errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(submit(i) for i in range(args.generate)))
+    elapsed = time.perf_counter() - started
+    stats = (await client.get("/api/admin/generation/stats")).json()
+    return {
+        "response": _stats(response_latencies, elapsed),
+        "until_enqueued": _stats(enqueue_latencies, elapsed, errors),
+        "batches_sent": stats.get("batches_sent"),
+    }
+
+async def _measure(base_url: str, pid: int, args) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    result: Dict[str, Any] = {"memory": {"startup": _rss_mb(pid)}}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        result["listing"], names = await _listing(client, args)
+        result["memory"]["listing"] = _rss_mb(pid)
+        result["thumbnails"] = await _thumbnails(client, names, args)
+        result["memory"]["thumbnails"] = _rss_mb(pid)
+        result["metadata"] = await _metadata(client, names, args)
+        result["memory"]["metadata"] = _rss_mb(pid)
+        result["generate"] = await _generate(client, names, args)
+        result["memory"]["generate"] = _rss_mb(pid)
+    return result
+
+def _run_size(count: int, invokeai_url: str, args) -> Dict[str, Any]:
+    photo_dir = make_library(Path(args.data_dir), count, args.image_edge, args.embedded_metadata)
+    library_bytes = sum(entry.stat().st_size for entry in os.scandir(photo_dir))
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix="gallery-bench-") as work_dir:
+        command = [
+            sys.executable, "-m", "bench.bench_suite", "_serve",
+            "--port", str(port), "--photo-dir", str(photo_dir), "--work-dir", work_dir,
+            "--invokeai-url", invokeai_url, "--thumbnail-workers", str(args.thumbnail_workers),
+            "--workers", str(args.workers),
+        ]
+        with open(Path(work_dir) / "server.log", "w") as log:
+            process = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            startup = _wait_until_up(f"{base_url}/api/photos?limit=1", process, args.startup_timeout)
+            result = {
+                "photos": count,
+                "library_mb": round(library_bytes / 2**20, 1),
+                "startup_seconds": round(startup, 3),
+                **asyncio.run(_measure(base_url, process.pid, args)),
+            }
+        except Exception:
+            print((Path(work_dir) / "server.log").read_text()[-4000:], file=sys.stderr)
+            raise
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return result
+
+def run(args) -> None:
+    fake_port = free_port()
+    env = {**os.environ, "FAKE_INVOKEAI_SECONDS_PER_IMAGE": str(args.fake_seconds_per_image)}
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bench.fake_invokeai:app",
+         "--port", str(fake_port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    invokeai_url = f"http://127.0.0.1:{fake_port}"
+    try:
+        _wait_until_up(f"{invokeai_url}/api/v1/queue/default/status", fake, 30)
+        runs = []
+        for count in args.photos:
+            print(f"Benchmarking {count} photos...", file=sys.stderr)
+            runs.append(_run_size(count, invokeai_url, args))
+    finally:
+        fake.terminate()
+        fake.wait(timeout=10)
+
+    commit = _commit()
+    document = {
+        "version": RESULTS_VERSION,
+        "commit": commit,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("func", "output")},
+        "runs": runs,
+    }
+    output = Path(args.output or f"bench-results-{commit}.json")
+    output.write_text(json.dumps(document, indent=2))
+    print(f"Wrote {output}", file=sys.stderr)
+
+def _flatten(value: Any, prefix: str = "") -> Dict[str, float]:
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else key))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+def compare(args) -> None:
+    """Print every metric present in both result files with its relative change."""
+    old, new = (json.loads(Path(p).read_text()) for p in (args.old, args.new))
+    print(f"{old['commit']} -> {new['commit']}")
+    old_runs = {run["photos"]: run for run in old["runs"]}
+    for run in new["runs"]:
+        previous = old_runs.get(run["photos"])
+        if previous is None:
+            continue
+        print(f"\n{run['photos']} photos")
+        before, after = _flatten(previous), _flatten(run)
+        for key in sorted(before.keys() & after.keys()):
+            a, b = before[key], after[key]
+            change = f"{(b - a) / a * 100:+7.1f}%" if a else "     n/a"
+            print(f"  {key:<50} {a:>12} {b:>12} {change}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write a JSON result file")
+    run_parser.add_argument("--photos", type=int, nargs="+", default=[1000, 10000], help="Library sizes to test")
+    run_parser.add_argument("--image-edge", type=int, default=768, help="Edge length of the square synthetic PNGs")
+    run_parser.add_argument("--embedded-metadata", type=float, default=0.5,
+                            help="Fraction of photos with metadata embedded in the PNG")
+    run_parser.add_argument("--data-dir", default=str(Path(tempfile.gettempdir()) / "gallery-bench"),
+                            help="Where synthetic libraries are kept between runs")
+    run_parser.add_argument("--thumbnails", type=int, default=300, help="Photos whose thumbnails are requested")
+    run_parser.add_argument("--metadata", type=int, default=500, help="Photos whose metadata is requested")
+    run_parser.add_argument("--generate", type=int, default=24, help="Generation requests to submit")
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--repeat", type=int, default=20, help="Repetitions of sequential listing requests")
+    run_parser.add_argument("--thumbnail-workers", type=int, default=0, help="0 means the app's default")
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    run_parser.add_argument("--fake-seconds-per-image", type=float, default=0.05)
+    run_parser.add_argument("--enqueue-timeout", type=float, default=60.0)
+    run_parser.add_argument("--startup-timeout", type=float, default=600.0)
+    run_parser.add_argument("--output", help="Result file; defaults to bench-results-<commit>.json")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.set_defaults(func=compare)
+
+    serve_parser = commands.add_parser("_serve")
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--photo-dir", required=True)
+    serve_parser.add_argument("--work-dir", required=True)
+    serve_parser.add_argument("--invokeai-url", required=True)
+    serve_parser.add_argument("--thumbnail-workers", type=int, default=0)
+    serve_parser.add_argument("--workers", type=int, default=1)
+    serve_parser.set_defaults(func=_serve)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Minimal stand-in for the parts of the InvokeAI API the gallery uses.
+
+Run standalone with `uvicorn bench.fake_invokeai:app --port 9090`, or start
+it in-process with `serve_in_thread()`. Latency and error rate are set with
+FAKE_INVOKEAI_LATENCY_MS and FAKE_INVOKEAI_ERROR_RATE; enqueued images
+"finish" one after another every FAKE_INVOKEAI_SECONDS_PER_IMAGE.
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from bench import servers
+import asyncio
+import os
+import random
+import time
+import uuid
+
+LATENCY = float(os.environ.get("FAKE_INVOKEAI_LATENCY_MS", 20)) / 1000
+ERROR_RATE = float(os.environ.get("FAKE_INVOKEAI_ERROR_RATE", 0))
+SECONDS_PER_IMAGE = float(os.environ.get("FAKE_INVOKEAI_SECONDS_PER_IMAGE", 0.5))
+
+app = FastAPI()
+app.state.enqueued = []
+
+async def _simulate():
+    await asyncio.sleep(LATENCY)
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        return JSONResponse(status_code=503, content={"detail": "simulated failure"})
+    return None
+
+@app.get("/api/v1/images/i/{image_name}/metadata")
+async def image_metadata(image_name: str):
+    failure = await _simulate()
+    if failure is not None:
+        return failure
+    return {
+        "positive_prompt": f"prompt for {image_name}",
+        "negative_prompt": "",
+        "width": 1024,
+        "height": 1024,
+        "seed": abs(hash(image_name)) % 1000000,
+        "steps": 20,
+        "cfg_scale": 7.5,
+        "scheduler": "dpmpp_2m",
+        "model": {"key": "fake-model", "name": "fake-sdxl", "base": "sdxl", "type": "main"},
+    }
+
+@app.post("/api/v1/queue/{queue_id}/enqueue_batch")
+async def enqueue_batch(queue_id: str, request: Request):
+    failure = await _simulate()
+    if failure is not None:
+        return failure
+    body = await request.json()
+    batch_id = str(uuid.uuid4())
+    data = body["batch"].get("data") or [[{"items": [None]}]]
+    requested = len(data[0][0]["items"]) * body["batch"].get("runs", 1)
+    app.state.enqueued.append({"batch_id": batch_id, "received_at": time.time(), "body": body, "total": requested})
+    return {"queue_id": queue_id, "enqueued": requested, "requested": requested, "batch": {"batch_id": batch_id}, "batch_id": batch_id}
+
+def _progress() -> dict:
+    """Completed image count per batch, as if one GPU worked through the queue in order."""
+    now = time.time()
+    free_at = 0.0
+    completed = {}
+    for batch in app.state.enqueued:
+        start = max(free_at, batch["received_at"])
+        done = int(max(0.0, now - start) // SECONDS_PER_IMAGE) if SECONDS_PER_IMAGE else batch["total"]
+        completed[batch["batch_id"]] = min(batch["total"], done)
+        free_at = start + batch["total"] * SECONDS_PER_IMAGE
+    return completed
+
+def _counts(total: int, completed: int) -> dict:
+    in_progress = 1 if completed < total else 0
+    return {
+        "pending": total - completed - in_progress,
+        "in_progress": in_progress,
+        "completed": completed,
+        "failed": 0,
+        "canceled": 0,
+        "total": total,
+    }
+
+@app.get("/api/v1/queue/{queue_id}/b/{batch_id}/status")
+async def batch_status(queue_id: str, batch_id: str):
+    completed = _progress()
+    batch = next((b for b in app.state.enqueued if b["batch_id"] == batch_id), None)
+    if batch is None:
+        return JSONResponse(status_code=404, content={"detail": "batch not found"})
+    return {"queue_id": queue_id, "batch_id": batch_id, **_counts(batch["total"], completed[batch_id])}
+
+@app.get("/api/v1/queue/{queue_id}/status")
+async def queue_status(queue_id: str):
+    completed = _progress()
+    total = sum(b["total"] for b in app.state.enqueued)
+    done = sum(completed.values())
+    counts = _counts(total, done)
+    return {"queue": {"queue_id": queue_id, **counts}}
+
+def serve_in_thread(port: int = 0) -> str:
+    """Start the fake server on a background thread and return its base URL."""
+    return servers.serve_in_thread(app, port)
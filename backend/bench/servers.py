@@ -0,0 +1,19 @@
+"""Helpers for starting the servers the benchmarks run against."""
+import socket
+import threading
+import time
+import uvicorn
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def serve_in_thread(app, port: int = 0) -> str:
+    """Run an ASGI app under uvicorn on a background thread and return its base URL."""
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
@@ -0,0 +1,65 @@
+"""Command line utilities for the gallery backend.
+
+Usage:
+    python cli.py prewarm [--workers N]
+"""
+from gallery import Gallery
+from settings import THUMBNAIL_WORKERS
+import argparse
+import asyncio
+
+async def _prewarm(workers: int) -> int:
+    # Built like the server's, so it shares the index, the thumbnail cache
+    # and the render locks: safe to run next to the server, and neither
+    # renders what the other is rendering
+    gallery = Gallery(thumbnail_workers=workers)
+    gallery.create_directories()
+    index = gallery.photo_index
+    await asyncio.to_thread(index.store.open)
+    await asyncio.to_thread(index.build)
+    cache = gallery.thumbnail_cache
+    await asyncio.to_thread(cache.load)
+    generator = gallery.thumbnail_generator
+    generator.start()
+    job = gallery.prewarm_job
+    try:
+        job.start()
+        while job.running:
+            await asyncio.sleep(1)
+            progress = job.progress()
+            processed = progress["generated"] + progress["failed"]
+            print(
+                f"\r{processed}/{progress['total']} thumbnails "
+                f"({progress['images_per_second']:.1f} images/sec, {progress['failed']} failed)",
+                end="",
+                flush=True
+            )
+    finally:
+        await job.cancel()
+        generator.shutdown()
+        await asyncio.to_thread(cache.save)
+        await asyncio.to_thread(cache.close)
+        index.store.close()
+
+    progress = job.progress()
+    print(
+        f"\nDone: {progress['generated']} generated, {progress['skipped']} already present, "
+        f"{progress['failed']} failed in {progress['elapsed_seconds']}s "
+        f"({progress['images_per_second']:.1f} images/sec)"
+    )
+    return 1 if progress["failed"] else 0
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description="Photo gallery backend utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prewarm = subparsers.add_parser("prewarm", help="Generate all missing thumbnails")
+    prewarm.add_argument("--workers", type=int, default=THUMBNAIL_WORKERS, help="Encoder processes")
+
+    args = parser.parse_args()
+    if args.command == "prewarm":
+        return asyncio.run(_prewarm(args.workers))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main_cli())
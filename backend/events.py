@@ -0,0 +1,66 @@
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from typing import List, Set
+import asyncio
+import json
+
+class EventBroadcaster:
+    """Fans events out to any number of subscriber queues.
+
+    Each subscriber gets a bounded queue. A subscriber that falls behind has
+    its backlog replaced by a single `resync` event instead of buffering
+    without limit.
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, events: List[dict]) -> None:
+        for queue in list(self._subscribers):
+            for event in events:
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait({"type": "resync"})
+                    break
+
+def format_sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+def sse_response(request: Request, broadcaster: EventBroadcaster, keepalive_interval: float) -> StreamingResponse:
+    """Stream a broadcaster's events to one client as Server-Sent Events."""
+    queue = broadcaster.subscribe()
+
+    async def event_stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive_interval)
+                    yield format_sse(event)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
@@ -0,0 +1,122 @@
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+import anyio
+import mimetypes
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header lies entirely outside the file."""
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single `bytes=` range, or None to send the whole file.
+
+    Malformed headers, other units and multi-range requests are ignored, as
+    RFC 9110 allows, and answered with the full file.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            # An empty file has no bytes to select, whatever the suffix length
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+def if_range_matches(if_range: Optional[str], etag: str, last_modified: float) -> bool:
+    """Whether a Range may be honoured given the request's If-Range validator."""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    try:
+        return parsedate_to_datetime(if_range).timestamp() >= int(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+class FileRangeResponse(Response):
+    """Sends a file, or one byte range of it, without buffering it in memory.
+
+    Uses the ASGI `http.response.zerocopy` extension (sendfile) or
+    `http.response.pathsend` when the server offers them, and otherwise
+    reads large chunks off the event loop.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: Path,
+        size: int,
+        byte_range: Optional[Tuple[int, int]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: Optional[str] = None
+    ):
+        self.path = path
+        self.size = size
+        self.status_code = 206 if byte_range is not None else 200
+        self.start, self.end = byte_range if byte_range is not None else (0, size - 1)
+        self.media_type = media_type or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.background = None
+        self.body = b""
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-length"] = str(self.end - self.start + 1)
+        if byte_range is not None:
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions", {})
+        count = self.end - self.start + 1
+        head_only = scope.get("method") == "HEAD" or count <= 0
+        if not head_only and "http.response.pathsend" in extensions and self.status_code == 200:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if head_only:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            elif "http.response.zerocopy" in extensions:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": file,
+                    "offset": self.start,
+                    "count": count,
+                    "more_body": False
+                })
+            else:
+                await anyio.to_thread.run_sync(file.seek, self.start)
+                remaining = count
+                while remaining > 0:
+                    chunk = await anyio.to_thread.run_sync(file.read, min(self.chunk_size, remaining))
+                    if not chunk:
+                        # File shrank underneath us; end the body early
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining > 0:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await anyio.to_thread.run_sync(file.close)
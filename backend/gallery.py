@@ -0,0 +1,317 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from photo_index import PhotoIndex, PhotoIndexStore, IndexChanges
+from process_locks import FileLock
+from photo_watcher import PhotoWatcher
+from generation_tracker import GenerationTracker
+from generation_store import GenerationStore
+from generation_queue import GenerationScheduler
+from generation_graphs import GRAPH_TEMPLATES
+from thumbnail_cache import ThumbnailCache
+from memory_cache import BytesLRU
+from invokeai_client import InvokeAIClient
+from metadata_store import MetadataStore, MetadataError
+from image_features import FeatureStore, FeatureExtractor
+from metrics import REGISTRY, EventLoopLagMonitor
+from thumbnails import ThumbnailGenerator, ThumbnailError, PrewarmJob, DEFAULT_FORMAT
+from settings import (
+    DEFAULT_THUMBNAIL_SIZE_CLASS, DISPLAY_MAX_EDGE, DISPLAY_QUALITY, DISPLAY_SIZE_CLASS,
+    DISPLAY_VARIANTS, ESTIMATED_TIME_PER_IMAGE, EVENT_LOOP_LAG_INTERVAL, FEATURES_DB,
+    FEATURE_WORKERS, GENERATION_BATCH_WINDOW, GENERATION_DB, GENERATION_MAX_BATCH_IMAGES,
+    GENERATION_MAX_OUTSTANDING, GENERATION_MAX_QUEUED, GENERATION_MAX_QUEUED_PER_CLIENT,
+    GENERATION_POLL_INTERVAL, INDEX_DB, INVOKEAI_BASE_URL, INVOKEAI_CONNECT_TIMEOUT,
+    INVOKEAI_ENQUEUE_TIMEOUT, INVOKEAI_MAX_CONNECTIONS, INVOKEAI_MAX_KEEPALIVE,
+    INVOKEAI_METADATA_TIMEOUT, INVOKEAI_RETRIES, LEADER_POLL_INTERVAL, LOCK_DIR, METADATA_DB,
+    METADATA_FROM_PNG, METADATA_UPSTREAM_CONCURRENCY, PHOTO_DIR, PREWARM_ON_STARTUP,
+    THUMBNAIL_CACHE_MAX_MB, THUMBNAIL_DIR, THUMBNAIL_LOCK_DIR, THUMBNAIL_MAX_PENDING,
+    THUMBNAIL_MEMORY_CACHE_MB, THUMBNAIL_QUALITY, THUMBNAIL_QUEUE_SIZE, THUMBNAIL_SIZE,
+    THUMBNAIL_SIZE_CLASSES, THUMBNAIL_WORKERS, WATCH_POLL_INTERVAL, WATCH_RECONCILE_INTERVAL
+)
+import anyio
+import asyncio
+import httpx
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class Gallery:
+    """The services one worker process serves the API from.
+
+    Built by the app's lifespan (see main.create_app) and by cli.py.
+    Constructing it touches neither the disk nor the network; `start()`
+    opens the stores, indexes the photo directory and starts the background
+    tasks. Of several worker processes, the one holding the leader lock
+    also does the background work: cache eviction and sweeps, feature
+    extraction, prewarming, rendering thumbnails for new photos and
+    dispatching and polling generations.
+    """
+
+    def __init__(self, thumbnail_workers: int = THUMBNAIL_WORKERS):
+        self.leader_lock = FileLock(LOCK_DIR / "leader.lock")
+        self.photo_index = PhotoIndex(PHOTO_DIR, PhotoIndexStore(INDEX_DB))
+        self.invokeai = InvokeAIClient(
+            INVOKEAI_BASE_URL,
+            timeout=httpx.Timeout(INVOKEAI_ENQUEUE_TIMEOUT, connect=INVOKEAI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=INVOKEAI_MAX_CONNECTIONS,
+                max_keepalive_connections=INVOKEAI_MAX_KEEPALIVE
+            ),
+            retries=INVOKEAI_RETRIES
+        )
+        self.metadata_store = MetadataStore(
+            METADATA_DB,
+            PHOTO_DIR,
+            self._fetch_invokeai_metadata,
+            read_png=METADATA_FROM_PNG,
+            upstream_concurrency=METADATA_UPSTREAM_CONCURRENCY
+        )
+        self.thumbnail_bytes = BytesLRU(THUMBNAIL_MEMORY_CACHE_MB * 2**20)
+        self.thumbnail_cache = ThumbnailCache(THUMBNAIL_DIR, PHOTO_DIR, max_bytes=THUMBNAIL_CACHE_MAX_MB * 2**20)
+        self.thumbnail_generator = ThumbnailGenerator(
+            THUMBNAIL_SIZE,
+            THUMBNAIL_QUALITY,
+            max_workers=thumbnail_workers,
+            max_pending=THUMBNAIL_MAX_PENDING,
+            on_render=lambda original_path, thumbnail_path, nbytes: self.thumbnail_cache.record(
+                thumbnail_path, original_path.name, nbytes
+            ),
+            lock_dir=THUMBNAIL_LOCK_DIR
+        )
+        self.feature_extractor = FeatureExtractor(
+            self.photo_index,
+            FeatureStore(FEATURES_DB),
+            self.thumbnail_generator.run,
+            concurrency=FEATURE_WORKERS
+        )
+        self.prewarm_job = PrewarmJob(self.thumbnail_generator, self.photo_index, self.thumbnail_path)
+        self.thumbnail_queue: asyncio.Queue = asyncio.Queue(maxsize=THUMBNAIL_QUEUE_SIZE)
+        self.photo_watcher = PhotoWatcher(
+            self.photo_index,
+            on_change=self._on_photo_changes,
+            poll_interval=WATCH_POLL_INTERVAL,
+            reconcile_interval=WATCH_RECONCILE_INTERVAL
+        )
+        self.generation_tracker = GenerationTracker(
+            self.invokeai,
+            GenerationStore(GENERATION_DB),
+            poll_interval=GENERATION_POLL_INTERVAL,
+            default_seconds_per_image=ESTIMATED_TIME_PER_IMAGE
+        )
+        self.generation_scheduler = GenerationScheduler(
+            self.generation_tracker,
+            self._enqueue_generation,
+            max_outstanding=GENERATION_MAX_OUTSTANDING,
+            max_batch_items=GENERATION_MAX_BATCH_IMAGES,
+            batch_window=GENERATION_BATCH_WINDOW,
+            max_queued=GENERATION_MAX_QUEUED,
+            max_queued_per_client=GENERATION_MAX_QUEUED_PER_CLIENT
+        )
+        self.loop_lag_monitor = EventLoopLagMonitor(EVENT_LOOP_LAG_INTERVAL)
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def leader(self) -> bool:
+        return self.leader_lock.locked
+
+    def create_directories(self) -> None:
+        for directory in [PHOTO_DIR, THUMBNAIL_DIR, THUMBNAIL_LOCK_DIR]:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    async def start(self) -> None:
+        self.create_directories()
+        leader = await asyncio.to_thread(self.leader_lock.acquire, False)
+        await asyncio.to_thread(self.photo_index.store.open)
+        # Index the photo directory once, off the event loop
+        await asyncio.to_thread(self.photo_index.build)
+        await self.invokeai.start()
+        await asyncio.to_thread(self.metadata_store.open)
+        await self.thumbnail_cache.start(maintain=leader)
+        self.thumbnail_generator.start()
+        await self.feature_extractor.start(extract=leader)
+        await self.photo_watcher.start()
+        await asyncio.to_thread(self.generation_tracker.store.open)
+        await self.generation_tracker.start(poll=leader)
+        if leader:
+            await self.generation_scheduler.start()
+        self._tasks = [asyncio.create_task(self._thumbnail_worker())]
+        if not leader:
+            self._tasks.append(asyncio.create_task(self._await_leadership()))
+        self.loop_lag_monitor.start()
+        if PREWARM_ON_STARTUP and leader:
+            self.prewarm_job.start()
+        self._register_metrics()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.loop_lag_monitor.stop()
+        await self.prewarm_job.cancel()
+        await self.generation_scheduler.stop()
+        await self.generation_tracker.stop()
+        self.generation_tracker.store.close()
+        await self.photo_watcher.stop()
+        await self.feature_extractor.stop()
+        self.thumbnail_generator.shutdown()
+        await self.thumbnail_cache.stop()
+        await self.invokeai.close()
+        self.metadata_store.close()
+        self.photo_index.store.close()
+        self.leader_lock.release()
+
+    def thumbnail_path(
+        self,
+        original_path: Path,
+        size_class: str = DEFAULT_THUMBNAIL_SIZE_CLASS,
+        fmt: str = DEFAULT_FORMAT,
+        stat: Optional[os.stat_result] = None
+    ) -> Path:
+        """Content-addressed thumbnail path; raises OSError if the original is missing.
+
+        Uses the photo index's view of the original when no stat is given, so
+        no disk access is needed for indexed photos.
+        """
+        entry = self.photo_index.get(original_path.name) if stat is None else None
+        if entry is not None:
+            key = self.thumbnail_cache.key_for(original_path, entry.mtime_ns, entry.size, entry.inode)
+            return self.thumbnail_cache.path_for_key(key, size_class, fmt)
+        return self.thumbnail_cache.path_for(original_path, size_class, fmt, stat)
+
+    async def render_thumbnail(
+        self,
+        image_path: Path,
+        thumbnail_path: Path,
+        size_class: str = DEFAULT_THUMBNAIL_SIZE_CLASS,
+        fmt: str = DEFAULT_FORMAT,
+        block: bool = False
+    ) -> None:
+        """Make sure a thumbnail or display variant exists; see ThumbnailGenerator.ensure."""
+        if size_class == DISPLAY_SIZE_CLASS:
+            edge, quality = DISPLAY_MAX_EDGE, DISPLAY_QUALITY
+        else:
+            edge, quality = THUMBNAIL_SIZE_CLASSES[size_class], THUMBNAIL_QUALITY
+        await self.thumbnail_generator.ensure(
+            image_path, thumbnail_path, size=(edge, edge), fmt=fmt, block=block, quality=quality
+        )
+
+    def discard_thumbnails(self, names: List[str]) -> None:
+        for name in names:
+            self.thumbnail_cache.discard_stale(name)
+
+    async def _on_photo_changes(self, changes: IndexChanges):
+        """Drop stale thumbnails and queue fresh ones when photos change on disk.
+
+        Every worker process sees the change; only the leader cleans up and
+        renders, the others just update their in-memory state.
+        """
+        if changes.added:
+            self.generation_tracker.on_photos_added(changes.added)
+        if changes.removed or changes.modified:
+            # A photo overwritten under the same name may carry different metadata
+            await self.metadata_store.discard(changes.removed + changes.modified)
+        await self.feature_extractor.on_change(changes)
+        if not self.leader:
+            return
+        for name in changes.removed + changes.modified:
+            await asyncio.to_thread(self.thumbnail_cache.discard_stale, name)
+        for name in changes.added + changes.modified:
+            try:
+                self.thumbnail_queue.put_nowait(name)
+            except asyncio.QueueFull:
+                # Falls back to generation on first request
+                pass
+
+    async def _thumbnail_worker(self):
+        size_classes = [DEFAULT_THUMBNAIL_SIZE_CLASS] + ([DISPLAY_SIZE_CLASS] if DISPLAY_VARIANTS else [])
+        while True:
+            name = await self.thumbnail_queue.get()
+            original_path = PHOTO_DIR / name
+            for size_class in size_classes:
+                try:
+                    thumbnail_path = self.thumbnail_path(original_path, size_class)
+                except OSError:
+                    break
+                if thumbnail_path.exists():
+                    continue
+                try:
+                    await self.render_thumbnail(original_path, thumbnail_path, size_class, block=True)
+                except ThumbnailError as e:
+                    # Already names the photo
+                    logger.error(str(e))
+                except Exception as e:
+                    logger.error(f"Error creating thumbnail for {original_path}: {e}")
+
+    async def _await_leadership(self):
+        """Take over the background work if the leading worker process exits."""
+        while not await asyncio.to_thread(self.leader_lock.acquire, False):
+            await asyncio.sleep(LEADER_POLL_INTERVAL)
+        logger.info(f"Worker process {os.getpid()} took over background work")
+        self.thumbnail_cache.maintain = True
+        self.feature_extractor.start_extracting()
+        await self.generation_tracker.start_polling()
+        await self.generation_scheduler.start()
+
+    async def _fetch_invokeai_metadata(self, image_name: str) -> Any:
+        response = await self.invokeai.get(
+            f"/api/v1/images/i/{image_name}/metadata",
+            timeout=INVOKEAI_METADATA_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise MetadataError(
+                response.status_code,
+                f"Failed to get metadata from InvokeAI: {response.text}"
+            )
+        return response.json()
+
+    async def _enqueue_generation(self, params: Dict[str, Any], items: List[Tuple[int, str]]) -> Dict[str, Any]:
+        template = GRAPH_TEMPLATES[params["template"]]
+        response = await self.invokeai.post(
+            "/api/v1/queue/default/enqueue_batch",
+            content=template.render(params, items),
+            headers={"Content-Type": "application/json"},
+            timeout=INVOKEAI_ENQUEUE_TIMEOUT
+        )
+        if response.status_code not in (200, 201):
+            logger.error(f"Error response from InvokeAI: {response.text}")
+            raise RuntimeError(f"Failed to trigger generation: {response.text}")
+        return response.json()
+
+    def _register_metrics(self) -> None:
+        REGISTRY.gauge(
+            "gallery_queue_depth",
+            "Work waiting or in progress per internal queue",
+            ("queue",),
+            fn=lambda: {
+                "thumbnail_render": self.thumbnail_generator.pending,
+                "thumbnail_background": self.thumbnail_queue.qsize(),
+                "image_features": self.feature_extractor.stats()["queued"],
+                "generation_jobs": self.generation_scheduler.stats()["queued_jobs"],
+                "generation_outstanding_batches": self.generation_scheduler.stats()["outstanding_batches"],
+                "threadpool_busy": anyio.to_thread.current_default_thread_limiter().borrowed_tokens,
+            }
+        )
+        REGISTRY.counter(
+            "gallery_thumbnail_memory_cache_total",
+            "Lookups in the in-memory thumbnail cache",
+            ("result",),
+            fn=lambda: {
+                "hit": self.thumbnail_bytes.hits,
+                "miss": self.thumbnail_bytes.misses,
+                "eviction": self.thumbnail_bytes.evictions
+            }
+        )
+        REGISTRY.gauge(
+            "gallery_thumbnail_cache_bytes",
+            "Bytes held by the thumbnail caches",
+            ("cache",),
+            fn=lambda: {"memory": self.thumbnail_bytes.stats()["bytes"], "disk": self.thumbnail_cache.total_bytes}
+        )
+        REGISTRY.counter(
+            "gallery_metadata_lookups_total",
+            "Metadata lookups by where they were resolved from",
+            ("source",),
+            fn=lambda: self.metadata_store.stats()["resolved_from"]
+        )
+        REGISTRY.gauge("gallery_photos", "Photos in the index", fn=lambda: len(self.photo_index))
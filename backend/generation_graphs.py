@@ -0,0 +1,161 @@
+from typing import Any, Dict, List, Sequence, Tuple
+import hashlib
+
+try:
+    import orjson
+
+    def _dumps(value: Any, sort_keys: bool = False) -> bytes:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+except ImportError:
+    import json
+
+    def _dumps(value: Any, sort_keys: bool = False) -> bytes:
+        return json.dumps(value, sort_keys=sort_keys, separators=(",", ":")).encode()
+
+# (node id, field name) a value is written to
+FieldRef = Tuple[str, str]
+
+DEFAULT_SDXL_VAE = {
+    "key": "6415a9ec-819b-49ca-9a0d-44ac478703a6",
+    "hash": "blake3:9b7c3120af571e8d93fa82d50ef3b5f15727507d0edaae822424951937a008a3",
+    "name": "sdxl-vae-fp16-fix",
+    "base": "sdxl",
+    "type": "vae"
+}
+
+class GraphTemplate:
+    """An InvokeAI graph built once and patched per request.
+
+    Nodes and edges are fixed at construction. `param_fields` maps request
+    parameters to the node fields they fill; `item_fields` lists, for each
+    position of an item tuple, the fields that vary per image and go into
+    the batch's zipped `data`. The edge list and the envelope around the
+    variable parts are serialized once up front.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        nodes: Dict[str, Dict[str, Any]],
+        edges: Sequence[Tuple[str, str, str, str]],
+        param_fields: Dict[str, List[FieldRef]],
+        item_fields: Sequence[List[FieldRef]],
+        defaults: Dict[str, Any]
+    ):
+        self.name = name
+        self.nodes = {node_id: {"id": node_id, **node} for node_id, node in nodes.items()}
+        self.param_fields = param_fields
+        self.item_fields = item_fields
+        self.defaults = defaults
+        edge_list = [
+            {"source": {"node_id": source, "field": source_field},
+             "destination": {"node_id": destination, "field": destination_field}}
+            for source, source_field, destination, destination_field in edges
+        ]
+        self._prefix = b'{"prepend":false,"batch":{"graph":{"id":' + _dumps(name) + b',"nodes":'
+        self._middle = b',"edges":' + _dumps(edge_list) + b'},"runs":1,"data":'
+        self._suffix = b'},"origin":"photo_gallery","destination":"gallery"}'
+
+    def key(self, params: Dict[str, Any]) -> str:
+        """Requests with equal keys differ only in per-item fields and can share a batch."""
+        fixed = {name: params.get(name, self.defaults.get(name)) for name in self.param_fields}
+        return f"{self.name}:{hashlib.md5(_dumps(fixed, sort_keys=True)).hexdigest()}"
+
+    def render(self, params: Dict[str, Any], items: Sequence[Sequence[Any]]) -> bytes:
+        """Serialized enqueue_batch body generating one image per item."""
+        patches: Dict[str, Dict[str, Any]] = {}
+        for name, refs in self.param_fields.items():
+            value = params.get(name, self.defaults.get(name))
+            for node_id, field_name in refs:
+                patches.setdefault(node_id, {})[field_name] = value
+        # Nodes also carry the first item's values; data overrides them per image
+        for position, refs in enumerate(self.item_fields):
+            for node_id, field_name in refs:
+                patches.setdefault(node_id, {})[field_name] = items[0][position]
+        nodes = {
+            node_id: {**node, **patches[node_id]} if node_id in patches else node
+            for node_id, node in self.nodes.items()
+        }
+
+        data = []
+        for position, refs in enumerate(self.item_fields):
+            column = [item[position] for item in items]
+            data.extend({"node_path": node_id, "field_name": field_name, "items": column} for node_id, field_name in refs)
+        return self._prefix + _dumps(nodes) + self._middle + _dumps([data]) + self._suffix
+
+SDXL_TXT2IMG = GraphTemplate(
+    "sdxl_txt2img",
+    nodes={
+        "model_loader": {"type": "sdxl_model_loader", "is_intermediate": True, "use_cache": True},
+        "pos_cond": {"type": "sdxl_compel_prompt", "is_intermediate": True, "use_cache": True},
+        "pos_cond_collect": {"type": "collect", "is_intermediate": True, "use_cache": True},
+        "neg_cond": {"type": "sdxl_compel_prompt", "is_intermediate": True, "use_cache": True},
+        "neg_cond_collect": {"type": "collect", "is_intermediate": True, "use_cache": True},
+        "noise": {"type": "noise", "use_cpu": True, "is_intermediate": True, "use_cache": True},
+        "denoise_latents": {
+            "type": "denoise_latents",
+            "cfg_rescale_multiplier": 0,
+            "denoising_start": 0,
+            "denoising_end": 1,
+            "is_intermediate": True,
+            "use_cache": True
+        },
+        "vae": {"type": "vae_loader", "is_intermediate": True, "use_cache": True},
+        "core_metadata": {
+            "type": "core_metadata",
+            "is_intermediate": True,
+            "use_cache": True,
+            "generation_mode": "sdxl_txt2img",
+            "cfg_rescale_multiplier": 0,
+            "rand_device": "cpu"
+        },
+        "canvas_output": {"type": "l2i", "fp32": False, "is_intermediate": False, "use_cache": False},
+    },
+    edges=[
+        ("model_loader", "unet", "denoise_latents", "unet"),
+        ("model_loader", "clip", "pos_cond", "clip"),
+        ("model_loader", "clip", "neg_cond", "clip"),
+        ("model_loader", "clip2", "pos_cond", "clip2"),
+        ("model_loader", "clip2", "neg_cond", "clip2"),
+        ("pos_cond", "conditioning", "pos_cond_collect", "item"),
+        ("neg_cond", "conditioning", "neg_cond_collect", "item"),
+        ("pos_cond_collect", "collection", "denoise_latents", "positive_conditioning"),
+        ("neg_cond_collect", "collection", "denoise_latents", "negative_conditioning"),
+        ("noise", "noise", "denoise_latents", "noise"),
+        ("denoise_latents", "latents", "canvas_output", "latents"),
+        ("vae", "vae", "canvas_output", "vae"),
+        ("core_metadata", "metadata", "canvas_output", "metadata"),
+    ],
+    param_fields={
+        "model": [("model_loader", "model"), ("core_metadata", "model")],
+        "negative_prompt": [("neg_cond", "prompt"), ("core_metadata", "negative_prompt")],
+        "negative_style_prompt": [("neg_cond", "style")],
+        "width": [("noise", "width"), ("core_metadata", "width")],
+        "height": [("noise", "height"), ("core_metadata", "height")],
+        "cfg_scale": [("denoise_latents", "cfg_scale"), ("core_metadata", "cfg_scale")],
+        "scheduler": [("denoise_latents", "scheduler"), ("core_metadata", "scheduler")],
+        "steps": [("denoise_latents", "steps"), ("core_metadata", "steps")],
+        "vae": [("vae", "vae_model"), ("core_metadata", "vae")],
+    },
+    item_fields=[
+        [("noise", "seed"), ("core_metadata", "seed")],
+        [("pos_cond", "prompt"), ("core_metadata", "positive_prompt"),
+         ("pos_cond", "style"), ("core_metadata", "positive_style_prompt")],
+    ],
+    defaults={
+        "model": {},
+        "negative_prompt": "",
+        "negative_style_prompt": "",
+        "width": 1024,
+        "height": 1024,
+        "cfg_scale": 7.5,
+        "scheduler": "dpmpp_2m",
+        "steps": 20,
+        "vae": DEFAULT_SDXL_VAE,
+    }
+)
+
+# Generation modes by name; img2img and upscale graphs register here
+GRAPH_TEMPLATES: Dict[str, GraphTemplate] = {
+    SDXL_TXT2IMG.name: SDXL_TXT2IMG,
+}
@@ -0,0 +1,237 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from generation_tracker import GenerationTracker, FOLLOW_INTERVAL
+from generation_store import BatchState, GenerationItem, GenerationJob
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Builds and sends one enqueue_batch call; returns InvokeAI's JSON response
+EnqueueBatch = Callable[[Dict[str, Any], List[GenerationItem]], Awaitable[Dict[str, Any]]]
+
+class GenerationScheduler:
+    """Local queue in front of InvokeAI's enqueue_batch.
+
+    Jobs with the same compatibility `key` (same model and graph shape) are
+    merged into one batch whose `data` zips the seeds and prompts of every
+    job. At most `max_outstanding` batches are left unfinished in InvokeAI;
+    everything else waits here, ordered by priority and then round-robin
+    across clients so one client's burst can't starve the others.
+
+    Jobs are queued in the tracker's shared store, so any worker process
+    can `submit` them and report on them. Only the process holding the
+    leader lock `start`s the dispatch loop, which picks up jobs submitted
+    anywhere.
+    """
+
+    def __init__(
+        self,
+        tracker: GenerationTracker,
+        enqueue: EnqueueBatch,
+        max_outstanding: int = 2,
+        max_batch_items: int = 32,
+        batch_window: float = 0.05,
+        max_queued: int = 256,
+        max_queued_per_client: int = 32
+    ):
+        self.tracker = tracker
+        self.enqueue = enqueue
+        self.max_outstanding = max_outstanding
+        self.max_batch_items = max_batch_items
+        self.batch_window = batch_window
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.store = tracker.store
+        self._queues: Dict[str, List[Tuple[int, int, GenerationJob]]] = {}
+        self._last_served: Dict[str, int] = {}
+        # Sequence number in the store of the last job taken into _queues
+        self._loaded = 0
+        self._outstanding: Dict[str, int] = {}
+        self._sequence = itertools.count()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        tracker.add_listener(self._on_batch_finished)
+
+    async def start(self) -> None:
+        """Start dispatching, resuming whatever a previous leader left queued or outstanding."""
+        if self._task is not None:
+            return
+        self._outstanding = {
+            state.batch_id: state.total for state in await asyncio.to_thread(self.store.active_batches)
+        }
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def submit(self, job: GenerationJob) -> GenerationJob:
+        """Queue a job; raises QueueFullError when over the global or per-client limit."""
+        await asyncio.to_thread(self.store.add_job, job, self.max_queued, self.max_queued_per_client)
+        self._wake.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[GenerationJob]:
+        return await asyncio.to_thread(self.store.get_job, job_id)
+
+    async def describe(self, job: GenerationJob) -> dict:
+        data = {
+            "job_id": job.job_id,
+            "batch_id": job.batch_id,
+            "priority": job.priority,
+            "quantity": job.quantity,
+            "submitted_at": job.submitted_at,
+            "dispatched_at": job.dispatched_at,
+            "completed": 0,
+            "error": job.error,
+        }
+        state = await self.tracker.get(job.batch_id) if job.batch_id else None
+        if job.error is not None:
+            data["status"] = "failed"
+        elif job.batch_id is None:
+            data["status"] = "queued_locally"
+        elif state is None:
+            data["status"] = "enqueued"
+        else:
+            # InvokeAI runs a batch's items in order, so this job's share of
+            # the batch is the slice starting at its offset
+            completed = min(max(state.completed - job.offset, 0), job.quantity)
+            done = min(max(state.done - job.offset, 0), job.quantity)
+            data["completed"] = completed
+            if done >= job.quantity:
+                data["status"] = "completed" if completed == job.quantity else "failed"
+            else:
+                data["status"] = "running" if state.started_at and state.done >= job.offset else "queued"
+                data["eta_seconds"] = round((job.offset + job.quantity - state.done) * self.tracker.seconds_per_image, 1)
+        return data
+
+    def stats(self) -> dict:
+        """Queue depth and counters across all worker processes, as last read from the store."""
+        shared = self.tracker.shared
+        return {
+            "queued_jobs": shared.get("queued_jobs", 0),
+            "queued_images": shared.get("queued_images", 0),
+            "outstanding_batches": shared.get("outstanding_batches", 0),
+            "batches_sent": shared.get("batches_sent", 0),
+            "jobs_sent": shared.get("jobs_sent", 0),
+        }
+
+    def _on_batch_finished(self, state: BatchState) -> None:
+        if self._outstanding.pop(state.batch_id, None) is not None:
+            self._wake.set()
+
+    def _ready(self) -> bool:
+        return any(self._queues.values()) and len(self._outstanding) < self.max_outstanding
+
+    async def _load(self) -> None:
+        """Take jobs newly submitted by any worker process into the local queues."""
+        for seq, job in await asyncio.to_thread(self.store.queued_jobs, self._loaded):
+            heapq.heappush(self._queues.setdefault(job.client_id, []), (-job.priority, next(self._sequence), job))
+            self._loaded = seq
+
+    def _fair_order(self) -> List[str]:
+        """Clients with queued jobs, least recently served first."""
+        clients = [client for client, queue in self._queues.items() if queue]
+        return sorted(clients, key=lambda client: self._last_served.get(client, -1))
+
+    def _take_batch(self) -> List[GenerationJob]:
+        clients = self._fair_order()
+        # Highest priority first; ties go to the least recently served client
+        lead_client = min(clients, key=lambda client: self._queues[client][0][0])
+        lead = heapq.heappop(self._queues[lead_client])[2]
+        jobs = [lead]
+        size = lead.quantity
+        served = {lead_client}
+
+        # Fill the batch one job per client per round with compatible jobs
+        # of the same priority; the lead job is its client's first-round share
+        skip = {lead_client}
+        filling = True
+        while filling and size < self.max_batch_items:
+            filling = False
+            for client in clients:
+                if client in skip:
+                    continue
+                queue = self._queues[client]
+                match = next(
+                    (entry for entry in sorted(queue)
+                     if entry[2].key == lead.key and entry[2].priority == lead.priority),
+                    None
+                )
+                if match is None or size + match[2].quantity > self.max_batch_items:
+                    continue
+                queue.remove(match)
+                heapq.heapify(queue)
+                jobs.append(match[2])
+                size += match[2].quantity
+                served.add(client)
+                filling = True
+            if skip:
+                skip = set()
+                filling = True
+
+        tick = next(self._sequence)
+        for client in served:
+            self._last_served[client] = tick
+        for client in [client for client, queue in self._queues.items() if not queue]:
+            del self._queues[client]
+        return jobs
+
+    async def _run(self) -> None:
+        while True:
+            await self._load()
+            while not self._ready():
+                self._wake.clear()
+                try:
+                    # Woken by submissions in this process; other processes' are polled for
+                    await asyncio.wait_for(self._wake.wait(), FOLLOW_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                await self._load()
+            if self.batch_window:
+                # Give a burst of requests a moment to arrive so it can be merged
+                await asyncio.sleep(self.batch_window)
+                await self._load()
+            try:
+                await self._dispatch(self._take_batch())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Generation dispatch failed: {e}")
+
+    async def _dispatch(self, jobs: List[GenerationJob]) -> None:
+        items: List[GenerationItem] = []
+        for job in jobs:
+            job.offset = len(items)
+            items.extend(job.items)
+        try:
+            response = await self.enqueue(jobs[0].params, items)
+        except Exception as e:
+            for job in jobs:
+                job.error = str(e) or type(e).__name__
+            await asyncio.to_thread(self.store.update_jobs, jobs)
+            await self.tracker.publish([
+                {"type": "job_failed", "job_id": job.job_id, "error": job.error} for job in jobs
+            ])
+            raise
+
+        batch_id = response.get("batch", {}).get("batch_id") or response.get("batch_id")
+        now = time.time()
+        for job in jobs:
+            job.dispatched_at = now
+            job.batch_id = batch_id
+        await asyncio.to_thread(self.store.update_jobs, jobs)
+        if batch_id:
+            self._outstanding[batch_id] = len(items)
+            await self.tracker.track(batch_id, response.get("enqueued", len(items)))
+        await self.tracker.publish([
+            {"type": "job_dispatched", "job_id": job.job_id, "batch_id": batch_id, "offset": job.offset}
+            for job in jobs
+        ])
+        if len(jobs) > 1:
+            logger.info(f"Merged {len(jobs)} generation requests into batch {batch_id} ({len(items)} images)")
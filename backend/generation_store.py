@@ -0,0 +1,282 @@
+from dataclasses import dataclass, field, astuple
+from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
+from sqlite_db import open_sqlite
+import json
+import secrets
+import sqlite3
+import threading
+import time
+
+# (seed, positive prompt) of one image
+GenerationItem = Tuple[int, str]
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the local queue or the client's share of it is full."""
+
+@dataclass
+class GenerationJob:
+    client_id: str
+    key: str
+    params: Dict[str, Any]
+    items: List[GenerationItem]
+    priority: int = 0
+    job_id: str = field(default_factory=lambda: secrets.token_hex(8))
+    submitted_at: float = field(default_factory=time.time)
+    dispatched_at: Optional[float] = None
+    batch_id: Optional[str] = None
+    # Position of this job's first image within its (possibly shared) batch
+    offset: int = 0
+    error: Optional[str] = None
+
+    @property
+    def quantity(self) -> int:
+        return len(self.items)
+
+@dataclass
+class BatchState:
+    batch_id: str
+    total: int
+    enqueued_at: float
+    pending: int = 0
+    in_progress: int = 0
+    completed: int = 0
+    failed: int = 0
+    canceled: int = 0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> int:
+        return self.completed + self.failed + self.canceled
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def status(self) -> str:
+        if not self.finished:
+            return "running" if self.started_at is not None else "queued"
+        if self.completed == self.total:
+            return "completed"
+        return "failed" if self.failed else "canceled"
+
+_JOB_COLUMNS = (
+    "client_id, key, params, items, priority, job_id, submitted_at, "
+    "dispatched_at, batch_id, batch_offset, error"
+)
+# Submitted but neither sent to InvokeAI nor failed
+_QUEUED = "dispatched_at IS NULL AND error IS NULL"
+
+def _job_from_row(row: tuple) -> GenerationJob:
+    client_id, key, params, items, *rest = row
+    return GenerationJob(client_id, key, json.loads(params), [tuple(item) for item in json.loads(items)], *rest)
+
+class GenerationStore:
+    """Generation jobs, batches, events and counters shared by all worker processes.
+
+    Any worker process submits jobs and reads their status; only the one
+    holding the leader lock dispatches jobs, polls InvokeAI and writes the
+    results. Events are appended to a table every process tails, so any
+    worker can stream them. Finished jobs and batches, and old events, are
+    pruned beyond the `retain_*` limits.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        retain_jobs: int = 500,
+        retain_batches: int = 200,
+        retain_events: int = 1000
+    ):
+        self.db_path = db_path
+        self.retain_jobs = retain_jobs
+        self.retain_batches = retain_batches
+        self.retain_events = retain_events
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        # data_version only reflects other connections' commits
+        self._wrote = False
+
+    def open(self) -> None:
+        self._conn = open_sqlite(self.db_path, [
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT UNIQUE NOT NULL, "
+            "client_id TEXT NOT NULL, key TEXT NOT NULL, params TEXT NOT NULL, items TEXT NOT NULL, "
+            "quantity INTEGER NOT NULL, priority INTEGER NOT NULL, submitted_at REAL NOT NULL, "
+            "dispatched_at REAL, batch_id TEXT, batch_offset INTEGER NOT NULL, error TEXT)",
+            f"CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (client_id) WHERE {_QUEUED}",
+            "CREATE TABLE IF NOT EXISTS batches ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, batch_id TEXT UNIQUE NOT NULL, "
+            "total INTEGER NOT NULL, enqueued_at REAL NOT NULL, pending INTEGER NOT NULL, "
+            "in_progress INTEGER NOT NULL, completed INTEGER NOT NULL, failed INTEGER NOT NULL, "
+            "canceled INTEGER NOT NULL, started_at REAL, finished_at REAL)",
+            "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        ])
+        self.changed()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def changed(self) -> bool:
+        """Whether anything, in this process or another, was written since the last call."""
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            changed = data_version != self._data_version or self._wrote
+            self._data_version, self._wrote = data_version, False
+        return changed
+
+    def _commit(self) -> None:
+        self._conn.commit()
+        self._wrote = True
+
+    # Jobs
+
+    def add_job(self, job: GenerationJob, max_queued: int, max_queued_per_client: int) -> None:
+        """Queue a job; raises QueueFullError when over the global or per-client limit."""
+        with self._lock:
+            # Take the write lock first so concurrent submissions from other
+            # processes can't both pass the limit checks
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                queued = self._conn.execute(f"SELECT COUNT(*) FROM jobs WHERE {_QUEUED}").fetchone()[0]
+                if queued >= max_queued:
+                    raise QueueFullError("Generation queue is full")
+                queued = self._conn.execute(
+                    f"SELECT COUNT(*) FROM jobs WHERE {_QUEUED} AND client_id = ?", (job.client_id,)
+                ).fetchone()[0]
+                if queued >= max_queued_per_client:
+                    raise QueueFullError("Too many queued generations for this client")
+                self._conn.execute(
+                    f"INSERT INTO jobs ({_JOB_COLUMNS}, quantity) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        job.client_id, job.key, json.dumps(job.params), json.dumps(job.items), job.priority,
+                        job.job_id, job.submitted_at, job.dispatched_at, job.batch_id, job.offset, job.error,
+                        job.quantity
+                    )
+                )
+                self._conn.execute(
+                    f"DELETE FROM jobs WHERE seq <= (SELECT MAX(seq) FROM jobs) - ? AND NOT ({_QUEUED})",
+                    (self.retain_jobs,)
+                )
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._commit()
+
+    def get_job(self, job_id: str) -> Optional[GenerationJob]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return _job_from_row(row) if row is not None else None
+
+    def queued_jobs(self, after: int = 0) -> List[Tuple[int, GenerationJob]]:
+        """Queued jobs submitted after sequence number `after`, oldest first, with their sequence numbers."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT seq, {_JOB_COLUMNS} FROM jobs WHERE {_QUEUED} AND seq > ? ORDER BY seq", (after,)
+            ).fetchall()
+        return [(row[0], _job_from_row(row[1:])) for row in rows]
+
+    def update_jobs(self, jobs: List[GenerationJob]) -> None:
+        """Record the dispatch outcome of jobs sent together; counts them as sent unless they failed."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET dispatched_at = ?, batch_id = ?, batch_offset = ?, error = ? WHERE job_id = ?",
+                [(job.dispatched_at, job.batch_id, job.offset, job.error, job.job_id) for job in jobs]
+            )
+            if all(job.error is None for job in jobs):
+                self._increment("batches_sent", 1)
+                self._increment("jobs_sent", len(jobs))
+            self._commit()
+
+    # Batches
+
+    def put_batches(self, states: List[BatchState]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO batches (batch_id, total, enqueued_at, pending, in_progress, completed, "
+                "failed, canceled, started_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (batch_id) DO UPDATE SET pending = excluded.pending, "
+                "in_progress = excluded.in_progress, completed = excluded.completed, "
+                "failed = excluded.failed, canceled = excluded.canceled, "
+                "started_at = excluded.started_at, finished_at = excluded.finished_at",
+                [astuple(state) for state in states]
+            )
+            self._conn.execute(
+                "DELETE FROM batches WHERE seq <= (SELECT MAX(seq) FROM batches) - ? AND finished_at IS NOT NULL",
+                (self.retain_batches,)
+            )
+            self._commit()
+
+    def get_batch(self, batch_id: str) -> Optional[BatchState]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT batch_id, total, enqueued_at, pending, in_progress, completed, failed, canceled, "
+                "started_at, finished_at FROM batches WHERE batch_id = ?", (batch_id,)
+            ).fetchone()
+        return BatchState(*row) if row is not None else None
+
+    def active_batches(self) -> List[BatchState]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT batch_id, total, enqueued_at, pending, in_progress, completed, failed, canceled, "
+                "started_at, finished_at FROM batches WHERE finished_at IS NULL ORDER BY seq"
+            ).fetchall()
+        return [BatchState(*row) for row in rows]
+
+    # Events
+
+    def add_events(self, events: List[dict]) -> None:
+        with self._lock:
+            self._conn.executemany("INSERT INTO events (data) VALUES (?)", [(json.dumps(e),) for e in events])
+            self._conn.execute(
+                "DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?", (self.retain_events,)
+            )
+            self._commit()
+
+    def last_event_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def events_after(self, event_id: int) -> List[Tuple[int, dict]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, data FROM events WHERE id > ? ORDER BY id", (event_id,)
+            ).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    # Counters
+
+    def _increment(self, name: str, amount: int) -> None:
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value",
+            (name, amount)
+        )
+
+    def set_counters(self, values: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
+                [(name, json.dumps(value)) for name, value in values.items()]
+            )
+            self._commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and every counter, as one snapshot."""
+        with self._lock:
+            queued_jobs, queued_images = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(quantity), 0) FROM jobs WHERE {_QUEUED}"
+            ).fetchone()
+            outstanding = self._conn.execute(
+                "SELECT COUNT(*) FROM batches WHERE finished_at IS NULL"
+            ).fetchone()[0]
+            counters = self._conn.execute("SELECT name, value FROM counters").fetchall()
+        stats = {name: json.loads(value) for name, value in counters}
+        stats.update(queued_jobs=queued_jobs, queued_images=queued_images, outstanding_batches=outstanding)
+        return stats
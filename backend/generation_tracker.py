@@ -0,0 +1,235 @@
+from collections import deque
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional
+from invokeai_client import InvokeAIClient
+from events import EventBroadcaster
+from generation_store import GenerationStore, BatchState
+import asyncio
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# How often every worker process checks the shared store for new events and stats
+FOLLOW_INTERVAL = 0.25
+
+class GenerationTracker:
+    """Tracks enqueued InvokeAI batches from one shared polling task.
+
+    A single task polls the status of every active batch plus the queue
+    backlog, so the cost doesn't grow with the number of clients waiting.
+    Per-image durations are measured from observed completions and kept in
+    a rolling window, which drives all time estimates.
+
+    Batch state, events and the measured speed live in the shared `store`.
+    Only the process holding the leader lock polls (`start(poll=True)`, or
+    `start_polling()` on takeover); every process follows the store and
+    republishes progress and completion on its own `events`, so any worker
+    can serve status and event streams.
+    """
+
+    def __init__(
+        self,
+        client: InvokeAIClient,
+        store: GenerationStore,
+        queue_id: str = "default",
+        poll_interval: float = 1.0,
+        default_seconds_per_image: float = 15.0,
+        window: int = 20
+    ):
+        self.client = client
+        self.store = store
+        self.queue_id = queue_id
+        self.poll_interval = poll_interval
+        self.default_seconds_per_image = default_seconds_per_image
+        self.events = EventBroadcaster()
+        # Last snapshot of store.stats(), refreshed by _follow
+        self.shared: Dict[str, Any] = {}
+        self._batches: Dict[str, BatchState] = {}
+        self._samples: deque = deque(maxlen=window)
+        self._last_completion_at: Optional[float] = None
+        self._queue_backlog = 0
+        self._last_event_id = 0
+        self._listeners: List[Callable[[BatchState], None]] = []
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.polling = False
+
+    async def start(self, poll: bool = True) -> None:
+        self._last_event_id = await asyncio.to_thread(self.store.last_event_id)
+        self.shared = await asyncio.to_thread(self.store.stats)
+        self._tasks = [asyncio.create_task(self._follow())]
+        if poll:
+            await self.start_polling()
+
+    async def start_polling(self) -> None:
+        """Resume polling the batches still active in the store; also promotes a follower."""
+        if self.polling:
+            return
+        self.polling = True
+        stats = await asyncio.to_thread(self.store.stats)
+        self._samples.extend(stats.get("samples", []))
+        self._queue_backlog = stats.get("queue_backlog", 0)
+        for state in await asyncio.to_thread(self.store.active_batches):
+            self._batches[state.batch_id] = state
+        self._tasks.append(asyncio.create_task(self._run()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.polling = False
+
+    @property
+    def seconds_per_image(self) -> float:
+        """Rolling average of measured seconds per image."""
+        return self.shared.get("seconds_per_image") or self.default_seconds_per_image
+
+    def estimate(self, quantity: int) -> float:
+        """Seconds until `quantity` newly enqueued images are done, behind the current backlog."""
+        return (self.shared.get("queue_backlog", 0) + quantity) * self.seconds_per_image
+
+    async def track(self, batch_id: str, total: int) -> BatchState:
+        state = BatchState(batch_id=batch_id, total=total, pending=total, enqueued_at=time.time())
+        self._batches[batch_id] = state
+        self._queue_backlog += total
+        await asyncio.to_thread(self.store.put_batches, [state])
+        self._wake.set()
+        await self.publish([self._event("batch_queued", state)])
+        return state
+
+    async def publish(self, events: List[dict]) -> None:
+        """Publish events to subscribers in every worker process."""
+        await asyncio.to_thread(self.store.add_events, events)
+
+    def add_listener(self, callback: Callable[[BatchState], None]) -> None:
+        """Register a callback invoked with each batch as it finishes."""
+        self._listeners.append(callback)
+
+    async def get(self, batch_id: str) -> Optional[BatchState]:
+        return await asyncio.to_thread(self.store.get_batch, batch_id)
+
+    def describe(self, state: BatchState) -> dict:
+        data = asdict(state)
+        data["status"] = state.status
+        remaining = state.total - state.done
+        data["eta_seconds"] = None if state.finished else round(remaining * self.seconds_per_image, 1)
+        return data
+
+    def _event(self, event_type: str, state: BatchState) -> dict:
+        return {"type": event_type, **self.describe(state)}
+
+    def on_photos_added(self, names: List[str]) -> None:
+        """Forward newly arrived images to subscribers while generations are running.
+
+        Every worker process sees new photos itself, so this only reaches
+        this process's subscribers.
+        """
+        if self.shared.get("outstanding_batches"):
+            self.events.publish([{"type": "image_ready", "name": name} for name in names])
+
+    async def _follow(self) -> None:
+        while True:
+            try:
+                if await asyncio.to_thread(self.store.changed):
+                    events = await asyncio.to_thread(self.store.events_after, self._last_event_id)
+                    if events:
+                        self._last_event_id = events[-1][0]
+                        self.events.publish([event for _, event in events])
+                    self.shared = await asyncio.to_thread(self.store.stats)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not read generation state: {e}")
+            await asyncio.sleep(FOLLOW_INTERVAL)
+
+    @property
+    def _active(self) -> List[BatchState]:
+        return [state for state in self._batches.values() if not state.finished]
+
+    async def _run(self) -> None:
+        while True:
+            if not self._active:
+                self._wake.clear()
+                await self._wake.wait()
+            try:
+                await self._poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Polling InvokeAI queue failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _poll(self) -> None:
+        active = self._active
+        responses = await asyncio.gather(
+            self.client.get(f"/api/v1/queue/{self.queue_id}/status"),
+            *(self.client.get(f"/api/v1/queue/{self.queue_id}/b/{state.batch_id}/status") for state in active),
+            return_exceptions=True
+        )
+        queue_response, batch_responses = responses[0], responses[1:]
+        if not isinstance(queue_response, Exception) and queue_response.status_code == 200:
+            queue = queue_response.json().get("queue", {})
+            self._queue_backlog = queue.get("pending", 0) + queue.get("in_progress", 0)
+
+        now = time.time()
+        events = []
+        for state, response in zip(active, batch_responses):
+            if isinstance(response, Exception):
+                continue
+            if response.status_code == 404:
+                # Pruned or cleared from InvokeAI's queue; stop waiting for it
+                state.canceled = state.total - state.completed - state.failed
+                state.pending = state.in_progress = 0
+                state.finished_at = now
+                events.append(self._event("batch_finished", state))
+            elif response.status_code == 200:
+                events.extend(self._update(state, response.json(), now))
+        await asyncio.to_thread(self.store.put_batches, active)
+        await asyncio.to_thread(self.store.set_counters, {
+            "queue_backlog": self._queue_backlog,
+            "samples": list(self._samples),
+            "seconds_per_image": sum(self._samples) / len(self._samples) if self._samples else None,
+        })
+        if events:
+            await self.publish(events)
+        for state in active:
+            if state.finished:
+                del self._batches[state.batch_id]
+                self._notify(state)
+
+    def _notify(self, state: BatchState) -> None:
+        for callback in self._listeners:
+            try:
+                callback(state)
+            except Exception as e:
+                logger.error(f"Generation listener failed: {e}")
+
+    def _update(self, state: BatchState, status: dict, now: float) -> List[dict]:
+        previous_done = state.done
+        previous_completed = state.completed
+        state.pending = status.get("pending", state.pending)
+        state.in_progress = status.get("in_progress", state.in_progress)
+        state.completed = status.get("completed", state.completed)
+        state.failed = status.get("failed", state.failed)
+        state.canceled = status.get("canceled", state.canceled)
+        if state.started_at is None and (state.in_progress or state.done):
+            state.started_at = now
+
+        if state.done <= previous_done:
+            return []
+        # The GPU works through images one at a time, so time since the last
+        # finished image (or since this batch started) is spread over the new
+        # ones. Failed and canceled images say nothing about generation speed:
+        # they only move the starting point of the next sample
+        newly_completed = state.completed - previous_completed
+        since = max(filter(None, (self._last_completion_at, state.started_at, state.enqueued_at)))
+        if newly_completed > 0 and now > since:
+            per_image = (now - since) / newly_completed
+            self._samples.extend([per_image] * min(newly_completed, self._samples.maxlen))
+        self._last_completion_at = now
+
+        if state.done >= state.total:
+            state.finished_at = now
+            return [self._event("batch_finished", state)]
+        return [self._event("batch_progress", state)]
@@ -0,0 +1,354 @@
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from photo_index import PhotoIndex, PhotoEntry, IndexChanges
+from pathlib import Path
+from sqlite_db import open_sqlite
+from PIL import Image
+import asyncio
+import hashlib
+import logging
+import math
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Placeholder detail: BlurHash components across and down, and the edge
+# of the downscaled image they are computed from
+BLURHASH_COMPONENTS = (4, 3)
+SAMPLE_EDGE = 32
+# How often a process that doesn't extract checks the store for new features
+FOLLOW_INTERVAL = 5.0
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+@dataclass
+class ImageFeatures:
+    mtime_ns: int
+    size: int
+    width: int
+    height: int
+    blurhash: str
+    dominant_color: str
+
+    def matches(self, entry: PhotoEntry) -> bool:
+        return self.mtime_ns == entry.mtime_ns and self.size == entry.size
+
+def _fingerprint(name: str, features: ImageFeatures) -> int:
+    digest = hashlib.blake2b(f"{name}\0{features.mtime_ns}\0{features.size}".encode(), digest_size=8)
+    return int.from_bytes(digest.digest(), "big")
+
+def _encode83(value: int, length: int) -> str:
+    return "".join(_BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+_SRGB_TO_LINEAR = [_srgb_to_linear(value) for value in range(256)]
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+def _sign_pow(value: float, exponent: float) -> float:
+    return math.copysign(abs(value) ** exponent, value)
+
+def encode_blurhash(img: Image.Image, x_components: int = 4, y_components: int = 3) -> str:
+    """BlurHash of an RGB image; meant for images of a few dozen pixels."""
+    width, height = img.size
+    raw = img.tobytes()
+    linear = [
+        (_SRGB_TO_LINEAR[raw[k]], _SRGB_TO_LINEAR[raw[k + 1]], _SRGB_TO_LINEAR[raw[k + 2]])
+        for k in range(0, len(raw), 3)
+    ]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors: List[Tuple[float, float, float]] = []
+    for j in range(y_components):
+        for i in range(x_components):
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                basis_y = cos_y[j][y]
+                for x in range(width):
+                    basis = cos_x[i][x] * basis_y
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(v) for factor in ac for v in factor)
+        quantised_max = max(0, min(82, int(math.floor(actual_max * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+        result += _encode83(quantised_max, 1)
+    else:
+        max_value = 1.0
+        result += _encode83(0, 1)
+    result += _encode83(
+        (_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4
+    )
+
+    def quantise(v: float) -> int:
+        return max(0, min(18, int(math.floor(_sign_pow(v / max_value, 0.5) * 9 + 9.5))))
+
+    for r, g, b in ac:
+        result += _encode83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return result
+
+def dominant_color(img: Image.Image) -> str:
+    """Most common colour of a small RGB image after median-cut quantization, as #rrggbb."""
+    quantized = img.quantize(colors=5, method=Image.Quantize.MEDIANCUT)
+    count, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+def extract_features(image_path: str) -> Dict[str, Any]:
+    """Dimensions, BlurHash and dominant colour of one image. Runs inside a worker process."""
+    with Image.open(image_path) as img:
+        width, height = img.size
+        # Decode at reduced scale where the format allows it
+        img.draft("RGB", (SAMPLE_EDGE * 2, SAMPLE_EDGE * 2))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGBA")
+        img.thumbnail((SAMPLE_EDGE, SAMPLE_EDGE), Image.Resampling.BILINEAR, reducing_gap=2)
+        small = img.convert("RGB")
+    return {
+        "width": width,
+        "height": height,
+        "blurhash": encode_blurhash(small, *BLURHASH_COMPONENTS),
+        "dominant_color": dominant_color(small),
+    }
+
+class FeatureStore:
+    """SQLite persistence for image features, loaded into memory at startup."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._data_version = None
+
+    def open(self) -> Dict[str, ImageFeatures]:
+        """Open the database and return every stored row."""
+        self._conn = open_sqlite(self.db_path, [
+            "CREATE TABLE IF NOT EXISTS features ("
+            "name TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, "
+            "width INTEGER NOT NULL, height INTEGER NOT NULL, "
+            "blurhash TEXT NOT NULL, dominant_color TEXT NOT NULL)"
+        ])
+        self.changed()
+        return self.load()
+
+    def load(self) -> Dict[str, ImageFeatures]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, mtime_ns, size, width, height, blurhash, dominant_color FROM features"
+            ).fetchall()
+        return {row[0]: ImageFeatures(*row[1:]) for row in rows}
+
+    def changed(self) -> bool:
+        """Whether another connection, e.g. another process, wrote since the last call."""
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        changed, self._data_version = data_version != self._data_version, data_version
+        return changed
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def put_many(self, rows: List[Tuple[str, ImageFeatures]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(name, *asdict(features).values()) for name, features in rows]
+            )
+            self._conn.commit()
+
+    def delete(self, names: List[str]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM features WHERE name = ?", [(n,) for n in names])
+            self._conn.commit()
+
+class FeatureExtractor:
+    """Computes ImageFeatures for every indexed photo in the background.
+
+    Photos without current features are queued newest first at startup and
+    again whenever the index reports them added or modified. Extraction runs
+    through `run_in_pool` so decoding and hashing stay off the event loop;
+    results are written to the store in small batches.
+
+    In a multi-worker deployment one process extracts; the others start
+    with `extract=False` and pick up its results from the store.
+    """
+
+    def __init__(
+        self,
+        index: PhotoIndex,
+        store: FeatureStore,
+        run_in_pool: Callable[..., Awaitable[Any]],
+        concurrency: int = 2,
+        flush_every: int = 64
+    ):
+        self.index = index
+        self.store = store
+        self.run_in_pool = run_in_pool
+        self.concurrency = concurrency
+        self.flush_every = flush_every
+        self._features: Dict[str, ImageFeatures] = {}
+        self._queue: deque = deque()
+        self._queued: set = set()
+        self._pending_writes: List[Tuple[str, ImageFeatures]] = []
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.extracted = 0
+        self.failed = 0
+        self.extracting = False
+        # XOR of per-photo fingerprints, so processes holding the same
+        # features agree on it regardless of the order they got them in
+        self._digest = 0
+
+    @property
+    def version(self) -> str:
+        """Part of listing ETags; changes whenever any features do."""
+        return f"{self._digest:016x}"
+
+    async def start(self, extract: bool = True) -> None:
+        self._replace(await asyncio.to_thread(self.store.open))
+        if extract:
+            self.start_extracting()
+        else:
+            self._tasks = [asyncio.create_task(self._follow())]
+        logger.info(f"Image features loaded for {len(self._features)} photos, {len(self._queue)} queued")
+
+    def start_extracting(self) -> None:
+        """Queue photos without current features and start extracting; also promotes a follower."""
+        if self.extracting:
+            return
+        for task in self._tasks:
+            task.cancel()
+        self.extracting = True
+        names, _ = self.index.page()
+        for name in names:
+            entry = self.index.get(name)
+            if entry is not None and not self._is_current(name, entry):
+                self._enqueue(name)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._flush_periodically()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._flush()
+        self.store.close()
+
+    def _set(self, name: str, features: ImageFeatures) -> None:
+        previous = self._features.get(name)
+        if previous is not None:
+            self._digest ^= _fingerprint(name, previous)
+        self._features[name] = features
+        self._digest ^= _fingerprint(name, features)
+
+    def _drop(self, name: str) -> None:
+        previous = self._features.pop(name, None)
+        if previous is not None:
+            self._digest ^= _fingerprint(name, previous)
+
+    def _replace(self, features: Dict[str, ImageFeatures]) -> None:
+        self._features = {}
+        self._digest = 0
+        for name, value in features.items():
+            self._set(name, value)
+
+    async def _follow(self) -> None:
+        while True:
+            await asyncio.sleep(FOLLOW_INTERVAL)
+            try:
+                if await asyncio.to_thread(self.store.changed):
+                    self._replace(await asyncio.to_thread(self.store.load))
+            except sqlite3.Error as e:
+                logger.warning(f"Could not reload image features: {e}")
+
+    def _is_current(self, name: str, entry: PhotoEntry) -> bool:
+        features = self._features.get(name)
+        return features is not None and features.matches(entry)
+
+    def _enqueue(self, name: str) -> None:
+        if name not in self._queued:
+            self._queued.add(name)
+            self._queue.append(name)
+            self._wake.set()
+
+    def get(self, entry: PhotoEntry) -> Optional[ImageFeatures]:
+        """Features of the photo's current version, if already extracted."""
+        features = self._features.get(entry.name)
+        return features if features is not None and features.matches(entry) else None
+
+    async def on_change(self, changes: IndexChanges) -> None:
+        if not self.extracting:
+            # The extracting process updates the store; _follow picks it up
+            for name in changes.removed:
+                self._drop(name)
+            return
+        for name in changes.added + changes.modified:
+            self._enqueue(name)
+        if changes.removed:
+            for name in changes.removed:
+                self._drop(name)
+            await asyncio.to_thread(self.store.delete, changes.removed)
+
+    async def _work(self) -> None:
+        while True:
+            while not self._queue:
+                self._wake.clear()
+                await self._wake.wait()
+            name = self._queue.popleft()
+            self._queued.discard(name)
+            entry = self.index.get(name)
+            if entry is None or self._is_current(name, entry):
+                continue
+            try:
+                result = await self.run_in_pool(extract_features, str(self.index.photo_dir / name))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.debug(f"Feature extraction failed for {name}: {e}")
+                continue
+            features = ImageFeatures(mtime_ns=entry.mtime_ns, size=entry.size, **result)
+            self._set(name, features)
+            self._pending_writes.append((name, features))
+            self.extracted += 1
+            if len(self._pending_writes) >= self.flush_every:
+                await self._flush()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(5)
+            await self._flush()
+
+    async def _flush(self) -> None:
+        rows, self._pending_writes = self._pending_writes, []
+        if rows:
+            await asyncio.to_thread(self.store.put_many, rows)
+
+    def stats(self) -> dict:
+        return {
+            "photos_with_features": len(self._features),
+            "queued": len(self._queue),
+            "extracted": self.extracted,
+            "failed": self.failed,
+        }
@@ -0,0 +1,115 @@
+from typing import Optional
+from metrics import INVOKEAI_REQUEST_SECONDS, INVOKEAI_REQUESTS
+import asyncio
+import httpx
+import logging
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Methods that can be replayed even if the first attempt may have reached InvokeAI
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRYABLE_STATUS = {502, 503, 504}
+
+_PATH_PARAMS = re.compile(r"/(i|b|queue)/[^/]+")
+_PATH_PARAM_NAMES = {"i": "image_name", "b": "batch_id", "queue": "queue_id"}
+
+def endpoint_template(path: str) -> str:
+    """InvokeAI path with image names and queue/batch ids replaced, for metric labels."""
+    path = path.split("?", 1)[0]
+    return _PATH_PARAMS.sub(lambda m: f"/{m.group(1)}/{{{_PATH_PARAM_NAMES[m.group(1)]}}}", path)
+
+class InvokeAIClient:
+    """Shared, pooled HTTP client for all InvokeAI traffic.
+
+    One `httpx.AsyncClient` lives for the lifetime of the app so connections
+    to InvokeAI are kept alive and reused. Transient failures are retried
+    with exponential backoff and jitter: idempotent requests on any transport
+    error or 502/503/504, other requests only when the connection could not
+    be established, so a batch is never enqueued twice.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: httpx.Timeout,
+        limits: httpx.Limits,
+        retries: int = 3,
+        backoff: float = 0.2,
+        max_backoff: float = 5.0
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.limits = limits
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("InvokeAI client used before start()")
+        return self._client
+
+    def _delay(self, attempt: int) -> float:
+        # Full jitter keeps a burst of failing requests from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _should_retry(self, method: str, error: Optional[Exception], status: Optional[int]) -> bool:
+        if method in IDEMPOTENT_METHODS:
+            return isinstance(error, httpx.TransportError) or status in RETRYABLE_STATUS
+        # Only errors raised before the request left this process are safe to replay
+        return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a request, retrying transient failures. Accepts httpx request kwargs."""
+        method = method.upper()
+        attempt = 0
+        while True:
+            error: Optional[Exception] = None
+            response: Optional[httpx.Response] = None
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            status = response.status_code if response is not None else None
+            endpoint = endpoint_template(path)
+            INVOKEAI_REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, endpoint=endpoint)
+            INVOKEAI_REQUESTS.inc(
+                method=method, endpoint=endpoint,
+                outcome=status if error is None else type(error).__name__
+            )
+            if attempt >= self.retries or not self._should_retry(method, error, status):
+                if error is not None:
+                    raise error
+                return response
+            delay = self._delay(attempt)
+            logger.warning(
+                f"InvokeAI {method} {path} failed ({error or status}), "
+                f"retrying in {delay:.2f}s ({attempt + 1}/{self.retries})"
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
@@ -1,91 +1,174 @@
-from fastapi import Request, HTTPException
+from fastapi import Request
+from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
-from typing import List, Set, Optional
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import bisect
 import ipaddress
 import logging
-from pathlib import Path
+import os
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+class IPRangeTable:
+    """Whitelisted networks compiled into sorted, merged integer ranges.
+
+    Each IP version keeps parallel lists of range starts and ends, so a
+    lookup is one bisect regardless of how many networks are listed.
+    """
+
+    def __init__(self, networks: Iterable[IPNetwork]):
+        self.networks = sorted(set(networks), key=lambda n: (n.version, n))
+        self._ranges: Dict[int, Tuple[List[int], List[int]]] = {}
+        for version in (4, 6):
+            spans = sorted(
+                (int(n.network_address), int(n.broadcast_address))
+                for n in self.networks if n.version == version
+            )
+            starts: List[int] = []
+            ends: List[int] = []
+            for start, end in spans:
+                # Merge overlapping or adjacent ranges
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._ranges[version] = (starts, ends)
+
+    def __contains__(self, address: IPAddress) -> bool:
+        starts, ends = self._ranges[address.version]
+        value = int(address)
+        i = bisect.bisect_right(starts, value) - 1
+        return i >= 0 and value <= ends[i]
+
+    def match(self, address: IPAddress) -> List[IPNetwork]:
+        """Networks containing `address`; only used for diagnostics."""
+        return [n for n in self.networks if n.version == address.version and address in n]
+
+def parse_address(ip: str) -> IPAddress:
+    address = ipaddress.ip_address(ip.split("%", 1)[0])
+    # Dual-stack sockets report IPv4 clients as ::ffff:a.b.c.d
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
 class IPWhitelistMiddleware(BaseHTTPMiddleware):
     def __init__(
         self,
         app,
         whitelist_file: Optional[str] = None,
         whitelist: Optional[List[str]] = None,
-        always_allow: Optional[List[str]] = None
+        always_allow: Optional[List[str]] = None,
+        reload_interval: float = 2.0,
+        decision_cache_size: int = 4096
     ):
         super().__init__(app)
-        self.allowed_ips: Set[ipaddress.IPv4Network] = set()
+        self.whitelist_file = whitelist_file
+        self.whitelist = list(whitelist or [])
         self.always_allow = set(always_allow or ["127.0.0.1", "::1"])
-        
-        # Load IPs from whitelist file if provided
-        if whitelist_file:
-            self._load_from_file(whitelist_file)
-            
-        # Add IPs from direct whitelist if provided
-        if whitelist:
-            self._add_ips(whitelist)
-            
-        logger.info("IP Whitelist Middleware initialized with networks: %s", self.allowed_ips)
-
-    def _load_from_file(self, file_path: str) -> None:
+        self.reload_interval = reload_interval
+        self.decision_cache_size = decision_cache_size
+        self._decisions: Dict[str, bool] = {}
+        self._file_mtime: Optional[float] = None
+        self._next_reload_check = 0.0
+
+        self.table = self._compile()
+        logger.info("IP Whitelist Middleware initialized with networks: %s", self.table.networks)
+
+    def _load_from_file(self, file_path: str) -> List[str]:
         """Load IP addresses from a file, one per line."""
         try:
             with open(file_path, 'r') as f:
-                ips = [line.strip() for line in f.readlines() if line.strip() and not line.startswith('#')]
-                self._add_ips(ips)
+                self._file_mtime = os.fstat(f.fileno()).st_mtime
+                return [line.strip() for line in f.readlines() if line.strip() and not line.startswith('#')]
         except Exception as e:
             logger.error(f"Failed to load IP whitelist from file {file_path}: {e}")
             raise RuntimeError(f"Failed to load IP whitelist: {e}")
 
-    def _add_ips(self, ips: List[str]) -> None:
-        """Add IP addresses or networks to the whitelist."""
+    def _parse_networks(self, ips: List[str]) -> List[IPNetwork]:
+        """Parse IP addresses or networks, IPv4 or IPv6."""
+        networks = []
         for ip in ips:
             try:
                 # Handle both individual IPs and CIDR notation
-                network = ipaddress.IPv4Network(ip, strict=False)
-                self.allowed_ips.add(network)
-                logger.info(f"Added {network} to IP whitelist")
+                networks.append(ipaddress.ip_network(ip, strict=False))
             except ValueError as e:
                 logger.error(f"Invalid IP address or network '{ip}': {e}")
                 raise ValueError(f"Invalid IP address or network '{ip}'")
+        return networks
+
+    def _compile(self) -> IPRangeTable:
+        ips = list(self.whitelist) + list(self.always_allow)
+        if self.whitelist_file:
+            ips += self._load_from_file(self.whitelist_file)
+        return IPRangeTable(self._parse_networks(ips))
+
+    def _maybe_reload(self) -> None:
+        """Recompile the whitelist if its file changed; checked at most every reload_interval."""
+        now = time.monotonic()
+        if not self.whitelist_file or now < self._next_reload_check:
+            return
+        self._next_reload_check = now + self.reload_interval
+        try:
+            mtime = os.stat(self.whitelist_file).st_mtime
+        except OSError:
+            return
+        if mtime == self._file_mtime:
+            return
+        try:
+            table = self._compile()
+        except (RuntimeError, ValueError) as e:
+            # Keep enforcing the last good whitelist
+            self._file_mtime = mtime
+            logger.error(f"Not reloading IP whitelist: {e}")
+            return
+        self.table = table
+        self._decisions = {}
+        logger.info("IP whitelist reloaded with networks: %s", table.networks)
 
     def _is_ip_allowed(self, ip: str) -> bool:
         """Check if an IP address is allowed."""
-        if ip in self.always_allow:
-            logger.info(f"Allowed request from always-allowed IP: {ip}")
-            return True
-            
-        try:
-            client_ip = ipaddress.IPv4Address(ip)
-            allowed = any(client_ip in network for network in self.allowed_ips)
-            if allowed:
-                matching_networks = [net for net in self.allowed_ips if client_ip in net]
-                logger.info(f"Allowed request from IP: {ip} (matched networks: {matching_networks})")
-            else:
-                logger.warning(f"Blocked request from non-whitelisted IP: {ip}")
+        allowed = self._decisions.get(ip)
+        if allowed is not None:
             return allowed
+
+        try:
+            address = parse_address(ip)
+            allowed = address in self.table
         except ValueError:
             logger.warning(f"Invalid IP address format: {ip}")
-            return False
+            allowed = False
+        else:
+            if allowed:
+                logger.info(f"Allowed IP: {ip} (matched networks: {self.table.match(address)})")
+            else:
+                logger.warning(f"Blocked non-whitelisted IP: {ip}")
+
+        # Decisions are logged once; the cache is dropped wholesale when full
+        if len(self._decisions) >= self.decision_cache_size:
+            self._decisions = {}
+        self._decisions[ip] = allowed
+        return allowed
 
     async def dispatch(self, request: Request, call_next):
         """Process the request and check if the client IP is whitelisted."""
-        client_ip = request.client.host
-        logger.info(f"Checking IP: {client_ip} for path: {request.url.path}")
-        
+        self._maybe_reload()
+        client_ip = request.client.host if request.client else ""
+
         if not self._is_ip_allowed(client_ip):
-            logger.warning(f"Access denied for IP: {client_ip} to path: {request.url.path}")
-            raise HTTPException(
+            logger.debug(f"Access denied for IP: {client_ip} to path: {request.url.path}")
+            return JSONResponse(
                 status_code=403,
-                detail="Access denied. Your IP is not whitelisted."
+                content={"detail": "Access denied. Your IP is not whitelisted."}
             )
-        
-        logger.info(f"Access granted for IP: {client_ip} to path: {request.url.path}")    
+
         return await call_next(request)
 
 def setup_ip_whitelist(app, whitelist_file: Optional[str] = None, whitelist: Optional[List[str]] = None):
@@ -94,4 +177,4 @@ def setup_ip_whitelist(app, whitelist_file: Optional[str] = None, whitelist: Opt
         IPWhitelistMiddleware,
         whitelist_file=whitelist_file,
         whitelist=whitelist
-    )
\ No newline at end of file
+    )
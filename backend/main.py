@@ -1,68 +1,148 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response
 from ip_whitelist import setup_ip_whitelist
+from gallery import Gallery
+from events import sse_response
+from generation_store import GenerationJob, QueueFullError
+from generation_graphs import SDXL_TXT2IMG
+from file_responses import FileRangeResponse, RangeNotSatisfiable, parse_range, if_range_matches
+from metadata_store import MetadataError
+from metrics import REGISTRY, CONTENT_TYPE, MetricsMiddleware, THUMBNAIL_REQUESTS
+from profiling import ProfileStore, ProfilerMiddleware
+from photo_export import iter_zip
+from thumbnails import ThumbnailError, ThumbnailBusyError, THUMBNAIL_FORMATS, DEFAULT_FORMAT, negotiate_format
+from settings import (
+    CACHE_CONTROL_FULL, CACHE_CONTROL_THUMBNAILS, DEFAULT_THUMBNAIL_SIZE_CLASS, DISPLAY_SIZE_CLASS,
+    DISPLAY_VARIANTS, EXPORT_CHUNK_SIZE, MAX_BULK_PHOTOS, MAX_METADATA_BATCH, MAX_PAGE_SIZE,
+    PHOTO_DIR, PROFILE_INTERVAL, PROFILE_TOKEN, SSE_KEEPALIVE_INTERVAL, THUMBNAIL_SIZE_CLASSES
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from email.utils import formatdate, parsedate_to_datetime
 from pydantic import BaseModel, Field
 import httpx
+import asyncio
+import logging
 import os
-import string
 import random
-import hashlib
 import aiofiles
 import json
-from PIL import Image
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from fastapi.staticfiles import StaticFiles
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
-# Setup IP whitelist - must come before CORS middleware
-setup_ip_whitelist(app, whitelist_file="ip_whitelist.txt")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    gallery = Gallery()
+    await gallery.start()
+    app.state.gallery = gallery
+    yield
+    await gallery.stop()
 
-# Enable CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def create_app() -> FastAPI:
+    """Build the API app; its services are created when the lifespan starts.
+
+    Run it with `uvicorn main:create_app --factory`.
+    """
+    app = FastAPI(lifespan=lifespan)
+
+    # Setup IP whitelist - must come before CORS middleware
+    setup_ip_whitelist(app, whitelist_file="ip_whitelist.txt")
+
+    # Enable CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.state.profile_store = ProfileStore()
+    # Added last so they wrap everything, including the whitelist
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(
+        ProfilerMiddleware, store=app.state.profile_store, token=PROFILE_TOKEN, interval=PROFILE_INTERVAL
+    )
+    app.include_router(router)
+    return app
+
+def get_gallery(request: Request) -> Gallery:
+    return request.app.state.gallery
+
+def _check_photo_name(name: str) -> None:
+    """Reject names that aren't a plain file name inside PHOTO_DIR."""
+    if not name or Path(name).name != name or name.startswith("."):
+        raise HTTPException(status_code=400, detail=f"Invalid filename: {name!r}")
 
-# Constants
-INVOKEAI_BASE_URL = "http://localhost:9090"
-ESTIMATED_TIME_PER_IMAGE = 15
-THUMBNAIL_SIZE = (300, 300)
-THUMBNAIL_QUALITY = 85
-CACHE_CONTROL_THUMBNAILS = "public, max-age=604800"
-CACHE_CONTROL_FULL = "public, max-age=31536000"
-PHOTO_DIR = Path("photos").resolve()
-THUMBNAIL_DIR = Path("thumbnails").resolve()
-
-# Create required directories
-for directory in [PHOTO_DIR, THUMBNAIL_DIR]:
-    if not directory.exists():
-        directory.mkdir(parents=True, exist_ok=True)
-
-def _generate_random_id(length: int = 8) -> str:
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
-
-def get_thumbnail_path(original_path: Path) -> Path:
-    unique_id = str(original_path)
-    filename_hash = hashlib.md5(unique_id.encode()).hexdigest()
-    return THUMBNAIL_DIR / f"{original_path.stem}_{filename_hash}.webp"
-
-async def create_thumbnail(image_path: Path, thumbnail_path: Path):
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+def _not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """Evaluate If-None-Match, falling back to If-Modified-Since when it is absent."""
+    if "if-none-match" in request.headers:
+        return _etag_matches(request, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since:
+        return False
+    try:
+        return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def _resolve_size_class(size: Optional[str], width: Optional[int]) -> str:
+    """Map a size class name or a display width in pixels to a size class."""
+    if size is not None:
+        if size not in THUMBNAIL_SIZE_CLASSES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown size '{size}', expected one of {list(THUMBNAIL_SIZE_CLASSES)}"
+            )
+        return size
+    if width is not None:
+        # Smallest class that covers the requested width, else the largest
+        for size_class, edge in sorted(THUMBNAIL_SIZE_CLASSES.items(), key=lambda item: item[1]):
+            if edge >= width:
+                return size_class
+        return max(THUMBNAIL_SIZE_CLASSES, key=THUMBNAIL_SIZE_CLASSES.get)
+    return DEFAULT_THUMBNAIL_SIZE_CLASS
+
+async def create_thumbnail(
+    gallery: Gallery,
+    image_path: Path,
+    thumbnail_path: Path,
+    size_class: str = DEFAULT_THUMBNAIL_SIZE_CLASS,
+    fmt: str = DEFAULT_FORMAT,
+    block: bool = False
+):
     try:
-        with Image.open(image_path) as img:
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-            img.save(thumbnail_path, 'WEBP', quality=THUMBNAIL_QUALITY)
+        await gallery.render_thumbnail(image_path, thumbnail_path, size_class, fmt, block)
+    except ThumbnailBusyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Thumbnail generation is busy, retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    except ThumbnailError as e:
+        # Already names the photo
+        logger.error(str(e))
+        raise HTTPException(status_code=500, detail="Error creating thumbnail")
     except Exception as e:
-        print(f"Error creating thumbnail for {image_path}: {e}")
+        logger.error(f"Error creating thumbnail for {image_path}: {e}")
         raise HTTPException(status_code=500, detail="Error creating thumbnail")
 
+
+router = APIRouter()
+
 # Models
 class GenerationRequest(BaseModel):
     image_name: str
@@ -70,69 +150,350 @@ class GenerationRequest(BaseModel):
     quantity: int = Field(ge=1, le=10, default=1)  # Limiting to max 10 images
     seed: Optional[int] = None
     use_random_seed: bool = True
+    # Higher runs first; equal priorities are served round-robin per client
+    priority: int = Field(ge=-10, le=10, default=0)
     metadata: Dict[Any, Any]
 
 class GenerationResponse(BaseModel):
     estimated_time: int
-    batch_id: str
+    job_id: str
     message: str
 
+class PhotoDetails(BaseModel):
+    name: str
+    mtime: float
+    size: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    aspect_ratio: Optional[float] = None
+    # Null until the background extractor has processed the photo
+    blurhash: Optional[str] = None
+    dominant_color: Optional[str] = None
+
+class MetadataBatchRequest(BaseModel):
+    image_names: List[str] = Field(max_length=MAX_METADATA_BATCH)
+
+class MetadataBatchResponse(BaseModel):
+    metadata: Dict[str, Any]
+    errors: Dict[str, str]
+
+class PhotoSelection(BaseModel):
+    filenames: List[str] = Field(min_length=1, max_length=MAX_BULK_PHOTOS)
+
+class BulkDeleteResponse(BaseModel):
+    deleted: List[str]
+    not_found: List[str]
+    errors: Dict[str, str]
+
+
+@router.get("/api/photos", response_model=List[str])
+async def list_photos(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    gallery: Gallery = Depends(get_gallery)
+):
+    """List photos newest first, served from the in-memory index.
+
+    Without `limit` the full listing is returned. When more results remain,
+    the cursor for the next page is sent in the `X-Next-Cursor` header.
+    """
+    try:
+        # Cheap when nothing changed: a single stat of PHOTO_DIR
+        await asyncio.to_thread(gallery.photo_index.refresh)
+
+        etag = gallery.photo_index.etag
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        try:
+            photos, next_cursor = gallery.photo_index.page(cursor, limit)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        response.headers["ETag"] = etag
+        response.headers["X-Total-Count"] = str(len(gallery.photo_index))
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return photos
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/photos", response_model=List[str])
-async def list_photos():
+@router.get("/api/photos/details", response_model=List[PhotoDetails])
+async def list_photo_details(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    gallery: Gallery = Depends(get_gallery)
+):
+    """Like /api/photos, with dimensions and placeholders so clients can lay out the grid upfront."""
     try:
-        photos = [f.name for f in PHOTO_DIR.glob("*") if f.is_file()]
-        return sorted(photos, key=lambda x: os.path.getmtime(PHOTO_DIR / x), reverse=True)
+        await asyncio.to_thread(gallery.photo_index.refresh)
+
+        etag = f'{gallery.photo_index.etag[:-1]}-{gallery.feature_extractor.version}"'
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        try:
+            names, next_cursor = gallery.photo_index.page(cursor, limit)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        photos = []
+        for name in names:
+            entry = gallery.photo_index.get(name)
+            if entry is None:
+                continue
+            features = gallery.feature_extractor.get(entry)
+            details = PhotoDetails(name=name, mtime=entry.mtime, size=entry.size, width=entry.width, height=entry.height)
+            if features is not None:
+                details.width, details.height = features.width, features.height
+                details.blurhash = features.blurhash
+                details.dominant_color = features.dominant_color
+            if details.width and details.height:
+                details.aspect_ratio = round(details.width / details.height, 4)
+            photos.append(details)
+
+        response.headers["ETag"] = etag
+        response.headers["X-Total-Count"] = str(len(gallery.photo_index))
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return photos
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/photos/{filename}")
-async def get_photo(filename: str, thumbnail: bool = False):
+@router.get("/api/photos/events")
+async def photo_events(request: Request, gallery: Gallery = Depends(get_gallery)):
+    """Stream photo added/modified/removed events as Server-Sent Events."""
+    return sse_response(request, gallery.photo_watcher.events, SSE_KEEPALIVE_INTERVAL)
+
+def _photo_headers(mtime: float, cache_control: str, etag: str) -> Dict[str, str]:
+    return {
+        "Cache-Control": cache_control,
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+    }
+
+def _photo_etag(mtime_ns: int, size: int, inode: int) -> str:
+    return f'"{mtime_ns:x}-{size:x}-{inode:x}"'
+
+def _file_response(request: Request, path: Path, stat: os.stat_result, headers: Dict[str, str]) -> Response:
+    """Send a file, honouring a single Range unless If-Range says it changed."""
+    byte_range = None
+    if if_range_matches(request.headers.get("if-range"), headers["ETag"], stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get("range"), stat.st_size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=416,
+                headers={**headers, "Content-Range": f"bytes */{stat.st_size}"}
+            )
+    return FileRangeResponse(path, stat.st_size, byte_range, headers=headers)
+
+async def _display_variant(gallery: Gallery, request: Request, original_path: Path) -> Response:
+    """Serve the web-optimized copy of a photo, generating it on first use."""
+    fmt = negotiate_format(request.headers.get("accept"))
+    entry = gallery.photo_index.get(original_path.name)
+    try:
+        stat = original_path.stat() if entry is None else None
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    display_path = gallery.thumbnail_path(original_path, DISPLAY_SIZE_CLASS, fmt, stat)
+
+    etag = f'"{display_path.name}"'
+    mtime = entry.mtime if entry is not None else stat.st_mtime
+    headers = _photo_headers(mtime, CACHE_CONTROL_FULL, etag)
+    headers["Vary"] = "Accept"
+    if _not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
+
+    for _ in range(2):
+        if not display_path.exists():
+            await create_thumbnail(gallery, original_path, display_path, DISPLAY_SIZE_CLASS, fmt)
+        try:
+            display_stat = await asyncio.to_thread(display_path.stat)
+        except FileNotFoundError:
+            # Evicted between generation and serving; generate it again
+            continue
+        gallery.thumbnail_cache.touch(display_path, original_path.name)
+        return _file_response(request, display_path, display_stat, headers)
+    raise HTTPException(status_code=500, detail="Error reading display variant")
+
+@router.get("/photos/{filename}")
+async def get_photo(
+    request: Request,
+    filename: str,
+    thumbnail: bool = False,
+    variant: Optional[str] = None,
+    gallery: Gallery = Depends(get_gallery)
+):
+    """Serve a photo with Range support; `variant=display` asks for the web-optimized copy."""
     try:
         file_path = PHOTO_DIR / filename
-        if not file_path.exists():
+        if variant is not None and variant != DISPLAY_SIZE_CLASS:
+            raise HTTPException(status_code=400, detail=f"Unknown variant '{variant}'")
+        if variant == DISPLAY_SIZE_CLASS and DISPLAY_VARIANTS:
+            return await _display_variant(gallery, request, file_path)
+
+        entry = gallery.photo_index.get(filename)
+        if entry is not None:
+            # Revalidation is answered from the index without touching the disk
+            etag = _photo_etag(entry.mtime_ns, entry.size, entry.inode)
+            headers = _photo_headers(entry.mtime, CACHE_CONTROL_FULL, etag)
+            if _not_modified(request, etag, entry.mtime):
+                return Response(status_code=304, headers=headers)
+        try:
+            # Content-Length and ranges must match the file as it is now
+            stat = await asyncio.to_thread(file_path.stat)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="Photo not found")
-        return FileResponse(
-            file_path,
-            headers={"Cache-Control": CACHE_CONTROL_FULL}
-        )
+        etag = _photo_etag(stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        headers = _photo_headers(stat.st_mtime, CACHE_CONTROL_FULL, etag)
+        if entry is None and _not_modified(request, etag, stat.st_mtime):
+            return Response(status_code=304, headers=headers)
+        return _file_response(request, file_path, stat, headers)
     except HTTPException as he:
         raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/photos/thumbnail/{filename}")
-async def get_photo_thumbnail(filename: str):
+async def _read_thumbnail(
+    gallery: Gallery,
+    original_path: Path,
+    thumbnail_path: Path,
+    size_class: str,
+    fmt: str
+) -> bytes:
+    """Read a thumbnail from disk, generating it first if it is missing."""
+    for _ in range(2):
+        if thumbnail_path.exists():
+            gallery.thumbnail_cache.touch(thumbnail_path, original_path.name)
+            result = "disk"
+        else:
+            await create_thumbnail(gallery, original_path, thumbnail_path, size_class, fmt)
+            result = "generated"
+        try:
+            content = await asyncio.to_thread(thumbnail_path.read_bytes)
+            THUMBNAIL_REQUESTS.inc(result=result)
+            return content
+        except FileNotFoundError:
+            # Evicted between the check and the read; generate it again
+            continue
+    raise HTTPException(status_code=500, detail="Error reading thumbnail")
+
+@router.get("/photos/thumbnail/{filename}")
+async def get_photo_thumbnail(
+    request: Request,
+    filename: str,
+    size: Optional[str] = None,
+    width: Optional[int] = Query(None, ge=1),
+    gallery: Gallery = Depends(get_gallery)
+):
+    """Serve a thumbnail sized by `size` class or display `width` in pixels.
+
+    The format (AVIF, WebP or JPEG) is negotiated from the Accept header.
+    Revalidations and hot thumbnails are answered from memory.
+    """
     try:
+        size_class = _resolve_size_class(size, width)
+        fmt = negotiate_format(request.headers.get("accept"))
+
         original_path = PHOTO_DIR / filename
-        if not original_path.exists():
+        entry = gallery.photo_index.get(filename)
+        try:
+            stat = original_path.stat() if entry is None else None
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="Photo not found")
-            
-        thumbnail_path = get_thumbnail_path(original_path)
-        if not thumbnail_path.exists():
-            await create_thumbnail(original_path, thumbnail_path)
-            
-        return FileResponse(
-            thumbnail_path,
-            headers={"Cache-Control": CACHE_CONTROL_THUMBNAILS}
-        )
+        thumbnail_path = gallery.thumbnail_path(original_path, size_class, fmt, stat)
+
+        # Thumbnail names are content-addressed, so the name is a strong validator
+        etag = f'"{thumbnail_path.name}"'
+        mtime = entry.mtime if entry is not None else stat.st_mtime
+        headers = _photo_headers(mtime, CACHE_CONTROL_THUMBNAILS, etag)
+        headers["Vary"] = "Accept"
+        if _not_modified(request, etag, mtime):
+            THUMBNAIL_REQUESTS.inc(result="not_modified")
+            return Response(status_code=304, headers=headers)
+
+        media_type = THUMBNAIL_FORMATS[fmt][1]
+        cached = gallery.thumbnail_bytes.get(str(thumbnail_path))
+        if cached is not None:
+            THUMBNAIL_REQUESTS.inc(result="memory")
+            gallery.thumbnail_cache.touch(thumbnail_path, filename)
+            return Response(content=cached.content, media_type=media_type, headers=headers)
+
+        content = await _read_thumbnail(gallery, original_path, thumbnail_path, size_class, fmt)
+        gallery.thumbnail_bytes.put(str(thumbnail_path), content, media_type)
+        return Response(content=content, media_type=media_type, headers=headers)
     except HTTPException as he:
         raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/api/photos/{filename}")
-async def delete_photo(filename: str):
+@router.get("/api/admin/cache/stats")
+async def get_cache_stats(gallery: Gallery = Depends(get_gallery)):
+    """Hit/miss counters and sizes of the thumbnail and metadata caches."""
+    return {
+        "thumbnail_memory": gallery.thumbnail_bytes.stats(),
+        "thumbnail_disk": gallery.thumbnail_cache.stats(),
+        "metadata": gallery.metadata_store.stats(),
+        "image_features": gallery.feature_extractor.stats(),
+    }
+
+@router.get("/metrics")
+async def get_metrics():
+    """Latency, cache, queue and upstream metrics in the Prometheus text format."""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@router.get("/api/admin/profiles")
+async def list_profiles(request: Request):
+    """Recent request profiles recorded through the X-Profile header, newest first."""
+    return [profile.summary() for profile in request.app.state.profile_store.list()]
+
+@router.get("/api/admin/profiles/{profile_id}")
+async def get_profile(request: Request, profile_id: str):
+    """Sampled stacks of one profiled request in collapsed format (flamegraph.pl, speedscope)."""
+    profile = request.app.state.profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(content=profile.stacks, media_type="text/plain; charset=utf-8")
+
+@router.get("/api/admin/generation/stats")
+async def get_generation_stats(gallery: Gallery = Depends(get_gallery)):
+    """Local generation queue depth, merge counters and measured generation speed."""
+    return {
+        **gallery.generation_scheduler.stats(),
+        "seconds_per_image": round(gallery.generation_tracker.seconds_per_image, 2),
+    }
+
+@router.get("/api/admin/thumbnails/prewarm")
+async def get_prewarm_progress(gallery: Gallery = Depends(get_gallery)):
+    """Report progress and throughput of the thumbnail prewarm job."""
+    return gallery.prewarm_job.progress()
+
+@router.post("/api/admin/thumbnails/prewarm")
+async def start_prewarm(gallery: Gallery = Depends(get_gallery)):
+    """Generate all missing thumbnails in the background. No-op if already running."""
+    gallery.prewarm_job.start()
+    return gallery.prewarm_job.progress()
+
+@router.delete("/api/photos/{filename}")
+async def delete_photo(filename: str, gallery: Gallery = Depends(get_gallery)):
     try:
         file_path = PHOTO_DIR / filename
-        thumbnail_path = get_thumbnail_path(file_path)
         
-        if not file_path.exists():
+        try:
+            await asyncio.to_thread(file_path.unlink)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="Photo not found")
-            
-        file_path.unlink()
-        if thumbnail_path.exists():
-            thumbnail_path.unlink()
+        await asyncio.to_thread(gallery.photo_index.apply, [filename])
+        await asyncio.to_thread(gallery.thumbnail_cache.discard_stale, filename)
             
         return {"status": "success"}
     except HTTPException as he:
@@ -140,30 +501,131 @@ async def delete_photo(filename: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/metadata/{image_name}")
-async def get_image_metadata(image_name: str):
-    """Retrieve metadata for a specific image from InvokeAI."""
+def _checked_selection(filenames: List[str]) -> List[str]:
+    """De-duplicate a selection of photo names, rejecting anything outside PHOTO_DIR."""
+    for name in filenames:
+        _check_photo_name(name)
+    return list(dict.fromkeys(filenames))
+
+def _delete_files(names: List[str]) -> Tuple[List[str], List[str], Dict[str, str]]:
+    deleted, not_found, errors = [], [], {}
+    for name in names:
+        try:
+            (PHOTO_DIR / name).unlink()
+            deleted.append(name)
+        except FileNotFoundError:
+            not_found.append(name)
+        except OSError as e:
+            errors[name] = str(e)
+    return deleted, not_found, errors
+
+@router.post("/api/photos/bulk-delete", response_model=BulkDeleteResponse)
+async def bulk_delete_photos(request: PhotoSelection, gallery: Gallery = Depends(get_gallery)):
+    """Delete many photos and all their thumbnails in one call.
+
+    Files that could not be deleted are reported per name instead of
+    failing the whole request.
+    """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{INVOKEAI_BASE_URL}/api/v1/images/i/{image_name}/metadata"
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to get metadata from InvokeAI: {response.text}"
-                )
-                
-            return response.json()
+        names = _checked_selection(request.filenames)
+        deleted, not_found, errors = await asyncio.to_thread(_delete_files, names)
+        await asyncio.to_thread(gallery.photo_index.apply, deleted + not_found)
+        await asyncio.to_thread(gallery.discard_thumbnails, deleted)
+        return BulkDeleteResponse(deleted=deleted, not_found=not_found, errors=errors)
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/generate", response_model=GenerationResponse)
-async def trigger_generation(request: GenerationRequest):
-    """Trigger a new image generation batch based on existing image metadata and additional parameters."""
+async def _export_response(gallery: Gallery, filenames: List[str]) -> StreamingResponse:
+    names = _checked_selection(filenames)
+    await asyncio.to_thread(gallery.photo_index.refresh)
+    names = [name for name in names if gallery.photo_index.get(name) is not None]
+    if not names:
+        raise HTTPException(status_code=404, detail="None of the selected photos exist")
+    # A plain iterator, so Starlette pulls each piece in a worker thread
+    return StreamingResponse(
+        iter_zip(PHOTO_DIR, names, EXPORT_CHUNK_SIZE),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="photos.zip"'}
+    )
+
+@router.get("/api/photos/export")
+async def export_photos(
+    names: List[str] = Query(..., max_length=MAX_BULK_PHOTOS),
+    gallery: Gallery = Depends(get_gallery)
+):
+    """Stream a ZIP of the selected photos, built as it is sent.
+
+    Unknown names are skipped. Use the POST form for selections too large
+    for a query string.
+    """
+    try:
+        return await _export_response(gallery, names)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/photos/export")
+async def export_photos_selection(request: PhotoSelection, gallery: Gallery = Depends(get_gallery)):
+    """Same as GET /api/photos/export, with the selection in the body."""
     try:
-        # Extract and preserve original metadata
+        return await _export_response(gallery, request.filenames)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/metadata/batch", response_model=MetadataBatchResponse)
+async def get_image_metadata_batch(request: MetadataBatchRequest, gallery: Gallery = Depends(get_gallery)):
+    """Resolve metadata for many images in one round trip.
+
+    Images that could not be resolved are listed in `errors` instead of
+    failing the whole batch.
+    """
+    try:
+        for name in request.image_names:
+            _check_photo_name(name)
+        metadata, errors = await gallery.metadata_store.get_many(request.image_names)
+        return MetadataBatchResponse(metadata=metadata, errors=errors)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/metadata/{image_name}")
+async def get_image_metadata(image_name: str, gallery: Gallery = Depends(get_gallery)):
+    """Retrieve metadata for a specific image, cached after the first lookup."""
+    try:
+        _check_photo_name(image_name)
+        return await gallery.metadata_store.get(image_name)
+    except HTTPException as he:
+        raise he
+    except MetadataError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Timed out waiting for InvokeAI")
+    except httpx.TransportError as e:
+        raise HTTPException(status_code=502, detail=f"InvokeAI unreachable: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/generate", response_model=GenerationResponse, status_code=202)
+async def trigger_generation(
+    request: GenerationRequest,
+    http_request: Request,
+    gallery: Gallery = Depends(get_gallery)
+):
+    """Queue a new image generation based on existing image metadata and additional parameters.
+
+    Requests are scheduled locally and merged with compatible requests
+    from other clients before being enqueued in InvokeAI, so the answer is
+    202 with a `job_id`; whether sending the job to InvokeAI succeeded is
+    reported by GET /api/generate/{job_id}.
+    """
+    try:
+            # Extract and preserve original metadata
         generation_params = request.metadata.copy()
         
         # Handle prompt combination
@@ -190,200 +652,63 @@ async def trigger_generation(request: GenerationRequest):
         if not model_info and "core_metadata" in generation_params:
             model_info = generation_params["core_metadata"].get("model", {})
 
-        # Generate graph ID and node IDs
-        graph_id = f"sdxl_graph:{_generate_random_id()}"
-
-        # Create node IDs
-        nodes = {
-            "model_loader": f"sdxl_model_loader:{_generate_random_id()}",
-            "pos_cond": f"sdxl_compel_prompt:{_generate_random_id()}",
-            "pos_cond_collect": f"collect:{_generate_random_id()}",
-            "neg_cond": f"sdxl_compel_prompt:{_generate_random_id()}",
-            "neg_cond_collect": f"collect:{_generate_random_id()}",
-            "noise": f"noise:{_generate_random_id()}",
-            "denoise_latents": f"denoise_latents:{_generate_random_id()}",
-            "vae": f"vae_loader:{_generate_random_id()}",
-            "core_metadata": f"core_metadata:{_generate_random_id()}",
-            "canvas_output": f"l2i:{_generate_random_id()}"
+        params = {
+            "template": SDXL_TXT2IMG.name,
+            "model": model_info,
+            "negative_prompt": generation_params.get("negative_prompt", ""),
+            "negative_style_prompt": generation_params.get("negative_style_prompt", ""),
+            "width": generation_params.get("width", 1024),
+            "height": generation_params.get("height", 1024),
+            "cfg_scale": generation_params.get("cfg_scale", 7.5),
+            "scheduler": generation_params.get("scheduler", "dpmpp_2m"),
+            "steps": generation_params.get("steps", 20),
         }
+        if "vae" in generation_params:
+            params["vae"] = generation_params["vae"]
 
-        invoke_request = {
-            "prepend": False,
-            "batch": {
-                "graph": {
-                    "id": graph_id,
-                    "nodes": {
-                        nodes["model_loader"]: {
-                            "type": "sdxl_model_loader",
-                            "id": nodes["model_loader"],
-                            "model": model_info,
-                            "is_intermediate": True,
-                            "use_cache": True
-                        },
-                        nodes["pos_cond"]: {
-                            "type": "sdxl_compel_prompt",
-                            "id": nodes["pos_cond"],
-                            "prompt": combined_prompt,
-                            "style": combined_prompt,
-                            "is_intermediate": True,
-                            "use_cache": True
-                        },
-                        nodes["pos_cond_collect"]: {
-                            "type": "collect",
-                            "id": nodes["pos_cond_collect"],
-                            "is_intermediate": True,
-                            "use_cache": True
-                        },
-                        nodes["neg_cond"]: {
-                            "type": "sdxl_compel_prompt",
-                            "id": nodes["neg_cond"],
-                            "prompt": generation_params.get("negative_prompt", ""),
-                            "style": generation_params.get("negative_style_prompt", ""),
-                            "is_intermediate": True,
-                            "use_cache": True
-                        },
-                        nodes["neg_cond_collect"]: {
-                            "type": "collect",
-                            "id": nodes["neg_cond_collect"],
-                            "is_intermediate": True,
-                            "use_cache": True
-                        },
-                        nodes["noise"]: {
-                            "type": "noise",
-                            "id": nodes["noise"],
-                            "seed": seeds[0],
-                            "width": generation_params.get("width", 1024),
-                            "height": generation_params.get("height", 1024),
-                            "use_cpu": True,
-                            "is_intermediate": True,
-                            "use_cache": True
-                        },
-                        nodes["denoise_latents"]: {
-                            "type": "denoise_latents",
-                            "id": nodes["denoise_latents"],
-                            "cfg_scale": generation_params.get("cfg_scale", 7.5),
-                            "cfg_rescale_multiplier": 0,
-                            "scheduler": generation_params.get("scheduler", "dpmpp_2m"),
-                            "steps": generation_params.get("steps", 20),
-                            "denoising_start": 0,
-                            "denoising_end": 1,
-                            "is_intermediate": True,
-                            "use_cache": True
-                        },
-                        nodes["vae"]: {
-                            "type": "vae_loader",
-                            "id": nodes["vae"],
-                            "vae_model": generation_params.get("vae", {
-                                "key": "6415a9ec-819b-49ca-9a0d-44ac478703a6",
-                                "hash": "blake3:9b7c3120af571e8d93fa82d50ef3b5f15727507d0edaae822424951937a008a3",
-                                "name": "sdxl-vae-fp16-fix",
-                                "base": "sdxl",
-                                "type": "vae"
-                            }),
-                            "is_intermediate": True,
-                            "use_cache": True
-                        },
-                        nodes["core_metadata"]: {
-                            "id": nodes["core_metadata"],
-                            "type": "core_metadata",
-                            "is_intermediate": True,
-                            "use_cache": True,
-                            "generation_mode": "sdxl_txt2img",
-                            "cfg_scale": generation_params.get("cfg_scale", 7.5),
-                            "cfg_rescale_multiplier": 0,
-                            "width": generation_params.get("width", 1024),
-                            "height": generation_params.get("height", 1024),
-                            "negative_prompt": generation_params.get("negative_prompt", ""),
-                            "model": model_info,
-                            "steps": generation_params.get("steps", 20),
-                            "rand_device": "cpu",
-                            "scheduler": generation_params.get("scheduler", "dpmpp_2m"),
-                            "vae": generation_params.get("vae", {
-                                "key": "6415a9ec-819b-49ca-9a0d-44ac478703a6",
-                                "hash": "blake3:9b7c3120af571e8d93fa82d50ef3b5f15727507d0edaae822424951937a008a3",
-                                "name": "sdxl-vae-fp16-fix",
-                                "base": "sdxl",
-                                "type": "vae"
-                            })
-                        },
-                        nodes["canvas_output"]: {
-                            "type": "l2i",
-                            "id": nodes["canvas_output"],
-                            "fp32": False,
-                            "is_intermediate": False,
-                            "use_cache": False,
-                        }
-                    },
-                    "edges": [
-                        {"source": {"node_id": nodes["model_loader"], "field": "unet"},
-                         "destination": {"node_id": nodes["denoise_latents"], "field": "unet"}},
-                        {"source": {"node_id": nodes["model_loader"], "field": "clip"},
-                         "destination": {"node_id": nodes["pos_cond"], "field": "clip"}},
-                        {"source": {"node_id": nodes["model_loader"], "field": "clip"},
-                         "destination": {"node_id": nodes["neg_cond"], "field": "clip"}},
-                        {"source": {"node_id": nodes["model_loader"], "field": "clip2"},
-                         "destination": {"node_id": nodes["pos_cond"], "field": "clip2"}},
-                        {"source": {"node_id": nodes["model_loader"], "field": "clip2"},
-                         "destination": {"node_id": nodes["neg_cond"], "field": "clip2"}},
-                        {"source": {"node_id": nodes["pos_cond"], "field": "conditioning"},
-                         "destination": {"node_id": nodes["pos_cond_collect"], "field": "item"}},
-                        {"source": {"node_id": nodes["neg_cond"], "field": "conditioning"},
-                         "destination": {"node_id": nodes["neg_cond_collect"], "field": "item"}},
-                        {"source": {"node_id": nodes["pos_cond_collect"], "field": "collection"},
-                         "destination": {"node_id": nodes["denoise_latents"], "field": "positive_conditioning"}},
-                        {"source": {"node_id": nodes["neg_cond_collect"], "field": "collection"},
-                         "destination": {"node_id": nodes["denoise_latents"], "field": "negative_conditioning"}},
-                        {"source": {"node_id": nodes["noise"], "field": "noise"},
-                         "destination": {"node_id": nodes["denoise_latents"], "field": "noise"}},
-                        {"source": {"node_id": nodes["denoise_latents"], "field": "latents"},
-                         "destination": {"node_id": nodes["canvas_output"], "field": "latents"}},
-                        {"source": {"node_id": nodes["vae"], "field": "vae"},
-                         "destination": {"node_id": nodes["canvas_output"], "field": "vae"}},
-                        {"source": {"node_id": nodes["core_metadata"], "field": "metadata"},
-                         "destination": {"node_id": nodes["canvas_output"], "field": "metadata"}}
-                    ]
-                },
-                "runs": 1,
-                "data": [
-                    [
-                        {"node_path": nodes["noise"], "field_name": "seed", "items": seeds},
-                        {"node_path": nodes["core_metadata"], "field_name": "seed", "items": seeds}
-                    ],
-                    [
-                        {"node_path": nodes["pos_cond"], "field_name": "prompt", "items": [combined_prompt]},
-                        {"node_path": nodes["core_metadata"], "field_name": "positive_prompt", "items": [combined_prompt]},
-                        {"node_path": nodes["pos_cond"], "field_name": "style", "items": [combined_prompt]},
-                        {"node_path": nodes["core_metadata"], "field_name": "positive_style_prompt", "items": [combined_prompt]}
-                    ]
-                ]
-            },
-            "origin": "photo_gallery",
-            "destination": "gallery"
-        }
-        
-        # Send the generation request to InvokeAI
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{INVOKEAI_BASE_URL}/api/v1/queue/default/enqueue_batch",
-                json=invoke_request
-            )
-            
-            if response.status_code not in (200, 201):
-                print("Error response from InvokeAI:")
-                print(response.text)
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to trigger generation: {response.text}"
-                )
-            
-            response_data = response.json()
-            
-            return GenerationResponse(
-                estimated_time=ESTIMATED_TIME_PER_IMAGE * request.quantity,
-                batch_id=response_data.get("batch_id", "unknown"),
-                message=f"Generation started for {request.quantity} images"
-            )
-            
+        # Estimate before submitting so the job isn't counted twice
+        estimated_time = gallery.generation_tracker.estimate(
+            gallery.generation_scheduler.stats()["queued_images"] + request.quantity
+        )
+        job = await gallery.generation_scheduler.submit(GenerationJob(
+            client_id=http_request.client.host if http_request.client else "",
+            # Everything but seeds and prompts must match for requests to share a batch
+            key=SDXL_TXT2IMG.key(params),
+            params=params,
+            items=[(seed, combined_prompt) for seed in seeds],
+            priority=request.priority
+        ))
+
+        return GenerationResponse(
+            estimated_time=round(estimated_time),
+            job_id=job.job_id,
+            message=f"Generation queued for {request.quantity} images"
+        )
+
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(round(gallery.generation_tracker.seconds_per_image))}
+        )
+    except HTTPException as he:
+        raise he
     except Exception as e:
-        print(f"Generation error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        logger.error(f"Generation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/generate/events")
+async def generation_events(request: Request, gallery: Gallery = Depends(get_gallery)):
+    """Stream batch progress and `image_ready` events as Server-Sent Events."""
+    return sse_response(request, gallery.generation_tracker.events, SSE_KEEPALIVE_INTERVAL)
+
+@router.get("/api/generate/{job_id}")
+async def get_generation_status(job_id: str, gallery: Gallery = Depends(get_gallery)):
+    """Progress and remaining time of a job queued through /api/generate, or of an InvokeAI batch."""
+    job = await gallery.generation_scheduler.get(job_id)
+    if job is not None:
+        return await gallery.generation_scheduler.describe(job)
+    state = await gallery.generation_tracker.get(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    return gallery.generation_tracker.describe(state)
\ No newline at end of file
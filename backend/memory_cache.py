@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass
+class CachedBytes:
+    content: bytes
+    media_type: str
+
+class BytesLRU:
+    """Bounded in-process LRU of encoded bytes, sized in bytes rather than items.
+
+    Only used from the event loop, so it needs no locking. Items larger than
+    `max_item_bytes` are never cached to keep one large file from flushing
+    many small ones.
+    """
+
+    def __init__(self, max_bytes: int, max_item_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes if max_item_bytes is not None else max_bytes // 16
+        self._items: "OrderedDict[str, CachedBytes]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CachedBytes]:
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item
+
+    def put(self, key: str, content: bytes, media_type: str) -> None:
+        size = len(content)
+        if size > self.max_item_bytes:
+            return
+        self.discard(key)
+        self._items[key] = CachedBytes(content, media_type)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self._bytes -= len(evicted.content)
+            self.evictions += 1
+
+    def discard(self, key: str) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= len(item.content)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
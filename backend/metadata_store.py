@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from pathlib import Path
+from sqlite_db import open_sqlite
+from PIL import Image
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# tEXt chunk InvokeAI embeds in every generated PNG; same document the
+# /api/v1/images/i/{name}/metadata endpoint returns
+PNG_METADATA_KEY = "invokeai_metadata"
+
+_MISSING = object()
+
+class MetadataError(Exception):
+    """Raised when metadata could not be resolved from any source."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def read_png_metadata(path: Path) -> Optional[Any]:
+    """Read InvokeAI metadata from a PNG's text chunks without decoding pixels."""
+    try:
+        with Image.open(path) as img:
+            raw = img.info.get(PNG_METADATA_KEY)
+    except (OSError, ValueError):
+        return None
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+class MetadataStore:
+    """Persistent cache of image metadata in front of InvokeAI.
+
+    Image metadata never changes after generation, so once resolved it is
+    kept forever in SQLite with a small LRU in front. Lookups go memory,
+    SQLite, the PNG's own text chunks, and only then InvokeAI. Concurrent
+    lookups for the same image share one resolution and upstream calls are
+    capped at `upstream_concurrency`.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        photo_dir: Path,
+        fetch_upstream: Callable[[str], Awaitable[Any]],
+        read_png: bool = True,
+        upstream_concurrency: int = 8,
+        memory_entries: int = 4096
+    ):
+        self.db_path = db_path
+        self.photo_dir = photo_dir
+        self.fetch_upstream = fetch_upstream
+        self.read_png = read_png
+        self.memory_entries = memory_entries
+        self._upstream_slots = asyncio.Semaphore(upstream_concurrency)
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.hits = {"memory": 0, "db": 0, "png": 0, "upstream": 0}
+
+    def open(self) -> None:
+        self._conn = open_sqlite(self.db_path, [
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "image_name TEXT PRIMARY KEY, source TEXT NOT NULL, "
+            "data TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        ])
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _db_get(self, image_name: str) -> Any:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT data FROM metadata WHERE image_name = ?", (image_name,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else _MISSING
+
+    def _db_put(self, image_name: str, source: str, data: Any) -> None:
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata (image_name, source, data, fetched_at) VALUES (?, ?, ?, ?)",
+                (image_name, source, json.dumps(data), time.time())
+            )
+            self._conn.commit()
+
+    def _db_delete(self, image_names: List[str]) -> None:
+        with self._db_lock:
+            self._conn.executemany("DELETE FROM metadata WHERE image_name = ?", [(n,) for n in image_names])
+            self._conn.commit()
+
+    def _remember(self, image_name: str, data: Any) -> None:
+        self._memory[image_name] = data
+        self._memory.move_to_end(image_name)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, image_name: str) -> Any:
+        """Resolve metadata for one image. Raises MetadataError on upstream failure."""
+        if image_name in self._memory:
+            self._memory.move_to_end(image_name)
+            self.hits["memory"] += 1
+            return self._memory[image_name]
+        future = self._inflight.get(image_name)
+        if future is None:
+            future = asyncio.ensure_future(self._resolve(image_name))
+            self._inflight[image_name] = future
+            future.add_done_callback(lambda _: self._inflight.pop(image_name, None))
+        return await asyncio.shield(future)
+
+    async def _resolve(self, image_name: str) -> Any:
+        data = await asyncio.to_thread(self._db_get, image_name)
+        if data is not _MISSING:
+            self.hits["db"] += 1
+            self._remember(image_name, data)
+            return data
+
+        source = "png"
+        data = None
+        if self.read_png:
+            data = await asyncio.to_thread(read_png_metadata, self.photo_dir / image_name)
+        if data is None:
+            source = "upstream"
+            async with self._upstream_slots:
+                data = await self.fetch_upstream(image_name)
+        self.hits[source] += 1
+
+        await asyncio.to_thread(self._db_put, image_name, source, data)
+        self._remember(image_name, data)
+        return data
+
+    async def get_many(self, image_names: Iterable[str]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Resolve many images at once; returns (metadata, errors) keyed by name."""
+        names = list(dict.fromkeys(image_names))
+        results = await asyncio.gather(*(self.get(name) for name in names), return_exceptions=True)
+        found, errors = {}, {}
+        for name, result in zip(names, results):
+            if isinstance(result, MetadataError):
+                errors[name] = result.detail
+            elif isinstance(result, Exception):
+                errors[name] = str(result) or type(result).__name__
+            else:
+                found[name] = result
+        return found, errors
+
+    async def discard(self, image_names: List[str]) -> None:
+        """Forget metadata of deleted or replaced images."""
+        for name in image_names:
+            self._memory.pop(name, None)
+        await asyncio.to_thread(self._db_delete, image_names)
+
+    def stats(self) -> dict:
+        return {"memory_entries": len(self._memory), "resolved_from": dict(self.hits)}
@@ -0,0 +1,268 @@
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from starlette.types import ASGIApp, Receive, Scope, Send
+import asyncio
+import bisect
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# Starlette appends "; charset=utf-8"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        rendered = ",".join(f'{key}="{_escape(str(v))}"' for key, v in labels.items())
+        return f"{name}{{{rendered}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+class Metric:
+    """Base of the metric types: a name, help text and values per label combination.
+
+    Values are only updated from the event loop, so no locking is needed.
+    `fn` turns the metric into a callback read at scrape time; it returns a
+    number, or for labelled metrics a dict from label value tuples to numbers.
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        fn: Optional[Callable[[], object]] = None
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _values_now(self) -> Dict[LabelValues, float]:
+        if self.fn is None:
+            return self._values
+        value = self.fn()
+        if isinstance(value, dict):
+            return {tuple(str(v) for v in (k if isinstance(k, tuple) else (k,))): n for k, n in value.items()}
+        return {(): value}
+
+    def samples(self) -> Iterator[Sample]:
+        for key, value in self._values_now().items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: bucket counts (last is +Inf), sum
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def samples(self) -> Iterator[Sample]:
+        for key, (counts, total) in self._series.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total[0]
+            yield f"{self.name}_count", labels, cumulative
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # Re-registering a name replaces it, so an app built twice in one process keeps working
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (), fn=None) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, fn))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), fn=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, fn))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.warning(f"Skipping metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(_format_sample(name, labels, value) for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "gallery_http_request_duration_seconds",
+    "Time from request start to the last response byte, per route template",
+    ("method", "route", "status")
+)
+THUMBNAIL_REQUESTS = REGISTRY.counter(
+    "gallery_thumbnail_requests_total",
+    "Thumbnail requests by how they were answered",
+    ("result",)
+)
+THUMBNAIL_RENDER_SECONDS = REGISTRY.histogram(
+    "gallery_thumbnail_render_seconds",
+    "Decode, resize and encode time of one thumbnail in the process pool",
+    ("format",)
+)
+THUMBNAIL_RENDER_WAITS = REGISTRY.counter(
+    "gallery_thumbnail_render_waits_total",
+    "Thumbnail renders that waited for another worker process rendering the same thumbnail"
+)
+INVOKEAI_REQUEST_SECONDS = REGISTRY.histogram(
+    "gallery_invokeai_request_duration_seconds",
+    "Latency of each attempt at an InvokeAI call",
+    ("method", "endpoint")
+)
+INVOKEAI_REQUESTS = REGISTRY.counter(
+    "gallery_invokeai_requests_total",
+    "Attempts at InvokeAI calls by HTTP status, or the transport error raised",
+    ("method", "endpoint", "outcome")
+)
+EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "gallery_event_loop_lag_seconds",
+    "How late a periodic timer fires, i.e. how long the event loop was blocked",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+EVENT_LOOP_LAG_LAST = REGISTRY.gauge(
+    "gallery_event_loop_lag_last_seconds",
+    "Event loop lag measured by the most recent timer"
+)
+
+class MetricsMiddleware:
+    """Records HTTP_REQUEST_SECONDS for every request.
+
+    Requests are labelled with the matched route's path template rather
+    than the raw path, so photo names don't explode the label set.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def _route(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._routes.get(endpoint)
+        if path is None:
+            router = scope.get("app")
+            for route in getattr(router, "routes", ()):
+                self._routes[getattr(route, "endpoint", None) or getattr(route, "app", None)] = route.path
+            path = self._routes.get(endpoint, "unmatched")
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"], route=self._route(scope), status=status
+            )
+
+class EventLoopLagMonitor:
+    """Measures event loop lag by timing how late a short sleep wakes up."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            EVENT_LOOP_LAG_LAST.set(lag)
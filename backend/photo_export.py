@@ -0,0 +1,66 @@
+from pathlib import Path
+from typing import Iterable, Iterator, List
+import io
+import logging
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable write target that hands written bytes back to the caller.
+
+    Being unseekable makes zipfile emit data descriptors instead of seeking
+    back to patch headers, so the archive can be streamed as it is built.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip(photo_dir: Path, names: Iterable[str], chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """Yield a ZIP archive of the given photos piece by piece.
+
+    Photos are deflated at level 0, i.e. copied into stored deflate blocks,
+    since image formats are already compressed. Streaming needs a data
+    descriptor after each entry, which some unzip tools reject on STORED
+    entries but every tool accepts on deflated ones. At most about
+    `chunk_size` bytes are held in memory. Files that disappear before they
+    are reached are skipped. Blocking; iterate it off the event loop.
+    """
+    sink = _ZipSink()
+    # strict_timestamps=False clamps mtimes ZIP can't represent instead of failing
+    with zipfile.ZipFile(
+        sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=0, allowZip64=True, strict_timestamps=False
+    ) as archive:
+        for name in names:
+            path = photo_dir / name
+            try:
+                info = zipfile.ZipInfo.from_file(path, arcname=name, strict_timestamps=False)
+                source = open(path, "rb")
+            except OSError:
+                continue
+            info.compress_type = zipfile.ZIP_DEFLATED
+            # open() only applies the archive's level to entries it creates itself
+            info._compresslevel = 0
+            with source, archive.open(info, "w", force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as target:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield sink.drain()
+            # Data descriptor written when the entry closed
+            yield sink.drain()
+    # Central directory
+    yield sink.drain()
@@ -0,0 +1,309 @@
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Dict, Optional, Tuple
+from pathlib import Path
+from PIL import Image
+from process_locks import FileLock
+from sqlite_db import open_sqlite
+import base64
+import bisect
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from stat import S_ISREG
+
+logger = logging.getLogger(__name__)
+
+SortKey = Tuple[float, str]
+
+@dataclass
+class PhotoEntry:
+    name: str
+    mtime: float
+    size: int
+    mtime_ns: int = 0
+    inode: int = 0
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @property
+    def sort_key(self) -> SortKey:
+        # Newest first, ties broken by name so the order is total and stable
+        return (-self.mtime, self.name)
+
+@dataclass
+class IndexChanges:
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+def encode_cursor(key: SortKey) -> str:
+    raw = f"{key[0]!r}|{key[1]}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> SortKey:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    neg_mtime, name = raw.split("|", 1)
+    return (float(neg_mtime), name)
+
+def _unchanged(entry: Optional[PhotoEntry], stat: os.stat_result) -> bool:
+    return (
+        entry is not None
+        and entry.mtime_ns == stat.st_mtime_ns
+        and entry.size == stat.st_size
+        and entry.inode == stat.st_ino
+    )
+
+class PhotoIndexStore:
+    """SQLite copy of the index, shared by worker processes and restarts.
+
+    Lets a process starting up reuse entries, and the image headers read for
+    them, instead of opening every photo again. `lock` serializes full
+    builds so only the first worker reads headers.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.lock = FileLock(Path(f"{db_path}.lock"))
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        self._conn = open_sqlite(self.db_path, [
+            "CREATE TABLE IF NOT EXISTS photos ("
+            "name TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, width INTEGER, height INTEGER)"
+        ])
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def load(self) -> Dict[str, PhotoEntry]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, mtime, size, mtime_ns, inode, width, height FROM photos"
+            ).fetchall()
+        return {row[0]: PhotoEntry(*row) for row in rows}
+
+    def put_many(self, entries: List[PhotoEntry]) -> None:
+        if not entries:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(e.name, e.mtime, e.size, e.mtime_ns, e.inode, e.width, e.height) for e in entries]
+            )
+            self._conn.commit()
+
+    def delete(self, names: List[str]) -> None:
+        if not names:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM photos WHERE name = ?", [(n,) for n in names])
+            self._conn.commit()
+
+class PhotoIndex:
+    """In-memory index of the photo directory, kept sorted newest first.
+
+    With a `store`, entries are persisted so later builds, in this or
+    another worker process, only read headers of new or changed photos.
+    """
+
+    def __init__(self, photo_dir: Path, store: Optional[PhotoIndexStore] = None):
+        self.photo_dir = photo_dir
+        self.store = store
+        self._entries: Dict[str, PhotoEntry] = {}
+        self._lock = threading.Lock()
+        # Serializes syncs so concurrent refreshes don't report the same change twice
+        self._sync_lock = threading.Lock()
+        self._dir_mtime: Optional[float] = None
+        self._order: List[str] = []
+        self._keys: List[SortKey] = []
+        self._etag = ""
+        self._dirty = True
+        self._listeners: List[Callable[[IndexChanges], None]] = []
+
+    def _stat(self, name: str) -> Optional[os.stat_result]:
+        try:
+            stat = (self.photo_dir / name).stat()
+        except OSError:
+            return None
+        return stat if S_ISREG(stat.st_mode) else None
+
+    def _read_entry(self, name: str, stat: os.stat_result) -> PhotoEntry:
+        """Build an entry, reading dimensions from the image header."""
+        entry = PhotoEntry(
+            name=name,
+            mtime=stat.st_mtime,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            inode=stat.st_ino
+        )
+        try:
+            # Image.open only parses the header; pixel data is never decoded here
+            with Image.open(self.photo_dir / name) as img:
+                entry.width, entry.height = img.size
+        except Exception:
+            pass
+        return entry
+
+    def _scan(self) -> Dict[str, os.stat_result]:
+        stats = {}
+        with os.scandir(self.photo_dir) as it:
+            for dir_entry in it:
+                try:
+                    if dir_entry.is_file():
+                        # DirEntry.stat() leaves st_ino zero on Windows; the
+                        # inode is part of the thumbnail cache key
+                        stats[dir_entry.name] = os.stat(dir_entry.path) if os.name == "nt" else dir_entry.stat()
+                except OSError:
+                    continue
+        return stats
+
+    def build(self) -> None:
+        """Populate the index from scratch. Blocking; run off the event loop."""
+        dir_mtime = self.photo_dir.stat().st_mtime
+        if self.store is None:
+            entries = {name: self._read_entry(name, stat) for name, stat in self._scan().items()}
+            read = len(entries)
+        else:
+            # Workers starting together wait here and reuse the first one's work
+            with self.store.lock:
+                stored = self.store.load()
+                entries = {}
+                fresh = []
+                for name, stat in self._scan().items():
+                    entry = stored.get(name)
+                    if not _unchanged(entry, stat):
+                        entry = self._read_entry(name, stat)
+                        fresh.append(entry)
+                    entries[name] = entry
+                self.store.put_many(fresh)
+                self.store.delete([name for name in stored if name not in entries])
+            read = len(fresh)
+        with self._lock:
+            self._entries = entries
+            self._dir_mtime = dir_mtime
+            self._dirty = True
+        logger.info(f"Photo index built with {len(entries)} photos, {read} headers read")
+
+    def refresh(self, full: bool = False) -> IndexChanges:
+        """Re-sync with the directory if it changed since the last sync.
+
+        Costs a single stat when nothing changed. Otherwise only files that are
+        new or whose mtime/size changed are re-read. With `full`, the directory
+        is scanned even if its mtime is unchanged, which also catches files
+        rewritten in place.
+        """
+        try:
+            dir_mtime = self.photo_dir.stat().st_mtime
+        except OSError:
+            return IndexChanges()
+        if dir_mtime == self._dir_mtime and not full:
+            return IndexChanges()
+
+        stats = self._scan()
+        with self._lock:
+            known = set(self._entries)
+        changes = self.apply(known | stats.keys(), stats)
+        self._dir_mtime = dir_mtime
+        return changes
+
+    def apply(self, names: Iterable[str], stats: Optional[Dict[str, os.stat_result]] = None) -> IndexChanges:
+        """Re-check the given files against the disk and update the index to match."""
+        changes = IndexChanges()
+        with self._sync_lock:
+            for name in names:
+                stat = stats.get(name) if stats is not None else self._stat(name)
+                with self._lock:
+                    previous = self._entries.get(name)
+                if stat is None:
+                    if previous is not None:
+                        with self._lock:
+                            self._entries.pop(name, None)
+                            self._dirty = True
+                        changes.removed.append(name)
+                    continue
+                if _unchanged(previous, stat):
+                    continue
+                entry = self._read_entry(name, stat)
+                with self._lock:
+                    self._entries[name] = entry
+                    self._dirty = True
+                (changes.modified if previous is not None else changes.added).append(name)
+
+        if changes and self.store is not None:
+            try:
+                with self._lock:
+                    updated = [self._entries[n] for n in changes.added + changes.modified if n in self._entries]
+                self.store.put_many(updated)
+                self.store.delete(changes.removed)
+            except sqlite3.Error as e:
+                # The store is only a cache; the next build re-reads what is missing
+                logger.warning(f"Could not persist photo index changes: {e}")
+
+        if changes:
+            for listener in list(self._listeners):
+                try:
+                    listener(changes)
+                except Exception as e:
+                    logger.error(f"Photo index listener failed: {e}")
+        return changes
+
+    def add_listener(self, listener: Callable[[IndexChanges], None]) -> None:
+        """Register a callback for index changes. It may be called from any thread."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[IndexChanges], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def get(self, name: str) -> Optional[PhotoEntry]:
+        with self._lock:
+            return self._entries.get(name)
+
+    def _ensure_sorted(self) -> None:
+        # Caller holds the lock
+        if not self._dirty:
+            return
+        ordered = sorted(self._entries.values(), key=lambda e: e.sort_key)
+        self._order = [e.name for e in ordered]
+        self._keys = [e.sort_key for e in ordered]
+        digest = hashlib.md5()
+        for entry in ordered:
+            digest.update(f"{entry.name}\0{entry.mtime!r}\0{entry.size}\n".encode())
+        self._etag = f'"{digest.hexdigest()}"'
+        self._dirty = False
+
+    @property
+    def etag(self) -> str:
+        """Strong ETag for the current listing; changes whenever it does."""
+        with self._lock:
+            self._ensure_sorted()
+            return self._etag
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def page(self, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[str], Optional[str]]:
+        """Return a page of filenames newest first, plus the cursor for the next page.
+
+        Raises ValueError for a malformed cursor.
+        """
+        with self._lock:
+            self._ensure_sorted()
+            start = 0
+            if cursor:
+                start = bisect.bisect_right(self._keys, decode_cursor(cursor))
+            end = len(self._order) if limit is None else min(start + limit, len(self._order))
+            names = self._order[start:end]
+            next_cursor = encode_cursor(self._keys[end - 1]) if end < len(self._order) and names else None
+        return names, next_cursor
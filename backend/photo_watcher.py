@@ -0,0 +1,123 @@
+from typing import Awaitable, Callable, List, Optional
+from photo_index import PhotoIndex, IndexChanges
+from events import EventBroadcaster
+from pathlib import Path
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    # inotify on Linux, ReadDirectoryChangesW on Windows
+    from watchfiles import awatch
+except ImportError:
+    awatch = None
+
+ChangeHandler = Callable[[IndexChanges], Awaitable[None]]
+
+class PhotoWatcher:
+    """Keeps a PhotoIndex in sync with the photo directory and fans changes out.
+
+    Uses native filesystem notifications when `watchfiles` is installed and
+    falls back to a periodic scandir diff otherwise. Alongside notifications a
+    full scandir diff still runs every `reconcile_interval` seconds, catching
+    events the OS dropped (queue overflow, network filesystems) or missed
+    while the watcher was down. Every change reaching the
+    index, whichever code path detected it, is delivered to `on_change` and
+    published on `events`.
+    """
+
+    def __init__(
+        self,
+        index: PhotoIndex,
+        on_change: Optional[ChangeHandler] = None,
+        poll_interval: float = 2.0,
+        reconcile_interval: float = 60.0,
+        subscriber_queue_size: int = 256
+    ):
+        self.index = index
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self.events = EventBroadcaster(subscriber_queue_size)
+        self._changes: asyncio.Queue = asyncio.Queue()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop.clear()
+        self.index.add_listener(self._on_index_changes)
+        self._tasks = [
+            asyncio.create_task(self._watch()),
+            asyncio.create_task(self._dispatch()),
+        ]
+        if awatch:
+            mode = f"native notifications, reconciling every {self.reconcile_interval}s"
+        else:
+            mode = f"polling every {self.poll_interval}s"
+        logger.info(f"Watching {self.index.photo_dir} using {mode}")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        self.index.remove_listener(self._on_index_changes)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _on_index_changes(self, changes: IndexChanges) -> None:
+        # Called from whichever thread synced the index
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._changes.put_nowait, changes)
+
+    async def _watch(self) -> None:
+        if awatch is not None:
+            reconcile = asyncio.create_task(self._poll(self.reconcile_interval, full=True))
+            try:
+                await self._watch_native()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Native file watching failed, falling back to polling: {e}")
+            finally:
+                reconcile.cancel()
+                await asyncio.gather(reconcile, return_exceptions=True)
+        await self._poll(self.poll_interval)
+
+    async def _watch_native(self) -> None:
+        photo_dir = self.index.photo_dir
+        async for batch in awatch(photo_dir, stop_event=self._stop, recursive=False):
+            names = {Path(path).name for _, path in batch if Path(path).parent == photo_dir}
+            if names:
+                await asyncio.to_thread(self.index.apply, names)
+
+    async def _poll(self, interval: float, full: bool = False) -> None:
+        while not self._stop.is_set():
+            try:
+                await asyncio.to_thread(self.index.refresh, full)
+            except Exception as e:
+                logger.error(f"Photo directory poll failed: {e}")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self) -> None:
+        while True:
+            changes = await self._changes.get()
+            self._publish(changes)
+            if self.on_change is not None:
+                try:
+                    await self.on_change(changes)
+                except Exception as e:
+                    logger.error(f"Photo change handler failed: {e}")
+
+    def _publish(self, changes: IndexChanges) -> None:
+        self.events.publish(
+            [{"type": "added", "name": name} for name in changes.added]
+            + [{"type": "modified", "name": name} for name in changes.modified]
+            + [{"type": "removed", "name": name} for name in changes.removed]
+        )
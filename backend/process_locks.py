@@ -0,0 +1,107 @@
+from pathlib import Path
+from typing import Optional
+import os
+import threading
+import time
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+class FileLock:
+    """Exclusive advisory lock on a file, shared between worker processes.
+
+    Backed by flock (msvcrt.locking on Windows), so the operating system
+    releases it if the holding process dies. Also excludes other FileLock
+    instances on the same path within one process, and other threads using
+    the same instance. Like threading.Lock it is not reentrant.
+
+    With `remove_on_release` the file is deleted by whoever releases the
+    lock, so locks on many short-lived paths don't pile up; a waiter that
+    ends up holding the deleted file notices and locks the new one instead.
+    """
+
+    def __init__(self, path: Path, remove_on_release: bool = False):
+        self.path = path
+        self.remove_on_release = remove_on_release
+        self._fd: Optional[int] = None
+        # Held by the thread that owns the lock; flock alone doesn't exclude
+        # threads sharing this instance's descriptor
+        self._guard = threading.Lock()
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True, poll_interval: float = 0.05) -> bool:
+        """Take the lock; with `blocking=False` return False at once if it is held elsewhere."""
+        if not self._guard.acquire(blocking):
+            return False
+        try:
+            while True:
+                fd = self._lock_file(blocking, poll_interval)
+                if fd is None:
+                    self._guard.release()
+                    return False
+                if not self.remove_on_release or self._is_current(fd):
+                    self._fd = fd
+                    return True
+                # Locked a file its previous holder has since deleted
+                os.close(fd)
+        except BaseException:
+            self._guard.release()
+            raise
+
+    def _lock_file(self, blocking: bool, poll_interval: float) -> Optional[int]:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                if os.name == "nt":
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                return fd
+            except OSError:
+                if not blocking:
+                    os.close(fd)
+                    return None
+                # Only reached on Windows, which has no blocking lock without a timeout
+                time.sleep(poll_interval)
+
+    def _is_current(self, fd: int) -> bool:
+        """Whether `fd` is still the file at `path`."""
+        try:
+            current = os.stat(self.path)
+        except OSError:
+            return False
+        opened = os.fstat(fd)
+        return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            if self.remove_on_release:
+                # Deleted while still held, so a waiter that gets this file
+                # next finds it is no longer at `path` and retries
+                try:
+                    self.path.unlink()
+                except OSError:
+                    pass
+            if os.name == "nt":
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+            self._guard.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
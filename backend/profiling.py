@@ -0,0 +1,162 @@
+from collections import Counter as Tally, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from starlette.types import ASGIApp, Receive, Scope, Send
+import hmac
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class StackSampler:
+    """Samples the Python stack of every thread from a background thread.
+
+    Stacks are tallied in the collapsed format ("thread;outer;...;inner N")
+    read by flamegraph.pl and speedscope. Sampling stops by itself after
+    `max_seconds` so a long-lived request can't keep it running.
+    """
+
+    def __init__(self, interval: float = 0.005, max_seconds: float = 30.0):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks: Tally = Tally()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + self.max_seconds
+        while True:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            if self._stop.wait(self.interval) or time.monotonic() >= deadline:
+                break
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+@dataclass
+class Profile:
+    profile_id: str
+    method: str
+    path: str
+    started_at: float
+    duration: float = 0.0
+    samples: int = 0
+    stacks: str = field(default="", repr=False)
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_seconds": round(self.duration, 4),
+            "samples": self.samples,
+        }
+
+class ProfileStore:
+    """The most recent request profiles, kept in memory."""
+
+    def __init__(self, keep: int = 20):
+        self.keep = keep
+        self._profiles: "OrderedDict[str, Profile]" = OrderedDict()
+
+    def add(self, profile: Profile) -> None:
+        self._profiles[profile.profile_id] = profile
+        while len(self._profiles) > self.keep:
+            self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return self._profiles.get(profile_id)
+
+    def list(self) -> List[Profile]:
+        return list(reversed(self._profiles.values()))
+
+class ProfilerMiddleware:
+    """Samples stacks while a request runs when it carries the profiling header.
+
+    Disabled unless a token is configured; the header must carry that token.
+    Only one request is profiled at a time and the response itself is left
+    untouched: it gains an `X-Profile-Id` header naming the stored profile.
+    The sampler sees every thread, so work for concurrent requests shows up
+    in the same profile.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: ProfileStore,
+        token: Optional[str],
+        header: str = "x-profile",
+        interval: float = 0.005,
+        max_seconds: float = 30.0
+    ):
+        self.app = app
+        self.store = store
+        self.token = token.encode() if token else None
+        self.header = header.lower().encode()
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._active = False
+
+    def _requested(self, scope: Scope) -> bool:
+        for key, value in scope.get("headers", ()):
+            if key == self.header:
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.token is None or self._active or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self._active = True
+        profile = Profile(secrets.token_hex(8), scope["method"], scope["path"], time.time())
+        sampler = StackSampler(self.interval, self.max_seconds)
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile.profile_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            self._active = False
+            profile.duration = time.perf_counter() - started
+            profile.samples = sampler.samples
+            profile.stacks = sampler.collapsed()
+            self.store.add(profile)
+            logger.info(f"Profiled {profile.method} {profile.path}: {profile.samples} samples, id {profile.profile_id}")
@@ -0,0 +1,70 @@
+"""Configuration of the gallery backend, read from GALLERY_* environment variables."""
+from pathlib import Path
+import os
+
+INVOKEAI_BASE_URL = os.environ.get("GALLERY_INVOKEAI_URL", "http://localhost:9090")
+INVOKEAI_MAX_CONNECTIONS = int(os.environ.get("GALLERY_INVOKEAI_MAX_CONNECTIONS", 64))
+INVOKEAI_MAX_KEEPALIVE = int(os.environ.get("GALLERY_INVOKEAI_MAX_KEEPALIVE", 16))
+INVOKEAI_RETRIES = int(os.environ.get("GALLERY_INVOKEAI_RETRIES", 3))
+INVOKEAI_CONNECT_TIMEOUT = 5.0
+INVOKEAI_METADATA_TIMEOUT = 10.0
+INVOKEAI_ENQUEUE_TIMEOUT = 30.0
+METADATA_DB = Path(os.environ.get("GALLERY_METADATA_DB", "metadata.db")).resolve()
+# Read metadata InvokeAI embeds in the PNG before asking InvokeAI for it
+METADATA_FROM_PNG = os.environ.get("GALLERY_METADATA_FROM_PNG", "1") != "0"
+METADATA_UPSTREAM_CONCURRENCY = int(os.environ.get("GALLERY_METADATA_UPSTREAM_CONCURRENCY", 8))
+MAX_METADATA_BATCH = 500
+# Upper bound on photos per bulk delete or export request
+MAX_BULK_PHOTOS = int(os.environ.get("GALLERY_MAX_BULK_PHOTOS", 10000))
+EXPORT_CHUNK_SIZE = 1024 * 1024
+# Dimensions, BlurHash and dominant colour per photo for /api/photos/details
+FEATURES_DB = Path(os.environ.get("GALLERY_FEATURES_DB", "photo_features.db")).resolve()
+FEATURE_WORKERS = int(os.environ.get("GALLERY_FEATURE_WORKERS", 2))
+# Generation jobs, batches and events, shared by the worker processes
+GENERATION_DB = Path(os.environ.get("GALLERY_GENERATION_DB", "generation.db")).resolve()
+# Used until real generation timings have been measured
+ESTIMATED_TIME_PER_IMAGE = 15
+GENERATION_POLL_INTERVAL = float(os.environ.get("GALLERY_GENERATION_POLL_INTERVAL", 1.0))
+# Unfinished batches allowed in InvokeAI's queue; the rest wait locally
+GENERATION_MAX_OUTSTANDING = int(os.environ.get("GALLERY_GENERATION_MAX_OUTSTANDING", 2))
+GENERATION_MAX_BATCH_IMAGES = int(os.environ.get("GALLERY_GENERATION_MAX_BATCH_IMAGES", 32))
+GENERATION_BATCH_WINDOW = float(os.environ.get("GALLERY_GENERATION_BATCH_WINDOW", 0.05))
+GENERATION_MAX_QUEUED = int(os.environ.get("GALLERY_GENERATION_MAX_QUEUED", 256))
+GENERATION_MAX_QUEUED_PER_CLIENT = int(os.environ.get("GALLERY_GENERATION_MAX_QUEUED_PER_CLIENT", 32))
+THUMBNAIL_SIZE = (300, 300)
+# Bounding box edge in pixels per size class; "md" matches THUMBNAIL_SIZE
+THUMBNAIL_SIZE_CLASSES = {"sm": 150, "md": 300, "lg": 600, "xl": 1200}
+DEFAULT_THUMBNAIL_SIZE_CLASS = "md"
+THUMBNAIL_QUALITY = 85
+CACHE_CONTROL_THUMBNAILS = "public, max-age=604800"
+CACHE_CONTROL_FULL = "public, max-age=31536000"
+PHOTO_DIR = Path("photos").resolve()
+THUMBNAIL_DIR = Path("thumbnails").resolve()
+MAX_PAGE_SIZE = 1000
+WATCH_POLL_INTERVAL = 2.0
+# Full rescan alongside native notifications, for events the OS dropped
+WATCH_RECONCILE_INTERVAL = float(os.environ.get("GALLERY_WATCH_RECONCILE_INTERVAL", 60.0))
+THUMBNAIL_QUEUE_SIZE = 1024
+SSE_KEEPALIVE_INTERVAL = 15.0
+# Encodes running at once across all worker processes; defaults to one per core
+THUMBNAIL_WORKERS = int(os.environ.get("GALLERY_THUMBNAIL_WORKERS", 0)) or os.cpu_count() or 1
+THUMBNAIL_MAX_PENDING = int(os.environ.get("GALLERY_THUMBNAIL_MAX_PENDING", 512))
+THUMBNAIL_CACHE_MAX_MB = int(os.environ.get("GALLERY_THUMBNAIL_CACHE_MAX_MB", 2048))
+THUMBNAIL_MEMORY_CACHE_MB = int(os.environ.get("GALLERY_THUMBNAIL_MEMORY_CACHE_MB", 64))
+PREWARM_ON_STARTUP = os.environ.get("GALLERY_PREWARM_ON_STARTUP", "1") != "0"
+# Web-optimized full-size copies served for /photos/{filename}?variant=display
+DISPLAY_VARIANTS = os.environ.get("GALLERY_DISPLAY_VARIANTS", "0") != "0"
+DISPLAY_SIZE_CLASS = "display"
+DISPLAY_MAX_EDGE = int(os.environ.get("GALLERY_DISPLAY_MAX_EDGE", 2048))
+DISPLAY_QUALITY = int(os.environ.get("GALLERY_DISPLAY_QUALITY", 90))
+EVENT_LOOP_LAG_INTERVAL = 0.5
+# Requests sending this token in X-Profile are profiled; profiling is off when unset
+PROFILE_TOKEN = os.environ.get("GALLERY_PROFILE_TOKEN") or None
+PROFILE_INTERVAL = float(os.environ.get("GALLERY_PROFILE_INTERVAL", 0.005))
+# Photo index shared by worker processes and restarts
+INDEX_DB = Path(os.environ.get("GALLERY_INDEX_DB", "photo_index.db")).resolve()
+# Locks coordinating worker processes: leader election and thumbnail renders
+LOCK_DIR = Path(os.environ.get("GALLERY_LOCK_DIR", "locks")).resolve()
+THUMBNAIL_LOCK_DIR = LOCK_DIR / "thumbnails"
+# How often a follower checks whether the leader exited
+LEADER_POLL_INTERVAL = 5.0
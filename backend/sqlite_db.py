@@ -0,0 +1,22 @@
+from pathlib import Path
+from typing import Iterable
+import sqlite3
+
+# How long to wait for another worker process's write before failing with
+# "database is locked"
+BUSY_TIMEOUT = 30.0
+
+def open_sqlite(path: Path, schema: Iterable[str] = ()) -> sqlite3.Connection:
+    """Open a database shared by threads and worker processes, creating `schema` if missing.
+
+    The connection is usable from any thread (callers serialize access
+    themselves) and the database runs in WAL mode, so readers in other
+    processes are never blocked by a writer.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in schema:
+        conn.execute(statement)
+    conn.commit()
+    return conn
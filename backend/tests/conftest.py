@@ -0,0 +1,6 @@
+from pathlib import Path
+import sys
+
+# The backend's modules are imported as top-level modules, as uvicorn does
+# when started from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,50 @@
+from email.utils import formatdate
+from file_responses import RangeNotSatisfiable, parse_range, if_range_matches
+import pytest
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10-", (10, 999)),
+    ("bytes=990-2000", (990, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    (" bytes = 5-9", (5, 9)),
+    ("BYTES=5-9", (5, 9)),
+    # Ignored, so the whole file is sent
+    ("items=0-9", None),
+    ("bytes=0-9,20-29", None),
+    ("bytes=abc-", None),
+    ("bytes=9-5", None),
+    ("bytes=5", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000),
+    ("bytes=1000-2000", 1000),
+    ("bytes=-0", 1000),
+    ("bytes=0-", 0),
+    ("bytes=-1", 0),
+])
+def test_parse_range_not_satisfiable(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+def test_if_range_matches_etag():
+    etag = '"abc"'
+    assert if_range_matches(None, etag, 0)
+    assert if_range_matches('"abc"', etag, 0)
+    assert if_range_matches(' "abc" ', etag, 0)
+    assert not if_range_matches('"other"', etag, 0)
+    # If-Range requires a strong comparison
+    assert not if_range_matches('W/"abc"', etag, 0)
+
+def test_if_range_matches_date():
+    last_modified = 1_700_000_000.5
+    assert if_range_matches(formatdate(1_700_000_000, usegmt=True), '"abc"', last_modified)
+    assert if_range_matches(formatdate(1_700_000_100, usegmt=True), '"abc"', last_modified)
+    assert not if_range_matches(formatdate(1_699_999_999, usegmt=True), '"abc"', last_modified)
+    assert not if_range_matches("not a date", '"abc"', last_modified)
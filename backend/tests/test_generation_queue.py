@@ -0,0 +1,177 @@
+from generation_queue import GenerationScheduler
+from generation_store import GenerationJob, GenerationStore, QueueFullError
+from generation_tracker import GenerationTracker
+import asyncio
+import pytest
+
+class FakeInvokeAI:
+    """Records enqueue_batch calls and answers each with a new batch id."""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.batches = []
+
+    async def enqueue(self, params, items):
+        if self.fail:
+            raise RuntimeError("InvokeAI is down")
+        self.batches.append(items)
+        return {"batch": {"batch_id": f"batch-{len(self.batches)}"}, "enqueued": len(items)}
+
+@pytest.fixture
+def store(tmp_path):
+    store = GenerationStore(tmp_path / "generation.db")
+    store.open()
+    yield store
+    store.close()
+
+def _scheduler(store, invokeai, **kwargs):
+    kwargs.setdefault("batch_window", 0)
+    tracker = GenerationTracker(client=None, store=store)
+    return GenerationScheduler(tracker, invokeai.enqueue, **kwargs)
+
+def _job(client_id, label, quantity=1, key="sdxl", priority=0):
+    return GenerationJob(
+        client_id=client_id,
+        key=key,
+        params={"template": key},
+        items=[(seed, label) for seed in range(quantity)],
+        priority=priority
+    )
+
+async def _dispatch_all(scheduler, invokeai, batches):
+    await scheduler.start()
+    try:
+        for _ in range(200):
+            if len(invokeai.batches) >= batches:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await scheduler.stop()
+
+def _labels(batch):
+    return sorted({prompt for _, prompt in batch})
+
+def test_clients_are_served_round_robin(store):
+    invokeai = FakeInvokeAI()
+    # Each job fills a batch, so every batch serves exactly one client
+    scheduler = _scheduler(store, invokeai, max_batch_items=4, max_outstanding=10)
+
+    async def run():
+        for label in ("a1", "a2", "a3"):
+            await scheduler.submit(_job("a", label, quantity=4))
+        await scheduler.submit(_job("b", "b1", quantity=4))
+        await _dispatch_all(scheduler, invokeai, 4)
+
+    asyncio.run(run())
+    assert [_labels(batch) for batch in invokeai.batches] == [["a1"], ["b1"], ["a2"], ["a3"]]
+
+def test_compatible_jobs_are_merged_one_per_client_per_round(store):
+    invokeai = FakeInvokeAI()
+    scheduler = _scheduler(store, invokeai, max_batch_items=3, max_outstanding=1)
+
+    async def run():
+        jobs = [_job("a", "a1"), _job("a", "a2"), _job("a", "a3"), _job("b", "b1"), _job("c", "c1", key="other")]
+        for job in jobs:
+            await scheduler.submit(job)
+        await _dispatch_all(scheduler, invokeai, 1)
+        return [await scheduler.get(job.job_id) for job in jobs]
+
+    jobs = asyncio.run(run())
+    # a2 joins in the second round, after b1; c1 can't share the batch
+    assert [prompt for _, prompt in invokeai.batches[0]] == ["a1", "b1", "a2"]
+    assert [job.batch_id for job in jobs] == ["batch-1", "batch-1", None, "batch-1", None]
+    assert [job.offset for job in jobs[:2]] == [0, 2]
+
+def test_higher_priority_goes_first(store):
+    invokeai = FakeInvokeAI()
+    scheduler = _scheduler(store, invokeai, max_batch_items=1, max_outstanding=10)
+
+    async def run():
+        await scheduler.submit(_job("a", "low"))
+        await scheduler.submit(_job("b", "high", priority=5))
+        await _dispatch_all(scheduler, invokeai, 2)
+
+    asyncio.run(run())
+    assert [_labels(batch) for batch in invokeai.batches] == [["high"], ["low"]]
+
+def test_outstanding_batches_are_limited(store):
+    invokeai = FakeInvokeAI()
+    scheduler = _scheduler(store, invokeai, max_batch_items=1, max_outstanding=2)
+
+    async def run():
+        for i in range(4):
+            await scheduler.submit(_job(f"client{i}", str(i)))
+        await _dispatch_all(scheduler, invokeai, 4)
+        return await asyncio.to_thread(store.stats)
+
+    stats = asyncio.run(run())
+    # The others wait until InvokeAI finishes a batch
+    assert len(invokeai.batches) == 2
+    assert stats["queued_jobs"] == 2
+    assert stats["outstanding_batches"] == 2
+
+def test_queue_limits_raise_queue_full(store):
+    scheduler = _scheduler(store, FakeInvokeAI(), max_queued=3, max_queued_per_client=2)
+
+    async def run():
+        await scheduler.submit(_job("a", "a1"))
+        await scheduler.submit(_job("a", "a2"))
+        with pytest.raises(QueueFullError, match="this client"):
+            await scheduler.submit(_job("a", "a3"))
+        await scheduler.submit(_job("b", "b1"))
+        with pytest.raises(QueueFullError, match="queue is full"):
+            await scheduler.submit(_job("c", "c1"))
+
+    asyncio.run(run())
+    assert store.stats()["queued_jobs"] == 3
+
+def test_queue_limits_hold_across_processes(store, tmp_path):
+    # A second connection to the same database stands in for another worker process
+    other = GenerationStore(store.db_path)
+    other.open()
+    try:
+        store.add_job(_job("a", "a1"), max_queued=10, max_queued_per_client=2)
+        other.add_job(_job("a", "a2"), max_queued=10, max_queued_per_client=2)
+        with pytest.raises(QueueFullError):
+            store.add_job(_job("a", "a3"), max_queued=10, max_queued_per_client=2)
+    finally:
+        other.close()
+
+def test_failed_dispatch_is_reported(store):
+    scheduler = _scheduler(store, FakeInvokeAI(fail=True))
+
+    async def run():
+        job = await scheduler.submit(_job("a", "a1", quantity=2))
+        await scheduler.start()
+        for _ in range(200):
+            job = await scheduler.get(job.job_id)
+            if job.error is not None:
+                break
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+        return await scheduler.describe(job)
+
+    status = asyncio.run(run())
+    assert status["status"] == "failed"
+    assert status["error"] == "InvokeAI is down"
+    assert store.stats()["queued_jobs"] == 0
+
+def test_describe_follows_the_batch(store):
+    invokeai = FakeInvokeAI()
+    scheduler = _scheduler(store, invokeai)
+
+    async def run():
+        first = await scheduler.submit(_job("a", "a1", quantity=2))
+        second = await scheduler.submit(_job("b", "b1", quantity=2))
+        assert (await scheduler.describe(first))["status"] == "queued_locally"
+        await _dispatch_all(scheduler, invokeai, 1)
+        state = store.get_batch("batch-1")
+        state.completed = 3
+        state.in_progress = 1
+        state.started_at = state.enqueued_at
+        store.put_batches([state])
+        return [await scheduler.describe(await scheduler.get(job.job_id)) for job in (first, second)]
+
+    first, second = asyncio.run(run())
+    assert (first["status"], first["completed"]) == ("completed", 2)
+    assert (second["status"], second["completed"]) == ("running", 1)
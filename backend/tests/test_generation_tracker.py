@@ -0,0 +1,108 @@
+from generation_store import GenerationStore
+from generation_tracker import GenerationTracker
+import asyncio
+import pytest
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+class FakeClient:
+    """Answers InvokeAI's queue and batch status endpoints from `batches`."""
+
+    def __init__(self):
+        self.batches = {}
+
+    async def get(self, path):
+        if path.endswith("/status") and "/b/" in path:
+            batch_id = path.split("/b/")[1].split("/")[0]
+            if batch_id not in self.batches:
+                return FakeResponse(404)
+            return FakeResponse(200, self.batches[batch_id])
+        return FakeResponse(200, {"queue": {"pending": 0, "in_progress": 0}})
+
+@pytest.fixture
+def stores(tmp_path):
+    # Two connections to one database stand in for two worker processes
+    stores = [GenerationStore(tmp_path / "generation.db") for _ in range(2)]
+    for store in stores:
+        store.open()
+    yield stores
+    for store in stores:
+        store.close()
+
+async def _collect(queue, count, timeout=5.0):
+    return [await asyncio.wait_for(queue.get(), timeout) for _ in range(count)]
+
+def test_followers_receive_the_leaders_events(stores):
+    client = FakeClient()
+    leader = GenerationTracker(client, stores[0], poll_interval=0.01)
+    follower = GenerationTracker(None, stores[1])
+    finished = []
+    leader.add_listener(finished.append)
+
+    async def run():
+        await leader.start(poll=True)
+        await follower.start(poll=False)
+        queue = follower.events.subscribe()
+        client.batches["b1"] = {"pending": 1, "in_progress": 1, "completed": 0, "failed": 0, "canceled": 0}
+        await leader.track("b1", 2)
+        events = await _collect(queue, 1)
+        # Seen running first, so the time per image can be measured
+        await asyncio.sleep(0.1)
+        client.batches["b1"] = {"pending": 0, "in_progress": 0, "completed": 2, "failed": 0, "canceled": 0}
+        events += await _collect(queue, 1)
+        await asyncio.sleep(0.5)
+        await leader.stop()
+        await follower.stop()
+        return events
+
+    events = asyncio.run(run())
+    assert [event["type"] for event in events] == ["batch_queued", "batch_finished"]
+    assert events[1]["status"] == "completed"
+    assert [state.batch_id for state in finished] == ["b1"]
+    stats = stores[1].stats()
+    assert stats["outstanding_batches"] == 0
+    assert stats["seconds_per_image"] > 0
+
+def test_pruned_batch_is_canceled(stores):
+    leader = GenerationTracker(FakeClient(), stores[0], poll_interval=0.01)
+
+    async def run():
+        await leader.start(poll=True)
+        queue = leader.events.subscribe()
+        await leader.track("gone", 3)
+        events = await _collect(queue, 2)
+        await leader.stop()
+        return events
+
+    events = asyncio.run(run())
+    assert events[1]["type"] == "batch_finished"
+    assert (events[1]["status"], events[1]["canceled"]) == ("canceled", 3)
+
+def test_new_leader_resumes_active_batches(stores):
+    client = FakeClient()
+    client.batches["b1"] = {"pending": 1, "in_progress": 0, "completed": 0, "failed": 0, "canceled": 0}
+    first = GenerationTracker(client, stores[0], poll_interval=0.01)
+    second = GenerationTracker(client, stores[1], poll_interval=0.01)
+
+    async def run():
+        await first.start(poll=True)
+        await first.track("b1", 1)
+        await first.stop()
+        # The first leader exited before the batch finished
+        await second.start(poll=False)
+        queue = second.events.subscribe()
+        client.batches["b1"] = {"pending": 0, "in_progress": 0, "completed": 1, "failed": 0, "canceled": 0}
+        await second.start_polling()
+        events = await _collect(queue, 1)
+        await second.stop()
+        return events
+
+    events = asyncio.run(run())
+    assert (events[0]["type"], events[0]["batch_id"]) == ("batch_finished", "b1")
+    assert stores[0].get_batch("b1").status == "completed"
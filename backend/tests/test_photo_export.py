@@ -0,0 +1,44 @@
+from photo_export import iter_zip
+import io
+import os
+import zipfile
+
+def _write(path, data, mtime=1_700_000_000):
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+
+def _archive(chunks):
+    return zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+
+def test_archive_opens_with_zipfile(tmp_path):
+    contents = {"a.png": os.urandom(300_000), "b.png": b"", "c.png": b"x" * 1000}
+    for name, data in contents.items():
+        _write(tmp_path / name, data)
+    # A small chunk size spreads entries over many chunks
+    with _archive(iter_zip(tmp_path, contents, chunk_size=4096)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(contents)
+        for name, data in contents.items():
+            assert archive.read(name) == data
+
+def test_missing_files_are_skipped(tmp_path):
+    _write(tmp_path / "a.png", b"data")
+    with _archive(iter_zip(tmp_path, ["gone.png", "a.png"])) as archive:
+        assert archive.namelist() == ["a.png"]
+
+def test_empty_selection_is_a_valid_archive(tmp_path):
+    with _archive(iter_zip(tmp_path, [])) as archive:
+        assert archive.namelist() == []
+
+def test_mtimes_zip_cannot_represent_are_clamped(tmp_path):
+    _write(tmp_path / "old.png", b"data", mtime=0)
+    with _archive(iter_zip(tmp_path, ["old.png"])) as archive:
+        assert archive.getinfo("old.png").date_time == (1980, 1, 1, 0, 0, 0)
+        assert archive.read("old.png") == b"data"
+
+def test_chunks_are_bounded(tmp_path):
+    _write(tmp_path / "big.png", os.urandom(1_000_000))
+    chunks = list(iter_zip(tmp_path, ["big.png"], chunk_size=64 * 1024))
+    assert len(chunks) > 1
+    # About one chunk of file data plus deflate block and header overhead
+    assert max(len(chunk) for chunk in chunks) < 2 * 64 * 1024
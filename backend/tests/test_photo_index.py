@@ -0,0 +1,71 @@
+from photo_index import PhotoIndex, PhotoIndexStore
+from PIL import Image
+import os
+import pytest
+
+def _add_photo(photo_dir, name, mtime):
+    Image.new("RGB", (8, 6)).save(photo_dir / name)
+    os.utime(photo_dir / name, (mtime, mtime))
+
+@pytest.fixture
+def index(tmp_path):
+    photo_dir = tmp_path / "photos"
+    photo_dir.mkdir()
+    for i in range(7):
+        _add_photo(photo_dir, f"p{i}.png", 1000 + i)
+    # Same mtime as p3.png, so the name breaks the tie
+    _add_photo(photo_dir, "q3.png", 1003)
+    index = PhotoIndex(photo_dir)
+    index.build()
+    return index
+
+def _all_pages(index, limit):
+    names, cursor = index.page(limit=limit)
+    pages = [names]
+    while cursor is not None:
+        names, cursor = index.page(cursor, limit)
+        pages.append(names)
+    return pages
+
+def test_page_without_limit_is_everything_newest_first(index):
+    names, cursor = index.page()
+    assert names == ["p6.png", "p5.png", "p4.png", "p3.png", "q3.png", "p2.png", "p1.png", "p0.png"]
+    assert cursor is None
+
+@pytest.mark.parametrize("limit", [1, 3, 4, 8, 100])
+def test_cursor_paging_visits_every_photo_once(index, limit):
+    pages = _all_pages(index, limit)
+    assert [name for page in pages for name in page] == index.page()[0]
+    assert all(len(page) == limit for page in pages[:-1])
+    assert 0 < len(pages[-1]) <= limit
+
+def test_cursor_is_stable_when_photos_change(index):
+    first, cursor = index.page(limit=3)
+    assert first == ["p6.png", "p5.png", "p4.png"]
+    # A newer photo and the removal of an already listed one don't shift later pages
+    _add_photo(index.photo_dir, "new.png", 2000)
+    (index.photo_dir / "p5.png").unlink()
+    index.refresh(full=True)
+    second, _ = index.page(cursor, 3)
+    assert second == ["p3.png", "q3.png", "p2.png"]
+
+def test_cursor_past_the_end(index):
+    names, cursor = index.page(limit=8)
+    assert len(names) == 8
+    assert cursor is None
+
+def test_malformed_cursor_raises_value_error(index):
+    with pytest.raises(ValueError):
+        index.page("not-a-cursor", 3)
+
+def test_store_is_reused_by_later_builds(tmp_path, index):
+    store = PhotoIndexStore(tmp_path / "index.db")
+    store.open()
+    try:
+        PhotoIndex(index.photo_dir, store).build()
+        rebuilt = PhotoIndex(index.photo_dir, store)
+        rebuilt.build()
+        assert rebuilt.page() == index.page()
+        assert rebuilt.get("p0.png").width == 8
+    finally:
+        store.close()
@@ -0,0 +1,98 @@
+from pathlib import Path
+from process_locks import FileLock
+import process_locks
+import subprocess
+import sys
+import threading
+import time
+
+def _acquire_in_thread(lock: FileLock) -> threading.Event:
+    """Acquire `lock` in a new thread; the returned event is set once it holds it."""
+    acquired = threading.Event()
+
+    def run():
+        lock.acquire()
+        acquired.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    return acquired
+
+def test_instances_on_same_path_exclude_each_other(tmp_path):
+    first = FileLock(tmp_path / "a.lock")
+    second = FileLock(tmp_path / "a.lock")
+    assert first.acquire(blocking=False)
+    assert not second.acquire(blocking=False)
+    first.release()
+    assert second.acquire(blocking=False)
+    second.release()
+
+def test_blocking_acquire_waits_for_release(tmp_path):
+    holder = FileLock(tmp_path / "a.lock")
+    waiter = FileLock(tmp_path / "a.lock")
+    holder.acquire()
+    acquired = _acquire_in_thread(waiter)
+    assert not acquired.wait(0.2)
+    holder.release()
+    assert acquired.wait(5)
+    assert waiter.locked
+    waiter.release()
+
+def test_threads_sharing_an_instance_exclude_each_other(tmp_path):
+    lock = FileLock(tmp_path / "a.lock")
+    lock.acquire()
+    acquired = _acquire_in_thread(lock)
+    assert not acquired.wait(0.2)
+    lock.release()
+    assert acquired.wait(5)
+    lock.release()
+
+def test_not_reentrant(tmp_path):
+    lock = FileLock(tmp_path / "a.lock")
+    assert lock.acquire()
+    assert not lock.acquire(blocking=False)
+    lock.release()
+
+def test_release_without_holding_is_a_no_op(tmp_path):
+    lock = FileLock(tmp_path / "a.lock")
+    lock.release()
+    assert lock.acquire(blocking=False)
+    lock.release()
+
+def test_remove_on_release_keeps_excluding(tmp_path):
+    path = tmp_path / "a.lock"
+    holder = FileLock(path, remove_on_release=True)
+    waiter = FileLock(path, remove_on_release=True)
+    holder.acquire()
+    acquired = _acquire_in_thread(waiter)
+    time.sleep(0.1)
+    holder.release()
+    assert acquired.wait(5)
+    # The waiter locked a fresh file at the path, not the deleted one
+    assert path.exists()
+    assert not FileLock(path, remove_on_release=True).acquire(blocking=False)
+    waiter.release()
+    assert not path.exists()
+
+def test_excludes_other_processes(tmp_path):
+    path = tmp_path / "a.lock"
+    script = (
+        "import pathlib, sys\n"
+        f"sys.path.insert(0, {str(Path(process_locks.__file__).parent)!r})\n"
+        "from process_locks import FileLock\n"
+        f"FileLock(pathlib.Path({str(path)!r})).acquire()\n"
+        "print('locked', flush=True)\n"
+        "sys.stdin.readline()\n"
+    )
+    child = subprocess.Popen([sys.executable, "-c", script], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert child.stdout.readline().strip() == "locked"
+        lock = FileLock(path)
+        assert not lock.acquire(blocking=False)
+        # The operating system releases the lock when its holder exits
+        child.stdin.write("\n")
+        child.stdin.flush()
+        child.wait(5)
+        assert lock.acquire(blocking=False)
+        lock.release()
+    finally:
+        child.kill()
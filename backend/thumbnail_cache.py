@@ -0,0 +1,318 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+from sqlite_db import open_sqlite
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# "<2 hex>/<32 hex key>_<size class>.<format>"
+_THUMBNAIL_NAME = re.compile(r"^[0-9a-f]{32}_\w+\.\w+$")
+
+@dataclass
+class CacheEntry:
+    source: str
+    bytes: int
+    atime: float
+
+class ThumbnailCache:
+    """Content-addressed thumbnail store with a persistent LRU manifest.
+
+    Thumbnail names derive from the original's path, mtime, size and inode,
+    so overwriting a photo under the same name can never serve a stale
+    thumbnail. The manifest records every thumbnail's source, size and last
+    access; it bounds the directory to `max_bytes` by evicting least recently
+    used thumbnails and lets the sweeper delete files whose source is gone.
+
+    The manifest is a SQLite database shared by all worker processes. New
+    thumbnails and accesses are buffered in memory and written by `save()`,
+    so the request path never waits on the database. Eviction and sweeping
+    should run in one process only; see `start(maintain=...)`.
+    """
+
+    DB_NAME = "manifest.db"
+
+    def __init__(
+        self,
+        thumbnail_dir: Path,
+        photo_dir: Path,
+        max_bytes: int,
+        low_watermark: float = 0.9,
+        orphan_grace: float = 300.0
+    ):
+        self.thumbnail_dir = thumbnail_dir
+        self.photo_dir = photo_dir
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+        self.orphan_grace = orphan_grace
+        self.db_path = thumbnail_dir / self.DB_NAME
+        self._conn: Optional[sqlite3.Connection] = None
+        # Guards the connection
+        self._lock = threading.Lock()
+        # Guards the write buffers, which the event loop appends to
+        self._pending_lock = threading.Lock()
+        self._recorded: Dict[str, CacheEntry] = {}
+        self._touched: Dict[str, Tuple[str, float]] = {}
+        # Totals as of the last database read, plus this process's writes since
+        self._entries = 0
+        self._total_bytes = 0
+        # Whether this process sweeps and evicts; see start()
+        self.maintain = True
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def key_for(original_path: Path, mtime_ns: int, size: int, inode: int) -> str:
+        identity = f"{original_path}\0{mtime_ns}\0{size}\0{inode}"
+        return hashlib.md5(identity.encode()).hexdigest()
+
+    @classmethod
+    def cache_key(cls, original_path: Path, stat: os.stat_result) -> str:
+        return cls.key_for(original_path, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def path_for_key(self, key: str, size_class: str, fmt: str) -> Path:
+        # Two-level fan-out keeps directories small on large libraries
+        return self.thumbnail_dir / key[:2] / f"{key}_{size_class}.{fmt}"
+
+    def path_for(
+        self,
+        original_path: Path,
+        size_class: str,
+        fmt: str,
+        stat: Optional[os.stat_result] = None
+    ) -> Path:
+        """Thumbnail path for the current version of `original_path`."""
+        key = self.cache_key(original_path, stat or original_path.stat())
+        return self.path_for_key(key, size_class, fmt)
+
+    def _relative(self, thumbnail_path: Path) -> str:
+        return thumbnail_path.relative_to(self.thumbnail_dir).as_posix()
+
+    def _unlink(self, rel: str) -> None:
+        try:
+            (self.thumbnail_dir / rel).unlink(missing_ok=True)
+        except OSError as e:
+            # e.g. still open for a response on Windows; the sweeper retries
+            logger.warning(f"Could not remove thumbnail {rel}: {e}")
+
+    def _delete_rows(self, rels: List[str]) -> None:
+        # Caller holds the lock
+        self._conn.executemany("DELETE FROM thumbnails WHERE rel = ?", [(rel,) for rel in rels])
+        self._conn.commit()
+
+    def record(self, thumbnail_path: Path, source: str, nbytes: int) -> None:
+        """Register a freshly generated thumbnail."""
+        with self._pending_lock:
+            self._recorded[self._relative(thumbnail_path)] = CacheEntry(source, nbytes, time.time())
+        self._entries += 1
+        self._total_bytes += nbytes
+
+    def touch(self, thumbnail_path: Path, source: str) -> None:
+        """Mark a thumbnail as just used, adopting it if the manifest lost track of it."""
+        with self._pending_lock:
+            self._touched[self._relative(thumbnail_path)] = (source, time.time())
+
+    def discard_stale(self, source: str) -> int:
+        """Delete thumbnails of `source` that don't match its current version on disk."""
+        self.save()
+        try:
+            current_key = self.cache_key(self.photo_dir / source, (self.photo_dir / source).stat())
+        except OSError:
+            current_key = None
+        with self._lock:
+            rows = self._conn.execute("SELECT rel, bytes FROM thumbnails WHERE source = ?", (source,)).fetchall()
+            stale = [(rel, nbytes) for rel, nbytes in rows if Path(rel).name[:32] != current_key]
+            if stale:
+                self._delete_rows([rel for rel, _ in stale])
+        for rel, nbytes in stale:
+            self._unlink(rel)
+            self._entries -= 1
+            self._total_bytes -= nbytes
+        return len(stale)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _refresh_totals(self) -> None:
+        with self._lock:
+            self._entries, total = self._conn.execute("SELECT COUNT(*), SUM(bytes) FROM thumbnails").fetchone()
+        self._total_bytes = total or 0
+
+    def evict(self) -> int:
+        """Delete least recently used thumbnails until under the low watermark."""
+        self.save()
+        self._refresh_totals()
+        if self._total_bytes <= self.max_bytes:
+            return 0
+        target = self.max_bytes * self.low_watermark
+        victims = []
+        with self._lock:
+            total = self._total_bytes
+            for rel, nbytes in self._conn.execute("SELECT rel, bytes FROM thumbnails ORDER BY atime"):
+                if total <= target:
+                    break
+                victims.append(rel)
+                total -= nbytes
+            self._delete_rows(victims)
+        for rel in victims:
+            self._unlink(rel)
+        self._refresh_totals()
+        if victims:
+            logger.info(f"Evicted {len(victims)} thumbnails, cache now {self._total_bytes / 2**20:.1f} MB")
+        return len(victims)
+
+    def sweep(self) -> int:
+        """Delete orphaned thumbnails and forget manifest entries whose file is gone.
+
+        Orphans are thumbnails of photos that were removed or changed, and any
+        file in the thumbnail directory the manifest doesn't know about, such
+        as leftovers from an older naming scheme or an interrupted write.
+        """
+        self.save()
+        removed = 0
+        with self._lock:
+            sources = [row[0] for row in self._conn.execute("SELECT DISTINCT source FROM thumbnails")]
+        for source in sources:
+            removed += self.discard_stale(source)
+
+        with self._lock:
+            known = {row[0] for row in self._conn.execute("SELECT rel FROM thumbnails")}
+        seen = set()
+        unknown = []
+        for root, _, files in os.walk(self.thumbnail_dir):
+            for name in files:
+                path = Path(root) / name
+                if path.parent == self.thumbnail_dir and name.startswith("manifest."):
+                    continue
+                rel = self._relative(path)
+                seen.add(rel)
+                if rel not in known:
+                    unknown.append(path)
+
+        # Thumbnails of current photos are adopted rather than regenerated,
+        # e.g. after the manifest was lost
+        current = self._current_keys() if unknown else {}
+        cutoff = time.time() - self.orphan_grace
+        for path in unknown:
+            try:
+                stat = path.stat()
+                source = current.get(path.name[:32]) if _THUMBNAIL_NAME.match(path.name) else None
+                if source is not None:
+                    self.record(path, source, stat.st_size)
+                elif stat.st_mtime < cutoff:
+                    # Grace period so a just-renamed thumbnail, or one another
+                    # worker hasn't saved yet, isn't raced
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        self.save()
+
+        with self._lock:
+            self._delete_rows([rel for rel in known if rel not in seen])
+        self._refresh_totals()
+        if removed:
+            logger.info(f"Swept {removed} orphaned thumbnails")
+        return removed
+
+    def _current_keys(self) -> Dict[str, str]:
+        keys = {}
+        with os.scandir(self.photo_dir) as it:
+            for dir_entry in it:
+                try:
+                    if dir_entry.is_file():
+                        original_path = self.photo_dir / dir_entry.name
+                        keys[self.cache_key(original_path, original_path.stat())] = dir_entry.name
+                except OSError:
+                    continue
+        return keys
+
+    def load(self) -> None:
+        """Open the manifest database, creating it if needed."""
+        self._conn = open_sqlite(self.db_path, [
+            "CREATE TABLE IF NOT EXISTS thumbnails ("
+            "rel TEXT PRIMARY KEY, source TEXT NOT NULL, bytes INTEGER NOT NULL, atime REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS thumbnails_source ON thumbnails (source)",
+            "CREATE INDEX IF NOT EXISTS thumbnails_atime ON thumbnails (atime)",
+        ])
+        self._refresh_totals()
+
+    def save(self) -> None:
+        """Write buffered new thumbnails and access times to the manifest."""
+        with self._pending_lock:
+            recorded, self._recorded = self._recorded, {}
+            touched, self._touched = self._touched, {}
+        if not recorded and not touched:
+            return
+        adopted = []
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?)",
+                [(rel, e.source, e.bytes, e.atime) for rel, e in recorded.items()]
+            )
+            for rel, (source, atime) in touched.items():
+                cursor = self._conn.execute("UPDATE thumbnails SET atime = ? WHERE rel = ?", (atime, rel))
+                if cursor.rowcount == 0 and rel not in recorded:
+                    adopted.append((rel, source, atime))
+            self._conn.commit()
+        for rel, source, atime in adopted:
+            try:
+                nbytes = (self.thumbnail_dir / rel).stat().st_size
+            except OSError:
+                continue
+            self.record(self.thumbnail_dir / rel, source, nbytes)
+        if adopted:
+            self.save()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    async def start(self, flush_interval: float = 30.0, sweep_interval: float = 3600.0, maintain: bool = True) -> None:
+        """Open the manifest and start background flushing.
+
+        With `maintain`, the background task also sweeps and evicts; in a
+        multi-worker deployment only one process should do so.
+        """
+        self.maintain = maintain
+        await asyncio.to_thread(self.load)
+        self._task = asyncio.create_task(self._maintain(flush_interval, sweep_interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.save)
+        await asyncio.to_thread(self.close)
+
+    async def _maintain(self, flush_interval: float, sweep_interval: float) -> None:
+        last_sweep = None
+        while True:
+            try:
+                if self.maintain and (last_sweep is None or time.monotonic() - last_sweep >= sweep_interval):
+                    await asyncio.to_thread(self.sweep)
+                    last_sweep = time.monotonic()
+                if self.maintain:
+                    await asyncio.to_thread(self.evict)
+                else:
+                    await asyncio.to_thread(self.save)
+                    await asyncio.to_thread(self._refresh_totals)
+            except Exception as e:
+                logger.error(f"Thumbnail cache maintenance failed: {e}")
+            await asyncio.sleep(flush_interval)
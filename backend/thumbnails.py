@@ -0,0 +1,378 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from photo_index import PhotoIndex
+from process_locks import FileLock
+from metrics import THUMBNAIL_RENDER_SECONDS, THUMBNAIL_RENDER_WAITS
+from pathlib import Path
+from PIL import Image, features
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+REDUCING_GAP = 2
+# How often to check whether another process finished rendering a thumbnail
+RENDER_LOCK_POLL_INTERVAL = 0.02
+
+# Pillow format name and MIME type per thumbnail format, best first
+THUMBNAIL_FORMATS = {
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+AVAILABLE_FORMATS = [fmt for fmt in THUMBNAIL_FORMATS if fmt == "jpeg" or features.check(fmt)]
+DEFAULT_FORMAT = "webp" if "webp" in AVAILABLE_FORMATS else "jpeg"
+# Modes each format is written in; anything else is converted after resizing
+ENCODER_MODES = {"avif": ("RGB", "RGBA"), "webp": ("RGB", "RGBA"), "jpeg": ("RGB", "L")}
+
+class ThumbnailError(Exception):
+    """Raised when a thumbnail could not be generated."""
+
+class ThumbnailBusyError(ThumbnailError):
+    """Raised when too many thumbnails are already waiting to be generated."""
+
+def _accepted_types(accept: str) -> Set[str]:
+    """Media types listed in an Accept header, minus those refused with q=0."""
+    accepted = set()
+    for part in accept.split(","):
+        media_type, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        if quality > 0:
+            accepted.add(media_type.strip().lower())
+    return accepted
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """Pick the thumbnail format to serve for an `Accept` header.
+
+    AVIF or WebP when the client names them explicitly, the default format
+    for wildcards or a missing header, JPEG only when it is all the client
+    asks for.
+    """
+    if not accept:
+        return DEFAULT_FORMAT
+    accepted = _accepted_types(accept)
+    for fmt in AVAILABLE_FORMATS:
+        if fmt != "jpeg" and THUMBNAIL_FORMATS[fmt][1] in accepted:
+            return fmt
+    if "image/jpeg" in accepted and not accepted & {"*/*", "image/*"}:
+        return "jpeg"
+    return DEFAULT_FORMAT
+
+def render_thumbnail(image_path: str, thumbnail_path: str, size: Tuple[int, int], fmt: str, quality: int) -> int:
+    """Decode, resize and encode a thumbnail. Runs inside a worker process.
+
+    The result is written to a temporary file and renamed into place, so
+    readers never observe a partially written thumbnail. Returns its size
+    in bytes.
+    """
+    tmp_path = f"{thumbnail_path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+    try:
+        with Image.open(image_path) as img:
+            # Must happen before any pixel access: lets the JPEG decoder scale
+            # by 1/2..1/8 during the DCT instead of decoding full resolution
+            img.draft('RGB', (size[0] * REDUCING_GAP, size[1] * REDUCING_GAP))
+            if img.mode in ('P', 'PA'):
+                img = img.convert('RGBA')
+            elif img.mode.startswith('I;16'):
+                # 16-bit greyscale can't be resampled; scale to 8 bits first
+                img = img.convert('I').point(lambda v: v / 256).convert('L')
+            # reduce() by an integer factor first, then LANCZOS the remainder
+            img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+            # Convert after resizing so only the small image is touched
+            if img.mode not in ENCODER_MODES[fmt]:
+                # Same test as Image.has_transparency_data, which needs Pillow 10.1
+                has_alpha = img.mode in ("RGBA", "LA", "PA", "RGBa", "La") or "transparency" in img.info
+                keep_alpha = "RGBA" in ENCODER_MODES[fmt] and has_alpha
+                img = img.convert('RGBA' if keep_alpha else 'RGB')
+            img.save(tmp_path, THUMBNAIL_FORMATS[fmt][0], quality=quality)
+        nbytes = os.path.getsize(tmp_path)
+        os.replace(tmp_path, thumbnail_path)
+        return nbytes
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+class ThumbnailGenerator:
+    """Generates thumbnails in a process pool.
+
+    Concurrent requests for the same thumbnail share one job. At most
+    `max_workers * 2` jobs are handed to the pool at a time; further jobs
+    wait their turn, and once `max_pending` jobs are outstanding non-blocking
+    callers are rejected with ThumbnailBusyError. `on_render` is called with
+    the original path, thumbnail path and byte size of every new thumbnail.
+
+    With a `lock_dir` shared by several processes, a thumbnail is rendered
+    by only one of them; the others wait for it to appear. Every job also
+    takes one of `max_workers` encoder slots there, so all the processes
+    together run at most `max_workers` jobs at a time.
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int],
+        quality: int,
+        max_workers: Optional[int] = None,
+        max_pending: int = 512,
+        on_render: Optional[Callable[[Path, Path, int], None]] = None,
+        lock_dir: Optional[Path] = None
+    ):
+        self.size = size
+        self.quality = quality
+        self.on_render = on_render
+        self.lock_dir = lock_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.max_workers * 2)
+        self._encoder_locks = [
+            FileLock(lock_dir / f"encoder-{i}.lock") for i in range(self.max_workers)
+        ] if lock_dir is not None else []
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def start(self) -> None:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._inflight)
+
+    async def ensure(
+        self,
+        image_path: Path,
+        thumbnail_path: Path,
+        size: Optional[Tuple[int, int]] = None,
+        fmt: str = DEFAULT_FORMAT,
+        block: bool = False,
+        quality: Optional[int] = None
+    ) -> Path:
+        """Make sure `thumbnail_path` exists, generating it if needed.
+
+        `size` and `quality` default to the generator's and `fmt` is a key
+        of THUMBNAIL_FORMATS.
+
+        With `block=True` the call waits for queue space instead of raising
+        ThumbnailBusyError; used by background jobs.
+        """
+        key = str(thumbnail_path)
+        future = self._inflight.get(key)
+        if future is None:
+            if thumbnail_path.exists():
+                return thumbnail_path
+            if not block and len(self._inflight) >= self.max_pending:
+                raise ThumbnailBusyError("Thumbnail queue is full")
+            future = asyncio.ensure_future(
+                self._render(image_path, thumbnail_path, size or self.size, fmt, quality or self.quality)
+            )
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so a disconnecting client doesn't cancel work others wait on
+        await asyncio.shield(future)
+        return thumbnail_path
+
+    async def _claim(self, thumbnail_path: Path) -> Optional[FileLock]:
+        """Take the cross-process render lock, waiting while another process holds it."""
+        if self.lock_dir is None:
+            return None
+        lock = FileLock(self.lock_dir / f"{thumbnail_path.name}.lock", remove_on_release=True)
+        if not lock.acquire(blocking=False):
+            THUMBNAIL_RENDER_WAITS.inc()
+            while not lock.acquire(blocking=False):
+                await asyncio.sleep(RENDER_LOCK_POLL_INTERVAL)
+        return lock
+
+    async def _render(
+        self,
+        image_path: Path,
+        thumbnail_path: Path,
+        size: Tuple[int, int],
+        fmt: str,
+        quality: int
+    ) -> None:
+        lock = await self._claim(thumbnail_path)
+        try:
+            async with self._slots:
+                # Also covers a render finished by another process while we waited
+                if thumbnail_path.exists():
+                    return
+                args = (str(image_path), str(thumbnail_path), size, fmt, quality)
+                started = time.perf_counter()
+                try:
+                    nbytes = await self._submit(render_thumbnail, *args)
+                except Exception as e:
+                    raise ThumbnailError(f"Error creating thumbnail for {image_path}: {e}") from e
+                THUMBNAIL_RENDER_SECONDS.observe(time.perf_counter() - started, format=fmt)
+                if self.on_render is not None:
+                    self.on_render(image_path, thumbnail_path, nbytes)
+        finally:
+            if lock is not None:
+                lock.release()
+
+    async def _encoder_slot(self) -> Optional[FileLock]:
+        """Take a free encoder slot shared with the other processes, waiting while all are taken."""
+        if not self._encoder_locks:
+            return None
+        while True:
+            for lock in self._encoder_locks:
+                if lock.acquire(blocking=False):
+                    return lock
+            await asyncio.sleep(RENDER_LOCK_POLL_INTERVAL)
+
+    async def _submit(self, fn: Callable, *args):
+        slot = await self._encoder_slot()
+        try:
+            return await self._submit_to_pool(fn, *args)
+        finally:
+            if slot is not None:
+                slot.release()
+
+    async def _submit_to_pool(self, fn: Callable, *args):
+        self.start()
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # Every job on a broken pool fails at once; only the first to
+            # notice replaces it, the others retry on the new pool
+            if self._pool is pool:
+                logger.warning("Thumbnail process pool broke, restarting it")
+                self.shutdown()
+                self.start()
+            try:
+                return await loop.run_in_executor(self._pool, fn, *args)
+            except BrokenProcessPool as e:
+                raise ThumbnailError(f"Thumbnail process pool broke again: {e}") from e
+
+    async def run(self, fn: Callable, *args):
+        """Run other image work in the pool, sharing its slots with thumbnails."""
+        async with self._slots:
+            return await self._submit(fn, *args)
+
+class PrewarmJob:
+    """Generates every missing thumbnail in the index, newest photos first.
+
+    Only thumbnails that don't exist yet are rendered and every write is
+    atomic, so an interrupted run simply resumes where it stopped when
+    started again.
+    """
+
+    def __init__(
+        self,
+        generator: ThumbnailGenerator,
+        index: PhotoIndex,
+        thumbnail_path_for: Callable[[Path], Path],
+        concurrency: Optional[int] = None
+    ):
+        self.generator = generator
+        self.index = index
+        self.thumbnail_path_for = thumbnail_path_for
+        # Leave pool slots free so request-path thumbnails aren't starved
+        self.concurrency = concurrency or generator.max_workers
+        self.status = "idle"
+        self.total = 0
+        self.generated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Start the job in the background unless it is already running."""
+        if not self.running:
+            self.status = "running"
+            self._task = asyncio.create_task(self.run())
+
+    async def cancel(self) -> None:
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def _missing(self) -> List[Tuple[Path, Path]]:
+        names, _ = self.index.page()
+        missing = []
+        for name in names:
+            original_path = self.index.photo_dir / name
+            try:
+                thumbnail_path = self.thumbnail_path_for(original_path)
+            except OSError:
+                # Deleted since it was indexed
+                continue
+            if not thumbnail_path.exists():
+                missing.append((original_path, thumbnail_path))
+        return missing
+
+    async def run(self) -> None:
+        self.status = "running"
+        self.generated = self.skipped = self.failed = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        try:
+            missing = await asyncio.to_thread(self._missing)
+            self.total = len(missing)
+            self.skipped = len(self.index) - self.total
+            remaining = iter(missing)
+
+            async def worker():
+                for original_path, thumbnail_path in remaining:
+                    try:
+                        await self.generator.ensure(original_path, thumbnail_path, block=True)
+                        self.generated += 1
+                    except ThumbnailError as e:
+                        logger.warning(str(e))
+                        self.failed += 1
+
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+            self.status = "done"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Thumbnail prewarm failed: {e}")
+            self.status = "failed"
+        finally:
+            self.finished_at = time.monotonic()
+            if self.status == "done":
+                logger.info(
+                    f"Thumbnail prewarm finished: {self.generated} generated, {self.failed} failed "
+                    f"in {self.finished_at - self.started_at:.1f}s"
+                )
+
+    def progress(self) -> dict:
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        processed = self.generated + self.failed
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - processed
+        return {
+            "status": self.status,
+            "total": self.total,
+            "generated": self.generated,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "elapsed_seconds": round(elapsed, 2),
+            "images_per_second": round(rate, 2),
+            "eta_seconds": round(remaining / rate, 1) if rate > 0 and self.status == "running" else None,
+        }
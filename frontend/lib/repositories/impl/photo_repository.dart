@@ -15,6 +15,10 @@ class PhotoRepository implements IPhotoRepository {
   final ICacheService cacheService;
   final int maxRetries;
   final Duration timeout;
+  // How often, and for how long, to check that a queued generation reached
+  // InvokeAI before reporting it as started
+  final Duration generationPollInterval;
+  final Duration generationDispatchTimeout;
   @override
   final String baseUrl = 'http://47.151.18.30:8000'; // TODO: Move to config
 
@@ -23,6 +27,8 @@ class PhotoRepository implements IPhotoRepository {
     required this.cacheService,
     this.maxRetries = 3,
     this.timeout = const Duration(seconds: 10),
+    this.generationPollInterval = const Duration(seconds: 1),
+    this.generationDispatchTimeout = const Duration(minutes: 2),
   });
 
   Future<T> _withRetry<T>(Future<T> Function() operation) async {
@@ -165,7 +171,11 @@ class PhotoRepository implements IPhotoRepository {
         }),
       );
 
-      if (generationResponse.statusCode != 200 &&
+      if (generationResponse.statusCode == 202) {
+        // Queued on the server; it is sent to InvokeAI shortly after
+        final jobId = json.decode(generationResponse.body)['job_id'];
+        await _waitForDispatch(jobId);
+      } else if (generationResponse.statusCode != 200 &&
           generationResponse.statusCode != 201) {
         throw Exception('Failed to generate: ${generationResponse.statusCode}');
       }
@@ -173,4 +183,30 @@ class PhotoRepository implements IPhotoRepository {
       throw Exception('Generation error: $e');
     }
   }
+
+  /// Polls a queued generation job until InvokeAI accepted it.
+  ///
+  /// Throws if the server reports that sending it failed. A job still
+  /// waiting in the server's queue after [generationDispatchTimeout] is left
+  /// to run and treated as started.
+  Future<void> _waitForDispatch(String jobId) async {
+    final deadline = DateTime.now().add(generationDispatchTimeout);
+    while (DateTime.now().isBefore(deadline)) {
+      final statusResponse = await client.get(
+        Uri.parse('$baseUrl/api/generate/$jobId'),
+      );
+      if (statusResponse.statusCode != 200) {
+        throw Exception(
+            'Failed to get generation status: ${statusResponse.statusCode}');
+      }
+      final status = json.decode(statusResponse.body);
+      if (status['status'] == 'failed') {
+        throw Exception('Failed to generate: ${status['error']}');
+      }
+      if (status['status'] != 'queued_locally') {
+        return;
+      }
+      await Future.delayed(generationPollInterval);
+    }
+  }
 }
@@ -260,6 +260,83 @@ void main() {
       );
     });
 
+    test('should wait for a queued job to be dispatched', () async {
+      // Arrange
+      photoRepository = PhotoRepository(
+        client: mockHttpClient,
+        cacheService: mockCacheService,
+        generationPollInterval: Duration.zero,
+      );
+      when(mockHttpClient.get(Uri.parse('$baseUrl/api/metadata/$sourcePhoto')))
+          .thenAnswer(
+              (_) async => http.Response(jsonEncode(mockMetadata), 200));
+
+      when(mockHttpClient.post(
+        Uri.parse('$baseUrl/api/generate'),
+        headers: {'Content-Type': 'application/json'},
+        body: anyNamed('body'),
+      )).thenAnswer((_) async => http.Response('{"job_id": "job1"}', 202));
+
+      final statuses = ['queued_locally', 'enqueued'];
+      when(mockHttpClient.get(Uri.parse('$baseUrl/api/generate/job1')))
+          .thenAnswer((_) async => http.Response(
+              jsonEncode({'job_id': 'job1', 'status': statuses.removeAt(0)}),
+              200));
+
+      // Act
+      await photoRepository.generatePhotos(
+        sourcePhoto: sourcePhoto,
+        additionalPrompt: '',
+        count: 1,
+      );
+
+      // Assert
+      verify(mockHttpClient.get(Uri.parse('$baseUrl/api/generate/job1')))
+          .called(2);
+    });
+
+    test('should throw exception when a queued job fails to dispatch',
+        () async {
+      // Arrange
+      photoRepository = PhotoRepository(
+        client: mockHttpClient,
+        cacheService: mockCacheService,
+        generationPollInterval: Duration.zero,
+      );
+      when(mockHttpClient.get(Uri.parse('$baseUrl/api/metadata/$sourcePhoto')))
+          .thenAnswer(
+              (_) async => http.Response(jsonEncode(mockMetadata), 200));
+
+      when(mockHttpClient.post(
+        Uri.parse('$baseUrl/api/generate'),
+        headers: {'Content-Type': 'application/json'},
+        body: anyNamed('body'),
+      )).thenAnswer((_) async => http.Response('{"job_id": "job1"}', 202));
+
+      when(mockHttpClient.get(Uri.parse('$baseUrl/api/generate/job1')))
+          .thenAnswer((_) async => http.Response(
+              jsonEncode({
+                'job_id': 'job1',
+                'status': 'failed',
+                'error': 'InvokeAI unavailable',
+              }),
+              200));
+
+      // Act & Assert
+      expect(
+        () => photoRepository.generatePhotos(
+          sourcePhoto: sourcePhoto,
+          additionalPrompt: '',
+          count: 1,
+        ),
+        throwsA(isA<Exception>().having(
+          (e) => e.toString(),
+          'message',
+          contains('InvokeAI unavailable'),
+        )),
+      );
+    });
+
     test('should include additional prompt in generation request', () async {
       // Arrange
       when(mockHttpClient.get(Uri.parse('$baseUrl/api/metadata/$sourcePhoto')))